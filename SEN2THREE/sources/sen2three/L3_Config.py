@@ -4,9 +4,17 @@ from numpy import *
 import sys, os, time, fnmatch
 import logging, inspect
 import ConfigParser
+import json
 from lxml import etree, objectify
 from time import strftime
 from datetime import datetime, date
+from multiprocessing import cpu_count
+from threading import RLock
+try:
+    import fcntl
+except ImportError:
+    # not available on windows:
+    fcntl = None
 
 from L3_Borg import Borg
 from L3_Library import stdoutWrite, stderrWrite
@@ -35,6 +43,9 @@ class L3_Config(Borg):
 
     '''
     _shared = {}
+    # listings of the source directories, shared by all resolutions, path: (modification time, listing):
+    _inventory = {}
+
     def __init__(self, resolution, sourceDir=None, configFile='L3_GIPP'):
 
         if (sourceDir):
@@ -112,8 +123,28 @@ class L3_Config(Borg):
             self._maxAerosolOpticalThickness = None
             self._maxSolarZenithAngle = None
             self._medianFilter = None
+            self._medianFilterMethod = 'NDIMAGE'
+            self._nrThreads = 1
+            self._nrProcesses = 1
+            self._lock = RLock()
+            self._chunkCacheSize = 16
+            self._compression = 'ZLIB'
+            self._compressionLevel = 1
+            self._compressionShuffle = 'SHUFFLE'
+            self._bandDerivation = 'NONE'
+            self._inventoryCache = False
             self._targetDir = None
             self._cleanTarget = False
+            self._singlePass = False
+            self._historyTiles = set()
+            self._historyCount = {}
+            self._historySize = 0
+            self._historyFn = None
+            # progress since the last update of the status file, updated at most every Progress_Interval [s]:
+            self._progressBase = 0.0
+            self._progressPending = 0.0
+            self._progressFlushed = None
+            self._progressInterval = 2.0
             self._c0 = None
             self._c1 = None
             self._e0 = None
@@ -291,6 +322,18 @@ class L3_Config(Borg):
         del self._cleanTarget
 
 
+    def get_single_pass(self):
+        return self._singlePass
+
+
+    def set_single_pass(self, value):
+        self._singlePass = value
+
+
+    def del_single_pass(self):
+        del self._singlePass
+
+
     def get_median_filter(self):
         return self._medianFilter
 
@@ -302,6 +345,114 @@ class L3_Config(Borg):
     def del_median_filter(self):
         del self._medianFilter
 
+    def get_median_filter_method(self):
+        return self._medianFilterMethod
+
+    def set_median_filter_method(self, value):
+        self._medianFilterMethod = value
+
+    def del_median_filter_method(self):
+        del self._medianFilterMethod
+
+
+    def get_nr_threads(self):
+        return self._nrThreads
+
+
+    def set_nr_threads(self, value):
+        self._nrThreads = value
+
+
+    def del_nr_threads(self):
+        del self._nrThreads
+
+
+    def get_nr_processes(self):
+        return self._nrProcesses
+
+
+    def set_nr_processes(self, value):
+        self._nrProcesses = value
+
+
+    def del_nr_processes(self):
+        del self._nrProcesses
+
+
+    def get_lock(self):
+        return self._lock
+
+
+    def set_lock(self, value):
+        self._lock = value
+
+
+    def del_lock(self):
+        del self._lock
+
+    def get_chunk_cache_size(self):
+        return self._chunkCacheSize
+
+    def set_chunk_cache_size(self, value):
+        self._chunkCacheSize = value
+
+    def del_chunk_cache_size(self):
+        del self._chunkCacheSize
+
+    def get_compression(self):
+        return self._compression
+
+    def set_compression(self, value):
+        self._compression = value
+
+    def del_compression(self):
+        del self._compression
+
+    def get_compression_level(self):
+        return self._compressionLevel
+
+    def set_compression_level(self, value):
+        self._compressionLevel = value
+
+    def del_compression_level(self):
+        del self._compressionLevel
+
+    def get_compression_shuffle(self):
+        return self._compressionShuffle
+
+    def set_compression_shuffle(self, value):
+        self._compressionShuffle = value
+
+    def del_compression_shuffle(self):
+        del self._compressionShuffle
+
+    def get_band_derivation(self):
+        return self._bandDerivation
+
+    def set_band_derivation(self, value):
+        self._bandDerivation = value
+
+    def del_band_derivation(self):
+        del self._bandDerivation
+
+    def get_inventory_cache(self):
+        return self._inventoryCache
+
+    def set_inventory_cache(self, value):
+        self._inventoryCache = value
+
+    def del_inventory_cache(self):
+        del self._inventoryCache
+
+    def get_progress_interval(self):
+        return self._progressInterval
+
+    def set_progress_interval(self, value):
+        self._progressInterval = value
+
+    def del_progress_interval(self):
+        del self._progressInterval
+
     def get_rad_scale(self):
         return self._radScale
 
@@ -1235,6 +1386,17 @@ class L3_Config(Borg):
     classifier = property(get_classifier, set_classifier, del_classifier)
     tileFilter = property(get_tile_filter, set_tile_filter, del_tile_filter)
     medianFilter = property(get_median_filter, set_median_filter, del_median_filter)
+    medianFilterMethod = property(get_median_filter_method, set_median_filter_method, del_median_filter_method)
+    nrThreads = property(get_nr_threads, set_nr_threads, del_nr_threads)
+    nrProcesses = property(get_nr_processes, set_nr_processes, del_nr_processes)
+    lock = property(get_lock, set_lock, del_lock)
+    chunkCacheSize = property(get_chunk_cache_size, set_chunk_cache_size, del_chunk_cache_size)
+    compression = property(get_compression, set_compression, del_compression)
+    compressionLevel = property(get_compression_level, set_compression_level, del_compression_level)
+    compressionShuffle = property(get_compression_shuffle, set_compression_shuffle, del_compression_shuffle)
+    bandDerivation = property(get_band_derivation, set_band_derivation, del_band_derivation)
+    inventoryCache = property(get_inventory_cache, set_inventory_cache, del_inventory_cache)
+    progressInterval = property(get_progress_interval, set_progress_interval, del_progress_interval)
     home = property(get_home, set_home, del_home)
     sourceDir = property(get_source_dir, set_source_dir, del_source_dir)
     configDir = property(get_config_dir, set_config_dir, del_config_dir)
@@ -1257,6 +1419,7 @@ class L3_Config(Borg):
     L2A_WVP_QUANTIFICATION_VALUE = property(get_l_2_a_wvp_quantification_value, set_l_2_a_wvp_quantification_value, del_l_2_a_wvp_quantification_value)
     L2A_AOT_QUANTIFICATION_VALUE = property(get_l_2_a_aot_quantification_value, set_l_2_a_aot_quantification_value, del_l_2_a_aot_quantification_value)
     cleanTarget = property(get_clean_target, set_clean_target, del_clean_target)
+    singlePass = property(get_single_pass, set_single_pass, del_single_pass)
     dnScale = property(get_dn_scale, set_dn_scale, del_dn_scale)
     radScale = property(get_rad_scale, set_rad_scale, del_rad_scale)
     timestamp = property(get_timestamp, set_timestamp, del_timestamp)
@@ -1342,6 +1505,56 @@ class L3_Config(Borg):
             self._logger.fatal('Error in parsing configuration file.')
             self.exitError();
 
+        # optional parameters, defaults are kept if not present:
+        try:
+            nrThreads = cs.Nr_Threads.text
+            if nrThreads == 'AUTO':
+                self._nrThreads = cpu_count()
+            else:
+                self._nrThreads = max(1, int(nrThreads))
+        except AttributeError:
+            pass
+        except ValueError:
+            self._logger.error('Nr_Threads must be AUTO or a positive integer, will be ignored.')
+        try:
+            nrProcesses = cs.Nr_Processes.text
+            if nrProcesses == 'AUTO':
+                self._nrProcesses = cpu_count()
+            else:
+                self._nrProcesses = max(1, int(nrProcesses))
+        except AttributeError:
+            pass
+        except ValueError:
+            self._logger.error('Nr_Processes must be AUTO or a positive integer, will be ignored.')
+        try:
+            self._chunkCacheSize = max(1, cs.Chunk_Cache_Size.pyval)
+        except AttributeError:
+            pass
+        try:
+            self._compression = cs.Compression.text
+            self._compressionLevel = cs.Compression.attrib.get('level', self._compressionLevel)
+            self._compressionLevel = min(9, max(0, int(self._compressionLevel)))
+            self._compressionShuffle = cs.Compression.attrib.get('shuffle', self._compressionShuffle)
+        except AttributeError:
+            pass
+        except ValueError:
+            self._logger.error('Compression level must be an integer from 0 to 9, will be ignored.')
+            self._compressionLevel = 1
+        try:
+            self._bandDerivation = cs.Band_Derivation.text
+        except AttributeError:
+            pass
+        try:
+            self._inventoryCache = cs.Inventory_Cache.pyval
+        except AttributeError:
+            pass
+        try:
+            self._progressInterval = max(0.0, float(cs.Progress_Interval.text))
+        except AttributeError:
+            pass
+        except ValueError:
+            self._logger.error('Progress_Interval must be a number of seconds, will be ignored.')
+
         try:
             self._displayData = cs.Display_Data
             l3s = root.L3_Synthesis
@@ -1377,6 +1590,10 @@ class L3_Config(Borg):
         except:
             self._logger.fatal('Error in parsing configuration file.')
             self.exitError();
+        try:
+            self._medianFilterMethod = root.L3_Synthesis.Median_Filter_Method.text
+        except AttributeError:
+            pass
         return True
 
     def init(self, processorVersion):
@@ -1407,6 +1624,9 @@ class L3_Config(Borg):
         except:
             self.exitError('cannot create process status file: %s\n' % self.processingStatusFn)
             return
+        self._progressBase = 0.0
+        self._progressPending = 0.0
+        self._progressFlushed = None
 
         factor = self.getNrTilesToProcess()
 
@@ -1415,7 +1635,10 @@ class L3_Config(Borg):
         self._tEst60 = config.getfloat('time estimation','t_est_60') * factor
         self._tEst20 = config.getfloat('time estimation','t_est_20') * factor
         self._tEst10 = config.getfloat('time estimation','t_est_10') * factor
-        if(resolution == 60):
+        if self._singlePass:
+            # all resolutions are processed in one pass over the products:
+            self._tEstimation = self._tEst60 + self._tEst20 + self._tEst10
+        elif(resolution == 60):
             self._tEstimation = self._tEst60
         elif(resolution == 20):
             self._tEstimation = self._tEst20
@@ -1431,7 +1654,8 @@ class L3_Config(Borg):
             :rtype: unsigned int
 
         '''
-        upList = sorted(os.listdir(self.sourceDir))
+        self.scanSource()
+        upList = self.listSource(self.sourceDir)
         tileFilter = self.tileFilter
         L2A_mask = '*_MSIL2A_*'
         nrTiles = 0
@@ -1447,7 +1671,7 @@ class L3_Config(Borg):
                 L2A_mask = '*_MSI_L2A_*'
             else:
                 L2A_mask = 'L2A_*'
-            tilelist = sorted(os.listdir(GRANULE))
+            tilelist = self.listSource(GRANULE)
             for tile in tilelist:
                 # process only L2A tiles:
                 if not fnmatch.fnmatch(tile, L2A_mask):
@@ -1464,6 +1688,85 @@ class L3_Config(Borg):
 
         return nrTiles
 
+    def listSource(self, path):
+        ''' Get the sorted listing of a directory of the source products from the inventory.
+            The directory is only listed again if its modification time changed.
+
+            :param path: the directory.
+            :type path: str
+            :return: the names of the directory entries.
+            :rtype: list of str
+
+        '''
+        # raises OSError, if not present, as os.listdir:
+        mtime = os.stat(path).st_mtime
+        entry = L3_Config._inventory.get(path)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, sorted(os.listdir(path)))
+            L3_Config._inventory[path] = entry
+        return entry[1]
+
+    def readInventory(self, inventoryFn):
+        ''' Read the inventory stored by a previous run. The inventory is only used for
+            the same source directory, its entries are validated by listSource.
+
+            :param inventoryFn: the file name of the stored inventory.
+            :type inventoryFn: str
+            :return: the inventory, empty if not present or not valid.
+            :rtype: dict
+
+        '''
+        try:
+            with open(inventoryFn, 'r') as f:
+                stored = json.load(f)
+            if stored['sourceDir'] != self.sourceDir:
+                return {}
+            # the names are read as unicode strings:
+            return dict((path.encode('utf-8'), (float(mtime), [name.encode('utf-8') for name in names]))
+                        for path, (mtime, names) in stored['inventory'].items())
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return {}
+
+    def scanSource(self):
+        ''' Scan the source directory in one pass: the user products, their tiles and the band
+            directories of all resolutions are listed into the inventory, which is then used by the
+            time estimation and by the processing loops of all resolutions. If Inventory_Cache is
+            configured, the inventory is stored in the log directory and reused by the next run.
+            The source directory is not written.
+        '''
+        inventoryFn = os.path.join(self._logDir, '.inventory.json')
+        if self.inventoryCache and not L3_Config._inventory:
+            L3_Config._inventory = self.readInventory(inventoryFn)
+
+        scanned = [self.sourceDir]
+        for L2A_UP_ID in self.listSource(self.sourceDir):
+            if not fnmatch.fnmatch(L2A_UP_ID, '*_MSIL2A_*'):
+                continue
+            GRANULE = os.path.join(self.sourceDir, L2A_UP_ID, 'GRANULE')
+            try:
+                tilelist = self.listSource(GRANULE)
+            except OSError:
+                continue
+            scanned.append(GRANULE)
+            for tile in tilelist:
+                L2A_ImgDataDir = os.path.join(GRANULE, tile, 'IMG_DATA')
+                for path in [L2A_ImgDataDir] + [os.path.join(L2A_ImgDataDir, 'R%dm' % r) for r in [10, 20, 60]]:
+                    try:
+                        self.listSource(path)
+                    except OSError:
+                        continue
+                    scanned.append(path)
+
+        # entries of removed directories are dropped:
+        L3_Config._inventory = dict((path, L3_Config._inventory[path]) for path in scanned)
+        if self.inventoryCache:
+            try:
+                with open(inventoryFn, 'w') as f:
+                    json.dump({'sourceDir': self.sourceDir, 'inventory': L3_Config._inventory}, f)
+            except (IOError, UnicodeDecodeError):
+                self.logger.warning('Inventory of the source directory could not be stored in: ' + inventoryFn)
+        return
+
     def writeTimeEstimation(self, resolution, tMeasure):
         ''' Store the time estimation for the current processing.
 
@@ -1473,26 +1776,27 @@ class L3_Config(Borg):
             :type tMeasure: float 32
             
         '''
-        config = ConfigParser.RawConfigParser()
-        config.read(self._processingEstimationFn)
-
-        if(self.resolution == 60):
-            tEst = config.getfloat('time estimation','t_est_60')
-            tMeasureAsString = str((tEst + tMeasure) / 2.0 )
-            config.set('time estimation','t_est_60', tMeasureAsString)
-
-        elif(self.resolution == 20):
-            tEst = config.getfloat('time estimation','t_est_20')
-            tMeasureAsString = str((tEst + tMeasure) / 2.0 )
-            config.set('time estimation','t_est_20', tMeasureAsString)
-
-        elif(self.resolution == 10):
-            tEst = config.getfloat('time estimation','t_est_10')
-            tMeasureAsString = str((tEst + tMeasure) / 2.0 )
-            config.set('time estimation','t_est_10', tMeasureAsString)
-
-        with open(self._processingEstimationFn, 'w') as configFile:
-            config.write(configFile)
+        with self._lock:
+            config = ConfigParser.RawConfigParser()
+            config.read(self._processingEstimationFn)
+
+            if(self.resolution == 60):
+                tEst = config.getfloat('time estimation','t_est_60')
+                tMeasureAsString = str((tEst + tMeasure) / 2.0 )
+                config.set('time estimation','t_est_60', tMeasureAsString)
+
+            elif(self.resolution == 20):
+                tEst = config.getfloat('time estimation','t_est_20')
+                tMeasureAsString = str((tEst + tMeasure) / 2.0 )
+                config.set('time estimation','t_est_20', tMeasureAsString)
+
+            elif(self.resolution == 10):
+                tEst = config.getfloat('time estimation','t_est_10')
+                tMeasureAsString = str((tEst + tMeasure) / 2.0 )
+                config.set('time estimation','t_est_10', tMeasureAsString)
+
+            with open(self._processingEstimationFn, 'w') as configFile:
+                config.write(configFile)
         return
 
     def timestamp(self, procedure):
@@ -1512,21 +1816,48 @@ class L3_Config(Borg):
         if self._tEstimation == 0:
             self._tEstimation = 1.0
         increment = tDelta.total_seconds() / self._tEstimation
-        f = open(self._processingStatusFn, 'r')
-        tTotal = float(f.readline()) * 0.01
-        f.close()
-        tTotal += increment
+        # the status file is shared with the other processes of the tile parallel processing,
+        # it is updated at most every progress interval:
+        with self._lock:
+            self._progressPending += increment
+            if self._progressFlushed is None or \
+                (tNow - self._progressFlushed).total_seconds() >= self._progressInterval:
+                self.flushProgress()
+            tWeighted = self.weightProgress(self._progressBase + self._progressPending)
+            stdoutWrite('Progress[%%]: %03.2f : ' % tWeighted)
+        return
+
+    def weightProgress(self, tTotal):
+        ''' Get the progress in percent, approaching 100 if the time estimation is exceeded.
+
+            :param tTotal: the fraction of the estimated processing time.
+            :type tTotal: float
+            :return: the progress in percent.
+            :rtype: float
+
+        '''
         if tTotal > 1.0:
-            tWeighted = 100.0 - exp(-tTotal)
+            return 100.0 - exp(-tTotal)
         elif tTotal > 0.98:
-            tWeighted = tTotal * 100.0 - exp(-tTotal)
+            return tTotal * 100.0 - exp(-tTotal)
         else:
-            tWeighted = tTotal * 100.0
+            return tTotal * 100.0
 
-        stdoutWrite('Progress[%%]: %03.2f : ' % tWeighted)
-        f = open(self._processingStatusFn, 'w')
-        f.write(str(tWeighted) + '\n')
-        f.close()
+    def flushProgress(self):
+        ''' Add the progress accumulated since the last update to the status file.
+            Called by timestamp and at the end of the processing of a worker process or resolution.
+        '''
+        with self._lock:
+            f = open(self._processingStatusFn, 'r')
+            tTotal = float(f.readline()) * 0.01
+            f.close()
+            tWeighted = self.weightProgress(tTotal + self._progressPending)
+            f = open(self._processingStatusFn, 'w')
+            f.write(str(tWeighted) + '\n')
+            f.close()
+            self._progressBase = tWeighted * 0.01
+            self._progressPending = 0.0
+            self._progressFlushed = datetime.now()
         return
 
     def checkTimeRange(self, userProduct):
@@ -1866,29 +2197,73 @@ class L3_Config(Borg):
             else:
                 return False
 
-    def getNrTilesProcessed(self):
-        ''' Get the number of processed tiles.
+    def getHistoryId(self, tileId):
+        ''' Get the identifier of a tile in the product history.
 
-            :return: number of processed tiles.
-            :rtype: unsigned int
+            :param tileId: the tile identifier.
+            :type tileId: str
+            :return: the identifier of the tile and resolution in the product history.
+            :rtype: str
 
         '''
-
-        tileId = self.L2A_TILE_ID.split('_')
+        tileId = tileId.split('_')
         if len(tileId) == 4:
-            tileId = tileId[3] + '_' + tileId[1] + '_' + str(self.resolution)
+            return tileId[3] + '_' + tileId[1] + '_' + str(self.resolution)
         else:
-            tileId = tileId[7] + '_' + tileId[9] + '_' + str(self.resolution)
+            return tileId[7] + '_' + tileId[9] + '_' + str(self.resolution)
+
+    def readHistory(self):
+        ''' Update the product history in memory from the history file. As the file is append only,
+            only the entries appended since the last call are read, including those of other processes.
+            If the file was removed or truncated, or the source directory changed, the history is read
+            again completely.
+        '''
         processedFn = os.path.join(self.sourceDir, 'processed')
+        with self._lock:
+            try:
+                size = os.path.getsize(processedFn)
+            except OSError:
+                size = 0
+            if processedFn != self._historyFn or size < self._historySize:
+                self._historyFn = processedFn
+                self._historyTiles = set()
+                self._historyCount = {}
+                self._historySize = 0
+            if size == self._historySize:
+                return
+            try:
+                f = open(processedFn, 'r')
+                f.seek(self._historySize)
+                processedTiles = f.read(size - self._historySize)
+                f.close()
+            except IOError:
+                return
+            # an incomplete last entry is read with the next call:
+            end = processedTiles.rfind('\n') + 1
+            for tileId in processedTiles[:end].split():
+                if tileId.startswith('SKIPPED:'):
+                    # skipped tiles are not processed again, but have no mosaic number:
+                    self._historyTiles.add(tileId[8:])
+                    continue
+                self._historyTiles.add(tileId)
+                # tile and resolution:
+                tileIdSub = tileId[-9:]
+                self._historyCount[tileIdSub] = self._historyCount.get(tileIdSub, 0) + 1
+            self._historySize += end
+        return
 
-        tileIdSub = tileId[-9:]
-        try:  # read list already processed same tiles of same resolution
-            f = open(processedFn, 'r')
-            processedTiles = f.read()
-            f.close()
-            return processedTiles.count(tileIdSub)
-        except:
-            return 0
+    def getNrTilesProcessed(self):
+        ''' Get the number of processed tiles. Skipped tiles are not counted,
+            thus the mosaic numbers of the processed tiles are consecutive.
+
+            :return: number of processed tiles.
+            :rtype: unsigned int
+
+        '''
+
+        tileIdSub = self.getHistoryId(self.L2A_TILE_ID)[-9:]
+        self.readHistory()
+        return self._historyCount.get(tileIdSub, 0)
 
     def tileExists(self, tileId):
         ''' Check if a tile is present in the product history.
@@ -1900,43 +2275,34 @@ class L3_Config(Borg):
 
         '''
 
-        tileId = tileId.split('_')
-        if len(tileId) == 4:
-            tileId = tileId[3] + '_' + tileId[1] + '_' + str(self.resolution)
-        else:
-            tileId = tileId[7] + '_' + tileId[9] + '_' + str(self.resolution)
-        processedFn = os.path.join(self.sourceDir, 'processed')
-
-        try:  # read list of tiles already processed
-            f = open(processedFn, 'r')
-            processedTiles = f.read()
-            if tileId in processedTiles:
-                return True
-        except:
-            pass
-
-        return False
+        self.readHistory()
+        return self.getHistoryId(tileId) in self._historyTiles
 
-    def appendTile(self):
+    def appendTile(self, skipped=False):
         ''' Append a tile to the product history.
 
+            :param skipped: true, if the tile was skipped as it cannot improve the mosaic.
+            :type skipped: boolean
             :return: true, if operation successful.
             :rtype: boolean
 
         '''
-        tileId = self.L2A_TILE_ID.split('_')
-        if len(tileId) == 4:
-            tileId = tileId[3] + '_' + tileId[1] + '_' + str(self.resolution)
-        else:
-            tileId = tileId[7] + '_' + tileId[9] + '_' + str(self.resolution)
-        processedTile = tileId + '\n'
+        processedTile = self.getHistoryId(self.L2A_TILE_ID) + '\n'
+        if skipped:
+            processedTile = 'SKIPPED:' + processedTile
         processedFn = os.path.join(self.sourceDir, 'processed')
 
         try:
-            f = open(processedFn, 'a')
-            f.write(processedTile)
-            f.flush()
-            f.close()
+            # the history is shared with the other processes of the tile parallel processing:
+            with self._lock:
+                f = open(processedFn, 'a')
+                if fcntl is not None:
+                    # and with other instances of the processor:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                f.write(processedTile)
+                f.flush()
+                f.close()
+                self.readHistory()
         except:
             stderrWrite('Could not update processed tile history.\n')
             self.exitError()
@@ -1998,7 +2364,18 @@ class L3_Config(Borg):
         fmB02 = '*_B02_*.jp2'
         fmSCL = '*_SCL_*.jp2'
         fmAOT = '*_AOT_*.jp2'
-        dirs = sorted(os.listdir(L2A_BandDir))
+        # with band derivation, missing bands can be derived from the finer resolutions:
+        bandDirs = [L2A_BandDir]
+        if self.bandDerivation != 'NONE':
+            for resolution in [20, 10]:
+                if resolution < self.resolution:
+                    bandDirs.append(os.path.join(L2A_ImgDataDir, 'R%dm' % resolution))
+        dirs = []
+        for L2A_BandDir in bandDirs:
+            try:
+                dirs += self.listSource(L2A_BandDir)
+            except OSError:
+                pass
         for filename in dirs:
             if fnmatch.fnmatch(filename, fmB02) == True:
                 B02_OK = True
@@ -2023,7 +2400,7 @@ class L3_Config(Borg):
             if self.namingConvention == 'SAFE_COMPACT':
                 test = SCL_OK
             else: # for SAFE_STANDARD scene classification is in IMG_DATA folder:
-                dirs = sorted(os.listdir(L2A_ImgDataDir))
+                dirs = self.listSource(L2A_ImgDataDir)
                 for filename in dirs:
                     if fnmatch.fnmatch(filename, fmSCL) == True:
                         test = True
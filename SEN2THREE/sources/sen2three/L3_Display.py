@@ -9,8 +9,6 @@ plt.ioff()
 import matplotlib.colors as cl
 import pylab as P
 
-from scipy.stats import itemfreq
-
 class L3_Display(object):
     ''' A support class, for display of the scene classification and the mosaic map 
         using the Python Image Library (PIL). The display of the data is a configurable option.
@@ -73,18 +71,17 @@ class L3_Display(object):
         ax3 = self._plot.subplot2grid((2,2), (0,1))
         ax4 = self._plot.subplot2grid((2,2), (1,1))            
         
-        idxMoif = itemfreq(mosaic)[:,0]
-        nClasses = idxMoif.max()
+        # the histograms are collected in one pass over the row blocks:
+        histMoif = tables.getClassHistogram('L3', tables.MSC)
+        nClasses = nonzero(histMoif)[0].max()
         xMoif = arange(0,nClasses+1)
-        yMoif = zeros(nClasses+1, dtype=float32)
-        yMoif[idxMoif] = itemfreq(mosaic)[:,1]
+        yMoif = histMoif[:nClasses+1].astype(float32)
         yMoifCount = float32(yMoif.sum())
         yMoif = yMoif.astype(float32)/yMoifCount * 100.0
-        scenecData = [scenec != 0]
         classes = ('Sat','Dark','ClS','Soil','Veg','Water','LPC','MPC','HPC','Cir','Snw')
-        yScif = zeros(len(classes)+1, dtype=float32)
-        idxScif = itemfreq(scenec[scenecData])[:,0]
-        yScif[idxScif] = itemfreq(scenec[scenecData])[:,1]
+        histScif = tables.getClassHistogram('L3', tables.SCL)
+        histScif[0] = 0
+        yScif = histScif[:len(classes)+1].astype(float32)
         yScifCount = float32(yScif.sum())
         yScif = yScif.astype(float32)/yScifCount * 100.0
         xScif = arange(1,13)                
@@ -2,8 +2,7 @@
 # -*- coding: iso-8859-15 -*-
 
 from numpy import *
-from scipy import interpolate as sp
-from PIL import Image
+from multiprocessing.pool import ThreadPool
 import sys
 
 def stdoutWrite(s):
@@ -48,6 +47,7 @@ def showImage(arr):
         :rtype: boolean
 
     """
+    from PIL import Image
     if(arr.ndim) != 2:
         sys.stderr.write('Must be a two dimensional array.\n')
         return False
@@ -68,8 +68,144 @@ def reverse(a): return a[::-1]
 
 
 def rectBivariateSpline(xIn, yIn, zIn):
+    from scipy import interpolate as sp
     x = arange(zIn.shape[0], dtype=float32)
     y = arange(zIn.shape[1], dtype=float32)
 
     f = sp.RectBivariateSpline(x,y,zIn)
     return f(xIn,yIn)
+
+
+def medianNetwork(n):
+    """ Generates a selection network for the median of n values, n odd.
+        The network is derived from Batcher's odd-even merge sort on the next power of 2,
+        with the missing inputs set to infinity. Only the comparators, on which the median
+        depends, are kept, and of these only the minimum or maximum, which is needed.
+
+        :param n: the number of values.
+        :type n: unsigned int
+        :return: the operations (input a, input b, output of minimum, output of maximum)
+            on the variables 0 ... n-1 and the following intermediate ones, and the output variable.
+            Unused outputs are None.
+        :rtype: tuple (list, int)
+
+    """
+    size = 1
+    while size < n:
+        size *= 2
+    comparators = []
+
+    def merge(lo, length, r):
+        step = r * 2
+        if step < length:
+            merge(lo, length, step)
+            merge(lo + r, length, step)
+            for i in range(lo + r, lo + length - r, step):
+                comparators.append((i, i + r))
+        else:
+            comparators.append((lo, lo + r))
+
+    def sort(lo, length):
+        if length > 1:
+            m = length / 2
+            sort(lo, m)
+            sort(lo + m, m)
+            merge(lo, length, 1)
+
+    sort(0, size)
+    # forward pass, skipping all comparators with infinite inputs:
+    inf = -1
+    wires = range(n) + [inf] * (size - n)
+    nextVar = n
+    ops = []
+    for i, j in comparators:
+        a = wires[i]
+        b = wires[j]
+        if b == inf:
+            continue
+        if a == inf:
+            wires[i] = b
+            wires[j] = inf
+            continue
+        ops.append([a, b, nextVar, nextVar + 1])
+        wires[i] = nextVar
+        wires[j] = nextVar + 1
+        nextVar += 2
+    # backward pass, keeping only the outputs the median depends on:
+    result = wires[n / 2]
+    needed = set([result])
+    network = []
+    for op in reversed(ops):
+        a, b, lo, hi = op
+        if lo not in needed:
+            lo = None
+        if hi not in needed:
+            hi = None
+        if lo is None and hi is None:
+            continue
+        needed.add(a)
+        needed.add(b)
+        network.append((a, b, lo, hi))
+    network.reverse()
+    return network, result
+
+
+def fastMedianFilter(arr, size, nrThreads=1):
+    """ Median filter with a square kernel of odd size, using a selection network
+        of element wise minima and maxima. The result is identical to
+        scipy.ndimage.median_filter(arr, (size, size)), boundary mode 'reflect'.
+        The image is processed in row blocks, concurrently by a pool of worker threads,
+        if more than one thread is given.
+
+        :param arr: the image to be filtered.
+        :type arr: a 2 dimensional numpy array
+        :param size: the kernel size, odd.
+        :type size: unsigned int
+        :param nrThreads: the number of worker threads.
+        :type nrThreads: unsigned int
+        :return: the filtered image.
+        :rtype: a 2 dimensional numpy array of the same type
+
+    """
+    network, result = medianNetwork(size * size)
+    # the last use of each variable, to release it as early as possible:
+    lastUse = {}
+    for k, (a, b, lo, hi) in enumerate(network):
+        lastUse[a] = k
+        lastUse[b] = k
+    margin = size / 2
+    nrows, ncols = arr.shape
+    padded = pad(arr, margin, mode='symmetric')
+    out = empty_like(arr)
+    # about 2 million pixels for all values of the kernel per thread:
+    blockRows = max(1, (1 << 21) / (ncols * size * size))
+
+    def filterBlock(rowStart):
+        rowStop = min(rowStart + blockRows, nrows)
+        values = {}
+        for i in range(size):
+            for j in range(size):
+                values[i * size + j] = padded[rowStart + i:rowStop + i, j:j + ncols]
+        for k, (a, b, lo, hi) in enumerate(network):
+            if lo is not None:
+                values[lo] = minimum(values[a], values[b])
+            if hi is not None:
+                values[hi] = maximum(values[a], values[b])
+            if lastUse[a] == k:
+                del values[a]
+            if lastUse[b] == k:
+                del values[b]
+        out[rowStart:rowStop] = values[result]
+
+    blocks = range(0, nrows, blockRows)
+    if nrThreads > 1 and len(blocks) > 1:
+        pool = ThreadPool(min(nrThreads, len(blocks)))
+        try:
+            pool.map(filterBlock, blocks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for rowStart in blocks:
+            filterBlock(rowStart)
+    return out
@@ -10,11 +10,13 @@ from tables import *
 import sys, os
 import fnmatch
 from time import time
+from multiprocessing import Pool, Event, RLock
 from L3_Library import stdoutWrite, stderrWrite
 from L3_Config import L3_Config
 from L3_Product import L3_Product
 from L3_Tables import L3_Tables
-from L3_Synthesis import L3_Synthesis
+from L3_Synthesis import L3_Synthesis, NO_USABLE_PIXELS
+from L3_XmlParser import L3_XmlParser, metadataSession
 
 def sortObservationStartTime(dirList):
     UP_mask = '*_MSIL2A_*'
@@ -154,9 +156,14 @@ def doTheLoop(config):
         :rtype: processor object or -1
 
     '''
+    # tile parallel processing requires the fork of the worker processes, not available on windows:
+    if config.nrProcesses > 1 and os.name != 'nt':
+        return doTheTileParallelLoop(config)
+
     HelloWorld = processorName + ', ' + processorVersion + ', created: ' + processorDate
     stdoutWrite('\n%s started with %dm resolution ...\n' % (HelloWorld, config.resolution))
-    dirlist = os.listdir(config.sourceDir)
+    # the source directory is listed from the inventory, scanned by the time estimation:
+    dirlist = config.listSource(config.sourceDir)
     upList = sortObservationStartTime(dirlist)
     tileFilter = config.tileFilter
 
@@ -174,7 +181,7 @@ def doTheLoop(config):
         else:
             Tile_mask = 'L2A_*'
         GRANULE = os.path.join(config.sourceDir, L2A_UP_ID, 'GRANULE')
-        tilelist = sorted(os.listdir(GRANULE))
+        tilelist = config.listSource(GRANULE)
         for tile in tilelist:
             # process only L2A tiles:
             if not fnmatch.fnmatch(tile, Tile_mask):
@@ -190,16 +197,31 @@ def doTheLoop(config):
 
             tStart = time()
             product.config.L2A_TILE_ID = tile
-            tables = L3_Tables(product)
-            tables.init()
-            # no processing if first initialisation:
-            # check existence of Bands - B2 is always present:
-            if not tables.testBand('L2A', tables.B02):
-                # append processed tile to list
-                if not config.appendTile():
+            # the tile metadata of the scene, used by the decision and the preparation of the tile:
+            product.reinitL2A_Tile()
+            # scenes which cannot improve the mosaic are skipped before the tile is prepared:
+            contributes, reason = processor.l3Synthesis.canContribute(product)
+            if not contributes:
+                config.timestamp('L3_Process: %s, skipped' % reason)
+                if reason == NO_USABLE_PIXELS:
+                    processor.l3Synthesis.updateBestValues(product)
+                if not config.appendTile(skipped=True):
                     config.exitError()
                 continue
-            proc, result = processor.process(tables)
+            # the tile metadata is written once, after the processing of the tile:
+            with metadataSession(['T03']):
+                tables = L3_Tables(product)
+                # one database session per tile, closed after processing:
+                with tables.session():
+                    tables.init()
+                    # no processing if first initialisation:
+                    # check existence of Bands - B2 is always present:
+                    if not tables.testBand('L2A', tables.B02):
+                        # append processed tile to list
+                        if not config.appendTile():
+                            config.exitError()
+                        continue
+                    proc, result = processor.process(tables)
             if result == -1:
                 stderrWrite('Application terminated with errors, see log file and traces.\n')
                 return result
@@ -211,6 +233,309 @@ def doTheLoop(config):
 
     return proc
 
+# set by a worker process of the tile parallel loop, if the criteria for termination are reached:
+terminated = None
+
+def getTargetTileId(config, tile):
+    ''' Get the identifier of the L3 target tile, into which an L2A tile is processed,
+        following the selection of the target tile folder in L3_Tables.
+
+        :param config: the config object
+        :type config: a reference to the config object
+        :param tile: the L2A tile ID.
+        :type tile: str
+        :return: the orbit ID of the target tile.
+        :rtype: str
+
+    '''
+    strList = tile.split('_')
+    if config.namingConvention == 'SAFE_STANDARD':
+        return strList[-2]
+    else:
+        return strList[1]
+
+def processTileGroup(items):
+    ''' Processes the L2A tiles of one target tile sequentially, in the order of the observation time.
+        Executed by a worker process of the tile parallel loop, the config is inherited from the parent.
+
+        :param items: the user product ID and the tile ID of the L2A tiles.
+        :type items: list of tuples
+        :return: -1 if processing error occurred, 1 if criteria for termination are reached, 0 else,
+            and the last processed item.
+        :rtype: tuple
+
+    '''
+    config = L3_Config(None)
+    product = L3_Product(config)
+    processor = L3_Process(config)
+    processed = None
+    try:
+        for L2A_UP_ID, tile in items:
+            if terminated.is_set():
+                return 1, processed
+            # updates the product version for the user product:
+            config.checkTimeRange(L2A_UP_ID)
+            product.updateUserProduct(L2A_UP_ID)
+            tStart = time()
+            product.config.L2A_TILE_ID = tile
+            # the tile metadata of the scene, used by the decision and the preparation of the tile:
+            product.reinitL2A_Tile()
+            # scenes which cannot improve the mosaic are skipped before the tile is prepared:
+            contributes, reason = processor.l3Synthesis.canContribute(product)
+            if not contributes:
+                config.timestamp('L3_Process: %s, skipped' % reason)
+                if reason == NO_USABLE_PIXELS:
+                    processor.l3Synthesis.updateBestValues(product)
+                if not config.appendTile(skipped=True):
+                    config.exitError()
+                continue
+            # the tile metadata is written once, after the processing of the tile:
+            with metadataSession(['T03']):
+                tables = L3_Tables(product)
+                # one database session per tile, closed after processing:
+                with tables.session():
+                    tables.init()
+                    # no processing if first initialisation:
+                    # check existence of Bands - B2 is always present:
+                    if not tables.testBand('L2A', tables.B02):
+                        # append processed tile to list
+                        if not config.appendTile():
+                            config.exitError()
+                        processed = (L2A_UP_ID, tile)
+                        continue
+                    proc, result = processor.process(tables)
+            if result == -1:
+                return result, processed
+            processed = (L2A_UP_ID, tile)
+            if result == 1:
+                terminated.set()
+                return result, processed
+            tMeasure = time() - tStart
+            config.writeTimeEstimation(config.resolution, tMeasure)
+    except SystemExit:
+        # fatal errors terminate via config.exitError():
+        return -1, processed
+    finally:
+        # the progress of the worker is added to the shared status file:
+        config.flushProgress()
+    return 0, processed
+
+def getTileGroups(config, product):
+    ''' Groups the L2A tiles to be processed by their target tile, each group in the order
+        of the observation time. The L3 target product is created with the first user product.
+
+        :param config: the config object
+        :type config: a reference to the config object
+        :param product: the product object.
+        :type product: a reference to the L3_Product object
+        :return: the target tiles in the order of their first L2A tile, and the groups by target tile.
+        :rtype: tuple
+
+    '''
+    # the source directory is listed from the inventory, scanned by the time estimation:
+    dirlist = config.listSource(config.sourceDir)
+    upList = sortObservationStartTime(dirlist)
+    tileFilter = config.tileFilter
+
+    groups = {}
+    targetTiles = []
+    for L2A_UP_ID in upList:
+        if not config.checkTimeRange(L2A_UP_ID):
+            continue
+        # the L3 target product is created in advance by the parent process:
+        if not targetTiles:
+            product.updateUserProduct(L2A_UP_ID)
+        if config.productVersion == 13.1:
+            Tile_mask = '*L2A_*'
+        else:
+            Tile_mask = 'L2A_*'
+        GRANULE = os.path.join(config.sourceDir, L2A_UP_ID, 'GRANULE')
+        tilelist = config.listSource(GRANULE)
+        for tile in tilelist:
+            # process only L2A tiles:
+            if not fnmatch.fnmatch(tile, Tile_mask):
+                continue
+            # ignore already processed tiles:
+            if config.tileExists(tile):
+                continue
+            # apply tile filter:
+            if not config.tileIsSelected(tile, tileFilter):
+                continue
+            if not config.checkTileConsistency(GRANULE, tile):
+                continue
+            targetTile = getTargetTileId(config, tile)
+            if targetTile not in groups:
+                groups[targetTile] = []
+                targetTiles.append(targetTile)
+            groups[targetTile].append((L2A_UP_ID, tile))
+
+    return targetTiles, groups
+
+def doTheTileParallelLoop(config):
+    ''' Cycles through all input products and granules and groups the tiles to be processed
+        by their target tile. The groups are processed in parallel by a pool of worker processes,
+        each group in the order of the observation time. The access to the product statistics,
+        the datastrip metadata and the processing history is serialised via the lock of the config.
+        The best values of the past, deciding on the better scene, are kept per tile,
+        thus the result of a tile does not depend on the processing of the other groups.
+
+        :param config: the config object
+        :type config: a reference to the config object
+        :return: the processor object, for doing the postprocessing, -1 if processing error occurred.
+        :rtype: processor object or -1
+
+    '''
+    HelloWorld = processorName + ', ' + processorVersion + ', created: ' + processorDate
+    stdoutWrite('\n%s started with %dm resolution and %d processes ...\n' % (HelloWorld, config.resolution, config.nrProcesses))
+    product = L3_Product(config)
+    targetTiles, groups = getTileGroups(config, product)
+    if not targetTiles:
+        return None
+
+    # the scheme of the tile metadata, validated for each tile, is compiled once for all workers:
+    L3_XmlParser(config, 'GIPP').getSchema(config.tileScheme2a)
+    # lock and termination flag are inherited by the worker processes:
+    global terminated
+    config.lock = RLock()
+    terminated = Event()
+    # the pending progress is not to be inherited by the worker processes:
+    config.flushProgress()
+    pool = Pool(min(config.nrProcesses, len(targetTiles)))
+    result = 0
+    processed = None
+    try:
+        for groupResult, groupProcessed in pool.imap_unordered(processTileGroup, [groups[t] for t in targetTiles]):
+            if groupProcessed is not None:
+                processed = groupProcessed
+            if groupResult == -1:
+                result = -1
+                terminated.set()
+    finally:
+        pool.close()
+        pool.join()
+
+    if result == -1:
+        stderrWrite('Application terminated with errors, see log file and traces.\n')
+        return result
+    elif processed is None:
+        return None
+
+    # prepare the processor for the post processing with the last processed tile:
+    L2A_UP_ID, tile = processed
+    config.checkTimeRange(L2A_UP_ID)
+    product.updateUserProduct(L2A_UP_ID)
+    product.config.L2A_TILE_ID = tile
+    product.reinitL2A_Tile()
+    processor = L3_Process(config)
+    processor.tables = L3_Tables(product)
+    processor.l3Synthesis.product = product
+    return processor
+
+def doTheSinglePass(config, resolutions):
+    ''' Initializes a product object and a processor object per resolution. Cycles once through all
+        input products and granules and feeds each tile to all resolutions, for which the criteria
+        for processing are fulfilled. The bands shared between the resolutions are decoded only once per tile.
+
+        :param config: the config object
+        :type config: a reference to the config object
+        :param resolutions: the resolutions to be processed, in descending order.
+        :type resolutions: list of unsigned int
+        :return: the processor objects per resolution, for doing the post processing, -1 if processing error occurred.
+        :rtype: dictionary of processor objects or -1
+
+    '''
+    HelloWorld = processorName + ', ' + processorVersion + ', created: ' + processorDate
+    stdoutWrite('\n%s started in single pass mode with %s m resolution ...\n' % (HelloWorld, str(resolutions)))
+    # the source directory is listed from the inventory, scanned by the time estimation:
+    dirlist = config.listSource(config.sourceDir)
+    upList = sortObservationStartTime(dirlist)
+    tileFilter = config.tileFilter
+
+    product = L3_Product(config)
+    processors = {}
+    for resolution in resolutions:
+        config.resolution = resolution
+        processors[resolution] = L3_Process(config)
+    active = list(resolutions)
+    procs = {}
+    headersCreated = False
+    for L2A_UP_ID in upList:
+        # all resolutions have reached the criteria for termination:
+        if not active:
+            break
+        if not config.checkTimeRange(L2A_UP_ID):
+            continue
+        if headersCreated:
+            product.updateUserProduct(L2A_UP_ID)
+        else:
+            # the quality indicator headers of the target product are created per resolution:
+            for resolution in active:
+                config.resolution = resolution
+                product.updateUserProduct(L2A_UP_ID)
+            headersCreated = True
+        if config.productVersion == 13.1:
+            Tile_mask = '*L2A_*'
+        else:
+            Tile_mask = 'L2A_*'
+        GRANULE = os.path.join(config.sourceDir, L2A_UP_ID, 'GRANULE')
+        tilelist = config.listSource(GRANULE)
+        for tile in tilelist:
+            # process only L2A tiles:
+            if not fnmatch.fnmatch(tile, Tile_mask):
+                continue
+            # apply tile filter:
+            if not config.tileIsSelected(tile, tileFilter):
+                continue
+            tables = None
+            # the tile metadata is written once, after the processing of the tile in all resolutions:
+            with metadataSession(['T03']):
+                for resolution in list(active):
+                    config.resolution = resolution
+                    # ignore already processed tiles:
+                    if config.tileExists(tile):
+                        continue
+                    if not config.checkTileConsistency(GRANULE, tile):
+                        continue
+
+                    tStart = time()
+                    product.config.L2A_TILE_ID = tile
+                    # the tile metadata of the scene, used by the decision and the preparation of the tile:
+                    product.reinitL2A_Tile()
+                    # scenes which cannot improve the mosaic are skipped before the tile is prepared:
+                    contributes, reason = processors[resolution].l3Synthesis.canContribute(product)
+                    if not contributes:
+                        config.timestamp('L3_Process: %s, skipped' % reason)
+                        if reason == NO_USABLE_PIXELS:
+                            processors[resolution].l3Synthesis.updateBestValues(product)
+                        if not config.appendTile(skipped=True):
+                            config.exitError()
+                        continue
+                    tables = L3_Tables(product)
+                    # one database session per tile and resolution, closed after processing:
+                    with tables.session():
+                        tables.init()
+                        # no processing if first initialisation:
+                        # check existence of Bands - B2 is always present:
+                        if not tables.testBand('L2A', tables.B02):
+                            # append processed tile to list
+                            if not config.appendTile():
+                                config.exitError()
+                            continue
+                        proc, result = processors[resolution].process(tables)
+                    if result == -1:
+                        stderrWrite('Application terminated with errors, see log file and traces.\n')
+                        return result
+                    procs[resolution] = proc
+                    if result == 1:
+                        active.remove(resolution)
+                    elif result == 0:
+                        tMeasure = time() - tStart
+                        config.writeTimeEstimation(config.resolution, tMeasure)
+            if tables is not None:
+                tables.releaseSharedBands()
+
+    return procs
+
 
 def main(args=None):
     ''' Processes command line,
@@ -225,6 +550,7 @@ def main(args=None):
     parser.add_argument('directory', help='Directory where the Level-2A input files are located')
     parser.add_argument('--resolution', type=int, choices=[10, 20, 60], help='Target resolution, can be 10, 20 or 60m. If omitted, all resolutions will be processed')
     parser.add_argument('--clean', action='store_true', help='Removes the L3 product in the target directory before processing. Be careful!')
+    parser.add_argument('--single-pass', action='store_true', help='Processes all resolutions in a single pass over the Level-2A input products. Ignored if a resolution is given')
     args = parser.parse_args()
 
     # SIITBX-49: directory should not end with '/':
@@ -246,6 +572,9 @@ def main(args=None):
     else:
         resolutions = [args.resolution]
 
+    if args.single_pass and len(resolutions) > 1:
+        return singlePass(args, directory, resolutions)
+
     cleanDone = False # do only one clean up of target, if requested.
     for resolution in resolutions:
         config = L3_Config(resolution, directory)
@@ -270,6 +599,58 @@ def main(args=None):
             stdoutWrite('All tiles already processed.\n')
         else:
             processor.postProcessing()
+        config.flushProgress()
+
+    stdoutWrite('Application terminated successfully.\n')
+    return 0
+
+def singlePass(args, directory, resolutions):
+    ''' Initializes one config for all resolutions and starts the
+        L3 processing in a single pass over the input products
+
+        :param args: the command line arguments.
+        :type args: argparse namespace
+        :param directory: the directory of the Level-2A input products.
+        :type directory: str
+        :param resolutions: the resolutions to be processed, in descending order.
+        :type resolutions: list of unsigned int
+        :return: the exit code.
+        :rtype: int
+
+    '''
+    config = L3_Config(resolutions[0], directory)
+    config.singlePass = True
+    processedFn = os.path.join(directory, 'processed')
+    if args.clean:
+        stdoutWrite('Cleaning target directory ...\n')
+        config.cleanTarget = True
+        try:
+            os.remove(processedFn)
+        except:
+            stdoutWrite('No history file present ...\n')
+
+    config.init(processorVersion)
+    processors = doTheSinglePass(config, resolutions)
+    if processors == -1:
+        stderrWrite('Application terminated with errors, see log file and traces.\n')
+        return 1
+    elif not processors:
+        stdoutWrite('All tiles already processed.\n')
+
+    # the post processing modifies the product version, it is restored for each resolution:
+    productVersion = config.productVersion
+    reportClosed = False
+    for resolution in resolutions:
+        if resolution not in processors:
+            continue
+        if reportClosed:
+            # each resolution gets its own report, as for the sequential processing:
+            config.initLogger()
+        config.resolution = resolution
+        config.productVersion = productVersion
+        processors[resolution].postProcessing()
+        reportClosed = True
+    config.flushProgress()
 
     stdoutWrite('Application terminated successfully.\n')
     return 0
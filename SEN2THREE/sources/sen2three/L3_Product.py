@@ -32,7 +32,13 @@ class Particle(tables.IsDescription):
     THIN_CIRRUS = tables.UInt32Col()
     SNOW_ICE = tables.UInt32Col()
 
+# the pixel counts of the statistics, in the order of the count vector passed to updateTableRow:
+STATISTICS = ['TOTAL_PIXELS', 'DATA_PIXELS', 'NODATA_PIXELS', 'GOOD_PIXELS', 'BAD_PIXELS',
+              'SAT_DEF_PIXELS', 'DARK_PIXELS', 'CLOUD_SHADOWS', 'VEGETATION', 'NOT_VEGETATED',
+              'WATER', 'UNCLASSIFIED', 'MED_PROBA_CLOUDS', 'HIGH_PROBA_CLOUDS', 'THIN_CIRRUS', 'SNOW_ICE']
+
 class BestVal(tables.IsDescription):
+    TILE_ID = tables.StringCol(itemsize=9)
     AOT_MEAN = tables.Float32Col()
     SZA_MEAN = tables.Float32Col()
     DATE_TIME = tables.Float32Col()
@@ -45,6 +51,8 @@ class L3_Product(object):
     '''
 
     _shared = {}
+    # running totals of the statistics per database and resolution, as stored in the database:
+    _totals = {}
     def __init__(self, config):
         self._config = config
 
@@ -466,6 +474,40 @@ class L3_Product(object):
         
         return False
 
+    def getL3_TileId(self):
+        ''' Get the identifier of the L3 tile, into which the current L2A tile is processed.
+            This is the L3 tile with the same orbit ID, if it already exists.
+
+            :return: the L3 tile ID, false if the L3 tile does not exist yet.
+            :rtype: str
+
+        '''
+        strList = self.config.L2A_TILE_ID.split('_')
+        if self.config.namingConvention == 'SAFE_STANDARD':
+            ORBIT_ID = strList[-2]
+        else:
+            ORBIT_ID = strList[1]
+        tiles = os.path.join(self.config.targetDir, self.config.L3_TARGET_ID, 'GRANULE')
+        for L3_TILE_ID in sorted(os.listdir(tiles)):
+            if fnmatch.fnmatch(L3_TILE_ID, 'L03_*') and ORBIT_ID in L3_TILE_ID:
+                return L3_TILE_ID
+        return False
+
+    def getL3_Database(self, L3_TILE_ID):
+        ''' Get the database of an L3 tile for the current resolution, as created by L3_Tables.
+
+            :param L3_TILE_ID: the L3 tile ID.
+            :type L3_TILE_ID: str
+            :return: the file name of the database, false if the database does not exist yet.
+            :rtype: str
+
+        '''
+        database = os.path.join(self.config.L3_TARGET_DIR, 'GRANULE', L3_TILE_ID, 'IMG_DATA',
+                                'R' + str(self.config.resolution) + 'm', '.database.h5')
+        if not os.path.isfile(database):
+            return False
+        return database
+
     def createL3_Tile(self, tileId):
         ''' Create an L3 tile
 
@@ -599,10 +641,12 @@ class L3_Product(object):
                 gr2a = pi.L2A_Product_Organisation.Granule_List.Granules
         gi2a = gr2a.attrib['granuleIdentifier']
         gi03 = gi2a.replace('L2A_', 'L03_')
-        xp = L3_XmlParser(self.config, 'DS03')
-        ti = xp.getTree('Image_Data_Info', 'Tiles_Information')
-        ti.Tile_List.append(objectify.Element('Tile', tileId = gi03))
-        xp.export()
+        # the datastrip metadata is shared with the other processes of the tile parallel processing:
+        with self.config.lock:
+            xp = L3_XmlParser(self.config, 'DS03')
+            ti = xp.getTree('Image_Data_Info', 'Tiles_Information')
+            ti.Tile_List.append(objectify.Element('Tile', tileId = gi03))
+            xp.export()
         return
     
     def reinitL2A_Tile(self):
@@ -778,10 +822,16 @@ class L3_Product(object):
         dbname = os.path.join(self.config.L3_TARGET_DIR, '.database.h5')
         h5file = tables.open_file(dbname, mode="w", title='Product')
         grp = h5file.create_group("/", 'group1', 'Statistics')
-        h5file.create_table(grp, 'classes', Particle, 'Classes')
+        table = h5file.create_table(grp, 'classes', Particle, 'Classes')
+        table.cols.TILE_ID.create_index()
+        for key in L3_Product._totals.keys():
+            if key[0] == dbname:
+                del L3_Product._totals[key]
         h5file.create_table(grp, 'bestval', BestVal, 'Best Values')
         table = h5file.root.group1.bestval
+        # the default values, for all tiles without own best values:
         row = table.row
+        row['TILE_ID'] = ''
         row['AOT_MEAN'] = 1.0
         row['SZA_MEAN'] = 0.0
         row['DATE_TIME'] = 0.0
@@ -789,8 +839,51 @@ class L3_Product(object):
         h5file.close()
         return
 
+    def getBestValTileId(self, L3_TILE_ID=None):
+        ''' Get the key of the best values of the past for an L3 tile. In the tile parallel
+            processing, the best values are kept per tile and resolution, thus the result of a tile
+            does not depend on the processing of the other tile groups. Otherwise the best values
+            are product wide, kept in the default row, as by the sequential processing.
+
+            :param L3_TILE_ID: the L3 tile ID, the current tile if None.
+            :type L3_TILE_ID: str
+            :return: the tile ID and resolution, empty for the default row.
+            :rtype: str
+
+        '''
+        if L3_TILE_ID is None:
+            L3_TILE_ID = self.config.L3_TILE_ID
+        # as the selection of the tile parallel processing in doTheLoop:
+        if self.config.nrProcesses > 1 and os.name != 'nt':
+            return L3_TILE_ID[-13:-7] + '_' + str(self.config.resolution)
+        return ''
+
+    def getBestValTable(self, h5file):
+        ''' Get the table of the best values of the past, see getBestValTileId().
+            The single row of databases of previous versions becomes the default row.
+
+            :param h5file: the product database, opened for writing.
+            :type h5file: a pyTables file object.
+            :return: the table of the best values.
+            :rtype: a PyTables table
+
+        '''
+        table = h5file.root.group1.bestval
+        if 'TILE_ID' in table.colnames:
+            return table
+        records = table.read()
+        table.remove()
+        table = h5file.create_table(h5file.root.group1, 'bestval', BestVal, 'Best Values')
+        row = table.row
+        row['TILE_ID'] = ''
+        for key in ['AOT_MEAN', 'SZA_MEAN', 'DATE_TIME']:
+            row[key] = records[key][0]
+        row.append()
+        table.flush()
+        return table
+
     def setTableVal(self, key, value):
-        ''' Check if one of the two criteria for termination is reached:
+        ''' Set a best value of the past for the current tile.
             :param key: the search key.
             :type key: str
             :param value: the value to be passed.
@@ -800,126 +893,161 @@ class L3_Product(object):
         '''
         result = True
         dbname = os.path.join(self.config.L3_TARGET_DIR, '.database.h5')
-        h5file = tables.open_file(dbname, mode='a')
-        table = h5file.root.group1.bestval # default
-        try:
-            for row in table:
-                row[key] = value
-                row.update()
-        except:
-            result = False
-        finally:
-            table.flush()
-            h5file.close()
-            return result
-
-    def getTableVal(self, key):
-        ''' Check if one of the two criteria for termination is reached:
+        tileID = self.getBestValTileId()
+        # the table is shared with the other processes of the tile parallel processing:
+        with self.config.lock:
+            h5file = tables.open_file(dbname, mode='a')
+            table = self.getBestValTable(h5file)
+            try:
+                coords = table.get_where_list('TILE_ID == tileID', {'tileID': tileID})
+                if len(coords) == 0:
+                    # the first best value of the tile, the others are taken from the default row:
+                    coords = table.get_where_list('TILE_ID == default', {'default': ''})
+                    records = table.read_coordinates(coords[:1])
+                    records['TILE_ID'] = tileID
+                    records[key] = value
+                    table.append(records)
+                else:
+                    records = table.read_coordinates(coords)
+                    records[key] = value
+                    table.modify_coordinates(coords, records)
+            except:
+                result = False
+            finally:
+                table.flush()
+                h5file.close()
+        return result
+
+    def getTableVal(self, key, L3_TILE_ID=None):
+        ''' Get a best value of the past for an L3 tile.
             :param key: the search key.
             :type key: str
+            :param L3_TILE_ID: the L3 tile ID, the current tile if None.
+            :type L3_TILE_ID: str
             :return: the value
-            :rtype: bool
+            :rtype: float
         '''
         dbname = os.path.join(self.config.L3_TARGET_DIR, '.database.h5')
-        h5file = tables.open_file(dbname, mode='a')
-        table = h5file.root.group1.bestval # default
-        try:
-            for row in table.iterrows():
-                result = row[key]
-        except:
-            result = False
-        finally:
-            table.flush()
-            h5file.close()
-            return result
+        tileID = self.getBestValTileId(L3_TILE_ID)
+        with self.config.lock:
+            h5file = tables.open_file(dbname, mode='a')
+            table = self.getBestValTable(h5file)
+            try:
+                records = table.read_where('TILE_ID == tileID', {'tileID': tileID})
+                if len(records) == 0:
+                    records = table.read_where('TILE_ID == default', {'default': ''})
+                result = records[key][0]
+            except:
+                result = False
+            finally:
+                table.flush()
+                h5file.close()
+        return result
 
-    def updateTableRow(self, classification):
+    def updateTableRow(self, counts):
         ''' Update the statistics of a row in the table.
 
-            :param classification: the statistics
-            :type classification: an Objectify element
+            :param counts: the pixel counts of the tile, in the order of STATISTICS.
+            :type counts: a numpy array of int
 
         '''
         dbname = os.path.join(self.config.L3_TARGET_DIR, '.database.h5')
         tileID = self.config.L3_TILE_ID[-13:-7] + '_' + str(self.config.resolution)
-        h5file = tables.open_file(dbname, mode='a')
-        table = h5file.root.group1.classes # default
-        tileFound = False
-
-        for row in table:
-            if row['TILE_ID'] == tileID:
-                tileFound = True
-                row['TILES_COUNT'] += 1
-                row['TOTAL_PIXELS'] = classification.TOTAL_PIXEL_COUNT.pyval
-                row['DATA_PIXELS'] = classification.DATA_PIXEL_COUNT.pyval
-                row['NODATA_PIXELS'] = classification.NODATA_PIXEL_COUNT.pyval
-                row['GOOD_PIXELS'] = classification.GOOD_PIXEL_COUNT.pyval
-                row['BAD_PIXELS'] = classification.BAD_PIXEL_COUNT.pyval
-                row['SAT_DEF_PIXELS'] = classification.SATURATED_DEFECTIVE_PIXEL_COUNT.pyval
-                row['DARK_PIXELS'] = classification.DARK_FEATURES_COUNT.pyval
-                row['CLOUD_SHADOWS'] = classification.CLOUD_SHADOWS_COUNT.pyval
-                row['VEGETATION'] = classification.VEGETATION_COUNT.pyval
-                row['NOT_VEGETATED'] = classification.NOT_VEGETATED_COUNT.pyval
-                row['WATER'] = classification.WATER_COUNT.pyval
-                row['UNCLASSIFIED'] = classification.UNCLASSIFIED_COUNT.pyval
-                row['MED_PROBA_CLOUDS'] = classification.MEDIUM_PROBA_CLOUDS_COUNT.pyval
-                row['HIGH_PROBA_CLOUDS'] = classification.HIGH_PROBA_CLOUDS_COUNT.pyval
-                row['THIN_CIRRUS'] = classification.THIN_CIRRUS_COUNT.pyval
-                row['SNOW_ICE'] = classification.SNOW_ICE_COUNT.pyval
-                row.update()
-
-        if not tileFound:
-            row = table.row
-            row['TILE_ID'] = tileID
-            row['RESOLUTION'] = self.config.resolution
-            row['TILES_COUNT'] = 1
-            row['TOTAL_PIXELS'] = classification.TOTAL_PIXEL_COUNT.pyval
-            row['DATA_PIXELS'] = classification.DATA_PIXEL_COUNT.pyval
-            row['NODATA_PIXELS'] = classification.NODATA_PIXEL_COUNT.pyval
-            row['GOOD_PIXELS'] = classification.GOOD_PIXEL_COUNT.pyval
-            row['BAD_PIXELS'] = classification.BAD_PIXEL_COUNT.pyval
-            row['SAT_DEF_PIXELS'] = classification.SATURATED_DEFECTIVE_PIXEL_COUNT.pyval
-            row['DARK_PIXELS'] = classification.DARK_FEATURES_COUNT.pyval
-            row['CLOUD_SHADOWS'] = classification.CLOUD_SHADOWS_COUNT.pyval
-            row['VEGETATION'] = classification.VEGETATION_COUNT.pyval
-            row['NOT_VEGETATED'] = classification.NOT_VEGETATED_COUNT.pyval
-            row['WATER'] = classification.WATER_COUNT.pyval
-            row['UNCLASSIFIED'] = classification.UNCLASSIFIED_COUNT.pyval
-            row['MED_PROBA_CLOUDS'] = classification.MEDIUM_PROBA_CLOUDS_COUNT.pyval
-            row['HIGH_PROBA_CLOUDS'] = classification.HIGH_PROBA_CLOUDS_COUNT.pyval
-            row['THIN_CIRRUS'] = classification.THIN_CIRRUS_COUNT.pyval
-            row['SNOW_ICE'] = classification.SNOW_ICE_COUNT.pyval
-            row.append()
+        with self.config.lock:
+            h5file = tables.open_file(dbname, mode='a')
+            table = h5file.root.group1.classes # default
+            # databases of previous versions have no index:
+            if not table.cols.TILE_ID.is_indexed:
+                table.cols.TILE_ID.create_index()
+            coords = table.get_where_list('TILE_ID == tileID', {'tileID': tileID})
+            # the running totals are updated by the difference to the previous counts of the tile:
+            totals = self.getTableTotals(table)
+            if len(coords) > 0:
+                records = table.read_coordinates(coords)
+                for i, column in enumerate(STATISTICS):
+                    totals[i] -= records[column].sum(dtype=int64)
+                totals += len(coords) * counts
+                records['TILES_COUNT'] += 1
+            else:
+                totals += counts
+                records = zeros(1, dtype=table.dtype)
+                records['TILE_ID'] = tileID
+                records['RESOLUTION'] = self.config.resolution
+                records['TILES_COUNT'] = 1
+            for i, column in enumerate(STATISTICS):
+                records[column] = counts[i]
+            if len(coords) > 0:
+                table.modify_coordinates(coords, records)
+            else:
+                table.append(records)
+            table.attrs['TOTALS_%d' % self.config.resolution] = totals
+            L3_Product._totals[(dbname, self.config.resolution)] = totals
 
-        table.flush()
-        h5file.close()
+            table.flush()
+            h5file.close()
         return
 
-    def checkCriteriaForTermination(self):
-        ''' Check if one of the two criteria for termination is reached:
+    def getTableSums(self, table):
+        ''' Sum up the statistics of all tiles of the current resolution.
+
+            :param table: the statistics table.
+            :type table: a PyTables table
+            :return: the pixel counts, with the keys of STATISTICS.
+            :rtype: dict
+
+        '''
+        records = table.read_where('RESOLUTION == resolution', {'resolution': self.config.resolution})
+        return dict((column, int(records[column].sum(dtype=uint64))) for column in STATISTICS)
+
+    def getTableTotals(self, table):
+        ''' Get the running totals of the statistics of the current resolution, as stored
+            by updateTableRow. For databases of previous versions, the table is summed up.
+
+            :param table: the statistics table.
+            :type table: a PyTables table
+            :return: the pixel counts, in the order of STATISTICS.
+            :rtype: a numpy array of type int 64
 
-            :return: true if reached
-            :rtype: bool
         '''
+        key = 'TOTALS_%d' % self.config.resolution
+        if key in table.attrs:
+            return array(table.attrs[key], dtype=int64)
+        sums = self.getTableSums(table)
+        return array([sums[column] for column in STATISTICS], dtype=int64)
 
+    def getTotals(self):
+        ''' Get the running totals of the statistics of the current resolution.
+            These are kept in memory after each update, thus the database is only read once.
+
+            :return: the pixel counts, with the keys of STATISTICS.
+            :rtype: dict
+
+        '''
         dbname = os.path.join(self.config.L3_TARGET_DIR, '.database.h5')
-        h5file = tables.open_file(dbname, mode='r')
-        table = h5file.root.group1.classes
-        dataPixelCount = 0
-        badPixelCount = 0
-        lowProbaCloudsCount = 0
-        medProbaCloudsCount = 0
-        hiProbaCloudsCount = 0
-        for row in table.iterrows():
-            if row['RESOLUTION'] == self.config.resolution:
-                dataPixelCount += row['DATA_PIXELS']
-                badPixelCount += row['BAD_PIXELS']
-                lowProbaCloudsCount += row['UNCLASSIFIED']
-                medProbaCloudsCount += row['MED_PROBA_CLOUDS']
-                hiProbaCloudsCount += row['HIGH_PROBA_CLOUDS']
+        key = (dbname, self.config.resolution)
+        if key not in L3_Product._totals:
+            with self.config.lock:
+                h5file = tables.open_file(dbname, mode='r')
+                L3_Product._totals[key] = self.getTableTotals(h5file.root.group1.classes)
+                h5file.close()
+        return dict((column, int(count)) for column, count in zip(STATISTICS, L3_Product._totals[key]))
+
+    def getTerminationMargins(self):
+        ''' Get the distance of the statistics to the criteria for termination, in percent.
+            A criterion is reached if its margin is negative: for CLOUD_PROBABILITY, if all cloud
+            probability percentages are below Max_Cloud_Probability, for INVALID_PIXELS, if the
+            bad pixel percentage is below Max_Invalid_Pixels_Percentage.
+
+            :return: the margins of CLOUD_PROBABILITY and INVALID_PIXELS.
+            :rtype: dict
 
-        table.flush()
-        h5file.close()
+        '''
+        sums = self.getTotals()
+        dataPixelCount = sums['DATA_PIXELS']
+        badPixelCount = sums['BAD_PIXELS']
+        lowProbaCloudsCount = sums['UNCLASSIFIED']
+        medProbaCloudsCount = sums['MED_PROBA_CLOUDS']
+        hiProbaCloudsCount = sums['HIGH_PROBA_CLOUDS']
 
         dataPixelCount = float(dataPixelCount) * 0.01
         badPixelPercentage = float32(badPixelCount) / dataPixelCount
@@ -927,12 +1055,24 @@ class L3_Product(object):
         medProbaCloudsPercentage = float32(medProbaCloudsCount) / dataPixelCount
         hiProbaCloudsPercentage = float32(hiProbaCloudsCount) / dataPixelCount
 
-        if self.config.maxCloudProbability > lowProbaCloudsPercentage and \
-            self.config.maxCloudProbability > medProbaCloudsPercentage and \
-            self.config.maxCloudProbability > hiProbaCloudsPercentage:
+        cloudsPercentage = max(lowProbaCloudsPercentage, medProbaCloudsPercentage, hiProbaCloudsPercentage)
+        return {'CLOUD_PROBABILITY': float(cloudsPercentage) - float(self.config.maxCloudProbability),
+                'INVALID_PIXELS': float(badPixelPercentage) - float(self.config.maxInvalidPixelsPercentage)}
+
+    def checkCriteriaForTermination(self):
+        ''' Check if one of the two criteria for termination is reached:
+
+            :return: true if reached
+            :rtype: bool
+        '''
+
+        margins = self.getTerminationMargins()
+        self.config.logger.info('Distance to the criteria for termination [%%]: cloud probability %0.3f, invalid pixels %0.3f',
+                                margins['CLOUD_PROBABILITY'], margins['INVALID_PIXELS'])
+        if margins['CLOUD_PROBABILITY'] < 0:
             self.config.timestamp('L3_Process: cloud probability reached configured limit')
             return True
-        elif self.config.maxInvalidPixelsPercentage > badPixelPercentage:
+        elif margins['INVALID_PIXELS'] < 0:
             self.config.timestamp('L3_Process: invalid pixel percentage reached configured limit')
             return True
 
@@ -943,47 +1083,27 @@ class L3_Product(object):
         '''
 
         dbname = os.path.join(self.config.L3_TARGET_DIR, '.database.h5')
-        h5file = tables.open_file(dbname, mode='a')
-        table = h5file.root.group1.classes
-        
-        totalPixelCount = 0
-        dataPixelCount = 0
-        nodataPixelCount = 0
-        goodPixelCount = 0
-        badPixelCount = 0
-        satDefPixelCount = 0
-        darkFeaturesCount = 0
-        cloudShadowsCount = 0
-        vegetationCount = 0
-        bareSoilsCount = 0
-        waterCount = 0
-        lowProbaCloudsCount = 0
-        medProbaCloudsCount = 0
-        hiProbaCloudsCount = 0
-        thinCirrusCount = 0
-        snowIceCount = 0
-
-        for row in table.iterrows():
-            if row['RESOLUTION'] == self.config.resolution:
-                totalPixelCount += row['TOTAL_PIXELS']
-                dataPixelCount += row['DATA_PIXELS']
-                nodataPixelCount += row['NODATA_PIXELS']
-                goodPixelCount += row['GOOD_PIXELS']
-                badPixelCount += row['BAD_PIXELS']
-                satDefPixelCount += row['SAT_DEF_PIXELS']
-                darkFeaturesCount += row['DARK_PIXELS']
-                cloudShadowsCount +=row['CLOUD_SHADOWS']
-                vegetationCount += row['VEGETATION']
-                bareSoilsCount += row['NOT_VEGETATED']
-                waterCount += row['WATER']
-                lowProbaCloudsCount += row['UNCLASSIFIED']
-                medProbaCloudsCount += row['MED_PROBA_CLOUDS']
-                hiProbaCloudsCount += row['HIGH_PROBA_CLOUDS']
-                thinCirrusCount += row['THIN_CIRRUS']
-                snowIceCount += row['SNOW_ICE']
-
-        table.flush()
+        h5file = tables.open_file(dbname, mode='r')
+        totals = self.getTableTotals(h5file.root.group1.classes)
         h5file.close()
+        sums = dict((column, int(count)) for column, count in zip(STATISTICS, totals))
+
+        totalPixelCount = sums['TOTAL_PIXELS']
+        dataPixelCount = sums['DATA_PIXELS']
+        nodataPixelCount = sums['NODATA_PIXELS']
+        goodPixelCount = sums['GOOD_PIXELS']
+        badPixelCount = sums['BAD_PIXELS']
+        satDefPixelCount = sums['SAT_DEF_PIXELS']
+        darkFeaturesCount = sums['DARK_PIXELS']
+        cloudShadowsCount = sums['CLOUD_SHADOWS']
+        vegetationCount = sums['VEGETATION']
+        bareSoilsCount = sums['NOT_VEGETATED']
+        waterCount = sums['WATER']
+        lowProbaCloudsCount = sums['UNCLASSIFIED']
+        medProbaCloudsCount = sums['MED_PROBA_CLOUDS']
+        hiProbaCloudsCount = sums['HIGH_PROBA_CLOUDS']
+        thinCirrusCount = sums['THIN_CIRRUS']
+        snowIceCount = sums['SNOW_ICE']
 
         totalPixelCount = float(totalPixelCount) * 0.01
         dataPixelCount = float(dataPixelCount) * 0.01
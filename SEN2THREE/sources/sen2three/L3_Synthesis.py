@@ -1 +1 @@
-#!/usr/bin/env pythonfrom numpy import *import timefrom datetime import datetimefrom lxml import objectifyfrom L3_Library import stdoutWrite, showImagefrom L3_XmlParser import L3_XmlParserfrom L3_Display import L3_Displayfrom scipy.stats import itemfreqfrom scipy import ndimagefrom scipy.ndimage.morphology import *class L3_Synthesis(object):    ''' Performs the spatio temporal algorithms.        :param config: the config object for the current tile (via __init__).        :type config: a reference to the L3_Config object.    '''    def __init__(self, config):        self._config = config        self._product = None        self._tables = None        self._badPixelMask2A = None        self._goodPixelMask2A = None        self._badPixelMask03 = None        self._goodPixelMask03 = None        self._scl2A = None        self._aot2A = None        self._sza2A = None        self._scl03 = None        self._aot03 = None        self._sza03 = None        self._isBetterScene = False        self._bestSZA = 0.0        self._bestAOT = 1.0        self._noData = self.config.classifier['NO_DATA']        self._saturatedDefective = self.config.classifier['SATURATED_DEFECTIVE']        self._darkFeatures = self.config.classifier['DARK_FEATURES']        self._notVegetated = self.config.classifier['NOT_VEGETATED']        self._snowIce = self.config.classifier['SNOW_ICE']        self._vegetation = self.config.classifier['VEGETATION']        self._water = self.config.classifier['WATER']        self._unclassified = self.config.classifier['UNCLASSIFIED']        self._medProbaClouds = self.config.classifier['MEDIUM_PROBA_CLOUDS']        self._highProbaClouds = self.config.classifier['HIGH_PROBA_CLOUDS']        self._thinCirrus = self.config.classifier['THIN_CIRRUS']        self._cloudShadows = self.config.classifier['CLOUD_SHADOWS']        if self._config.displayData:            self._display = L3_Display(self._config)        else:            self._display = None        self.config.logger.debug('Module L3_STP initialized')        self._processingStatus = True        def get_config(self):        return self._config    def get_product(self):        return self._product    def get_tables(self):        return self._tables    def set_config(self, value):        self._config = value    def set_product(self, value):        self._product = value    def set_tables(self, value):        self._tables = value    def del_config(self):        del self._config    def del_product(self):        del self._product    def del_tables(self):        del self._tables    config = property(get_config, set_config, del_config)    product = property(get_product, set_product, del_product)    tables = property(get_tables, set_tables, del_tables)    def setPixelMasks(self):        ''' Sets the pixel masks according to following algorithm:            1. initialize good and bad pixels;            2. create mosaic map, if not exist, else read from L3_Tables;            3. update mosaic map and scene classification map according to selected algorithm:                if self.config.algorithm == 'MOST_RECENT':                    previous classification map will always be replaced with good pixels of recent classification map                    if the time stamp of the recent tile is more actual than of any scene in the past;                else if self.config.algorithm == 'TEMP_HOMOGENEITY':                    previous classification map will only be replaced if sum of current good pixels                    is better than sum of good pixels of the best classification map in the past;                else if self.config.algorithm == 'RADIOMETRIC_QUALITY':                    previous classification map will be replaced if either:                    - the average of the current AOT is lower or                    - the average of the current Solar Zenith Angle                    is higher than the equivalent parameter of the best classification map in the past;                else if self.config.algorithm == 'AVERAGE':                    images are an average of the current good pixels and the                    good pixels of all previous scenes. Mosaic map is the per pixel sum                    of all good pixels in the past and is used for calculating the average;            4. update good and bad pixel masks;        '''        saturatedDefective = self._saturatedDefective        notVegetated = self._notVegetated        vegetation = self._vegetation        water = self._water        noData = self._noData        cirrus = self._thinCirrus        darkFeatures = self._darkFeatures        cloudShadows = self._cloudShadows        unclassified = self._unclassified        medProbaClouds = self._medProbaClouds        highProbaClouds = self._highProbaClouds        snowIce = self._snowIce        self._isBetterScene = False        T_CLOUD_LP = 0        T_CLOUD_MP = 0.2        T_CLOUD_HP = 0.8        ntProcessed = self.config.getNrTilesProcessed()        self.config.timestamp('L3_Process: nr processed tiles: %d' % ntProcessed)        ntProcessed += 1        scl2A = self.tables.getBand('L2A', self.tables.SCL)        scl03 = self.tables.getBand('L3', self.tables.SCL)        # cld2A = self.tables.getBand('L2A', self.tables.CLD)        # cld03 = self.tables.getBand('L3', self.tables.CLD)        BPM2A = ones_like(scl2A)        BPM03 = ones_like(scl03)        BPM2A[(scl2A == notVegetated) | (scl2A == vegetation) | (scl2A == water)] = 0        BPM03[(scl03 == notVegetated) | (scl03 == vegetation) | (scl03 == water)] = 0        if self.config.cirrusRemoval == False:            BPM2A[scl2A == cirrus] = 0            BPM03[scl03 == cirrus] = 0        if self.config.shadowRemoval == False:            BPM2A[(scl2A == darkFeatures) | (scl2A == cloudShadows)] = 0            BPM03[(scl03 == darkFeatures) | (scl03 == cloudShadows)] = 0        if self.config.snowRemoval == False:            BPM2A[scl2A == snowIce] = 0            BPM03[scl03 == snowIce] = 0        # Create a hierachy of cloud probability in scene class and replace, if less:        BPM2A[(scl2A == cirrus) & (BPM03 == 1)] = 0        BPM2A[(scl2A == medProbaClouds) & (scl03 == highProbaClouds)] = 0        BPM2A[(scl2A == unclassified) & ((scl03 == medProbaClouds) | (scl03 == highProbaClouds))] = 0        BPM2A[(scl2A == darkFeatures) & ((scl03 == medProbaClouds) | (scl03 == highProbaClouds))] = 0        BPM2A[(scl2A == snowIce) & ((scl03 == medProbaClouds) | (scl03 == highProbaClouds))] = 0        BPM03[(scl03 == cirrus) & (BPM2A == 1)] = 0        BPM03[(scl03 == medProbaClouds) & (scl2A == highProbaClouds)] = 0        BPM03[(scl03 == unclassified) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = 0        BPM03[(scl03 == darkFeatures) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = 0        BPM03[(scl03 == snowIce) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = 0        # If 'better' features already exist, keep these:        scl2A[(scl03 == cirrus) & (BPM2A == 1)] = cirrus        scl2A[(scl03 == medProbaClouds) & (scl2A == highProbaClouds)] = medProbaClouds        scl2A[(scl03 == unclassified) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = unclassified        scl2A[(scl03 == darkFeatures) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = darkFeatures        scl2A[(scl03 == snowIce) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = snowIce        # Median Filter:        mf = self.config.medianFilter        if mf > 0:            # binary dilation first, to increase shape:            struct = generate_binary_structure(2, 1)            BPM2A = ndimage.binary_dilation(BPM2A, struct).astype(BPM2A.dtype)            BPM03 = ndimage.binary_dilation(BPM03, struct).astype(BPM03.dtype)            # now the median filter:            BPM2A = ndimage.filters.median_filter(BPM2A, (mf,mf))            BPM03 = ndimage.filters.median_filter(BPM03, (mf,mf))        GPM2A = 1 - BPM2A        GPM03 = 1 - BPM03        # Create mosaic map if not exist, else read from table:        if self.tables.testBand('L3', self.tables.MSC) == False:            mosaicMap = zeros_like(GPM03)            mosaicMap[GPM03 == 1] = 1            self.tables.setBand('L3', self.tables.MSC, mosaicMap.astype(uint8))            self.updateL3MosaicQI(first=True)            if self._display is not None:                self._display.displayData(self.tables)        else:            mosaicMap = self.tables.getBand('L3', self.tables.MSC)        if self.config.algorithm == 'MOST_RECENT':            # previous scene will always be replaced by good pixels of recent scene            # if the time stamp of the recent tile is more actual than of any scene in the past:            if self.isMoreRecent():                scl03[GPM2A == 1] = scl2A[GPM2A == 1]                mosaicMap[GPM2A == 1] = ntProcessed            mosaicMap[(GPM2A == 1) & (GPM03 == 0)] = ntProcessed                           elif self.config.algorithm == 'TEMP_HOMOGENEITY':            # previous scene will only be replaced if sum of current good pixels            # is better than sum of good pixels of the best scene in the past:            GP2Asum = float32(count_nonzero(GPM2A[GPM2A == 1]))            mmif = itemfreq(mosaicMap[GPM03 == 1])            bestScenePast = float32((mmif[:,1]).max())            if(GP2Asum / bestScenePast) > 1.0:                self._isBetterScene = True                scl03[GPM2A == 1] = scl2A[GPM2A == 1]                mosaicMap[GPM2A == 1] = ntProcessed            mosaicMap[(GPM2A == 1) & (GPM03 == 0)] = ntProcessed        elif self.config.algorithm == 'RADIOMETRIC_QUALITY':            # previous scene will be replaced if either:            # - the average of the current AOT or            # - the average of the current Solar Zenith Angle            # is better than the equivalent parameter of the best scene in the past:            if self.config.radiometricPreference == 'SOLAR_ZENITH':                if self.szaIsHigher():                    scl03[(GPM2A == 1)] = scl2A[(GPM2A == 1)]                    mosaicMap[GPM2A == 1] = ntProcessed                    self._isBetterScene = True                mosaicMap[(GPM2A == 1) & (GPM03 == 0)] = ntProcessed            else: # AOT:                if self.aotIsLower(GPM2A):                    scl03[(GPM2A == 1)] = scl2A[(GPM2A == 1)]                    mosaicMap[GPM2A == 1] = ntProcessed                    self._isBetterScene = True                mosaicMap[(GPM2A == 1) & (GPM03 == 0)] = ntProcessed        elif self.config.algorithm == 'AVERAGE':            # images are an average of the current good pixels and the            # good pixels of all previous scenes. Mosaic map is the per pixel sum            # of all good pixels in the past and is used for calculating the average:            mosaicMap[GPM2A == 1] = mosaicMap[GPM2A == 1] + 1        # fill always the bad pixels with good ones:        scl03[(GPM2A == 1) & (GPM03 == 0)] = scl2A[(GPM2A == 1) & (GPM03 == 0)]        # cld03[(cld2A < cld03) & (scl2A != self._noData)] = \        #     cld2A[(cld2A < cld03) & (scl2A != self._noData)]        # self.tables.setBand('L3', self.tables.CLD, cld03)        self.tables.setBand('L3', self.tables.SCL, scl03.astype(uint8))        self.tables.setBand('L3', self.tables.MSC, mosaicMap.astype(uint8))        self._goodPixelMask2A = GPM2A        self._goodPixelMask03 = GPM03        self._badPixelMask2A  = BPM2A        self._badPixelMask03  = BPM03        self._scl2A = scl2A        self._scl03 = scl03        return    def isMoreRecent(self):        ''' Check if current timestamp is more recent than any timestamp of the past:            :return: true if more recent            :rtype: bool        '''        key = 'DATE_TIME'        timestamp = self.config.L2A_UP_ID        prdMinTimeS = timestamp[45:60]        prdMinTime = time.mktime(datetime.strptime(prdMinTimeS,'%Y%m%dT%H%M%S').timetuple())        mostRecentPast = self.product.getTableVal(key)        if prdMinTime > mostRecentPast:  # more recent is better!            self.product.setTableVal(key, prdMinTime)            self._isBetterScene = True        return self._isBetterScene    def szaIsHigher(self):        ''' Check if current Solar Zenith Angle is higher than any SZA of the past:            :return: true if higher            :rtype: bool        '''        key = 'SZA_MEAN'        sza2A = self.readSolarZenithAngle('T2A')        bestSzaPast = self.product.getTableVal(key)        if sza2A > bestSzaPast:  # higher is better!            self.product.setTableVal(key, sza2A)            self._isBetterScene = True        return self._isBetterScene    def aotIsLower(self, GPM2A):        ''' Check if current Aerosol Optical Thickness is lower than any AOT of the past:            :return: true if lower            :rtype: bool        '''        key = 'AOT_MEAN'        aotArr2A = self.tables.getBand('L2A', self.tables.AOT)        aotMean2A = (aotArr2A[GPM2A == 1]).mean() * 0.001        bestAotPast = self.product.getTableVal(key)        if aotMean2A < bestAotPast:  # lower is better!            self.product.setTableVal(key, aotMean2A)            self._isBetterScene = True        return self._isBetterScene    def replaceBadPixels(self, bandIndex):        ''' Replaces the bad pixels by good ones, according to following algorithm:            1. get the bands from previous and current scene;            2. get the good pixel masks from function L3_Synthesis.setPixelMasks;            3. set the bad pixels to saturated / defective;            4. update bands according to selected algorithm:                if self.config.algorithm == 'MOST_RECENT':                    previous pixels will always be replaced with good pixels of recent scene                    if the time stamp of the recent tile is more actual than of any scene in the past;                else if self.config.algorithm == 'TEMP_HOMOGENEITY':                    previous pixels will only be replaced if sum of current good pixels                    is better than sum of good pixels of the best scene in the past;                else if self.config.algorithm == 'RADIOMETRIC_QUALITY':                    previous pixels will be replaced if either:                    - the average of the current AOT is lower or                    - the average of the current Solar Zenith Angle                    is higher than the equivalent parameter of the best classification map in the past;                else if self.config.algorithm == 'AVERAGE':                    images are an average of the current good pixels and the                    good pixels of all previous scenes. Mosaic map is the per pixel sum                    of all good pixels in the past and is used for calculating the average;            :param bandIndex: the band index.            :type bandIndex: unsigned int        '''        BL2A = self.tables.getBand('L2A', bandIndex)        BL03 = self.tables.getBand('L3', bandIndex)        GPM2A = self._goodPixelMask2A        GPM03 = self._goodPixelMask03        # fill always the bad pixels with good ones:        BL03[((GPM2A-GPM03) == 1)] = BL2A[((GPM2A-GPM03) == 1)]        if self.config.algorithm == 'MOST_RECENT':            # previous scene will always be replaced by good pixels of recent scene            # if the time stamp of the recent tile is more actual than of any scene in the past:            if self._isBetterScene:                BL03[(GPM2A == 1)] = BL2A[(GPM2A == 1)]        elif self.config.algorithm == 'TEMP_HOMOGENEITY':            # previous scene will only be replaced if sum of current good pixels            # is better than sum of good pixels of the best scene in the past:            if self._isBetterScene:                BL03[(GPM2A == 1)] = BL2A[(GPM2A == 1)]        elif self.config.algorithm == 'RADIOMETRIC_QUALITY':            # previous scene will be replaced if either:            # - the average of the current AOT or            # - the average of the current Solar Zenith Angle            # is better than the equivalent parameter of the best scene in the past:            if self._isBetterScene:                BL03[(GPM2A == 1)] = BL2A[(GPM2A == 1)]                elif self.config.algorithm == 'AVERAGE':            # new scene is an average of the current good pixels and the            # good pixels of all previous scenes:            mosaicMap = self.tables.getBand('L3', self.tables.MSC)            BL03[GPM2A == 1] = ((BL03[GPM2A == 1] * (mosaicMap[GPM2A == 1] - 1) + \                                BL2A[GPM2A == 1])) / mosaicMap[GPM2A == 1]        self.tables.setBand('L3', bandIndex, BL03)        return            def updateL3MosaicQI(self, first=False):        ''' Update the L3 Mosaic Map after each new cycle.           :param first: true if first tile.           :type first: bool        '''        # add mosaic values in list:        tilesProcessedCount = self.config.getNrTilesProcessed()        if first:            xp = L3_XmlParser(self.config, 'T03')            aotArr = self.tables.getBand('L3', self.tables.AOT)            szaMean = self.readSolarZenithAngle('T03')            TILE_ID = self.config.TILE_ID_2A            PRODUCT_ID = self.config.L2A_UP_ID_first        else:            xp = L3_XmlParser(self.config, 'T2A')            aotArr = self.tables.getBand('L2A', self.tables.AOT)            szaMean = self.readSolarZenithAngle('T2A')            TILE_ID = xp.getTree('General_Info', 'TILE_ID_2A')            if TILE_ID == False:                TILE_ID = xp.getTree('General_Info', 'TILE_ID')            PRODUCT_ID = self.config.L2A_UP_ID            TILE_ID = TILE_ID.text        mosaic = self.tables.getBand('L3', self.tables.MSC)        scenec = self.tables.getBand('L3', self.tables.SCL)        validData = [scenec != self._noData]        try:            aotMean = aotArr[(validData)].mean() * 0.001        except:            aotMean = 0        validPixelCount = float32(count_nonzero(scenec))        sensingTime = xp.getTree('General_Info', 'SENSING_TIME')        sensingTime = sensingTime.text        try:            freqMTF = itemfreq(mosaic[validData])[:,1]        except:            freqMTF = 0        percMTF = (float32(freqMTF) / validPixelCount) * 100.0        idxMoif = itemfreq(mosaic)[:, 0]        nClasses = idxMoif.max()        xMoif = arange(0, nClasses+1)        yMoif = zeros(nClasses+1, dtype=int)        yMoif[idxMoif] = itemfreq(mosaic)[:, 1]        yMoifCount = float32(yMoif.sum())        yMoifPerc = yMoif.astype(float32) / yMoifCount * 100.0        mosaicContent = objectify.Element('Mosaic_Content')        mosaicContent.attrib['tileNumber'] = str(tilesProcessedCount)        mosaicContent.append(objectify.Element('PRODUCT_ID'))        mosaicContent.append(objectify.Element('TILE_ID'))        mosaicContent.append(objectify.Element('TILE_PIXEL_COUNT'))        mosaicContent.append(objectify.Element('TILE_PIXEL_PERCENTAGE'))        mosaicContent.append(objectify.Element('TILE_DATE_TIME'))        mosaicContent.append(objectify.Element('TILE_AOT_MEAN'))        mosaicContent.append(objectify.Element('TILE_SZA_MEAN'))        mosaicContent.PRODUCT_ID = PRODUCT_ID        mosaicContent.TILE_ID = TILE_ID        mosaicContent.TILE_PIXEL_COUNT = '0'        mosaicContent.TILE_PIXEL_PERCENTAGE = '0.0'        mosaicContent.TILE_DATE_TIME = sensingTime        mosaicContent.TILE_AOT_MEAN = aotMean        mosaicContent.TILE_SZA_MEAN = szaMean        mosaicContent.TILE_SZA_MEAN.attrib['unit'] = 'deg'        xp = L3_XmlParser(self.config, 'T03')        mqi = xp.getTree('Quality_Indicators_Info', 'Mosaic_QI')        mqiLen = len(mqi)        for i in range(mqiLen):            if int(mqi[i].attrib['resolution']) == self.config.resolution:                mqi[i].append(mosaicContent)                mccLen = len(mqi[i].Mosaic_Content)                for j in range(mccLen):                    try:                        mqi[i].Mosaic_Content[j].attrib['tileNumber'] = str(xMoif[j+1])                        mqi[i].Mosaic_Content[j].TILE_PIXEL_COUNT = str(yMoif[j+1])                        mqi[i].Mosaic_Content[j].TILE_PIXEL_PERCENTAGE = str(yMoifPerc[j+1])                    except:                        scenec = self.tables.getBand('L3', self.tables.SCL)                        totalPixelCount = size(scenec)                        dataPixelCount = count_nonzero(scenec)                        dataPixelPercentage = float32(dataPixelCount) / float32(totalPixelCount) * 100.0                        mqi[i].Mosaic_Content[j].attrib['tileNumber'] = str(0)                        mqi[i].Mosaic_Content[j].TILE_PIXEL_COUNT = str(dataPixelCount)                        mqi[i].Mosaic_Content[j].TILE_PIXEL_PERCENTAGE = str(dataPixelPercentage)        xp.export()        return True    def updateL3ClassificationQI(self):        ''' Update the L3 classification QI after each new cycle        '''        scenec = self.tables.getBand('L3', self.tables.SCL)        validData = [scenec != self._noData]        mosaic = self.tables.getBand('L3', self.tables.MSC)        totalPixelCount = size(scenec)        dataPixelCount = count_nonzero(scenec)        dataPixelPercentage = float32(dataPixelCount) / float32(totalPixelCount) * 100.0        backgroundPixelCount = totalPixelCount - dataPixelCount        backgroundPixelPercentage = float32(100.0 - dataPixelPercentage)        goodPixelCount = count_nonzero(mosaic)        goodPixelPercentage = float32(goodPixelCount) / float32(dataPixelCount) * 100.0        badPixelCount = size(mosaic) - goodPixelCount - backgroundPixelCount        badPixelPercentage = float32(badPixelCount) / float32(dataPixelCount) * 100.0        freqSCF = zeros([12], dtype=uint32)        idxSCF = itemfreq(scenec[validData])[:,0]        freqSCF[idxSCF] = itemfreq(scenec[validData])[:,1]                           percSCF = freqSCF.astype(float32) / float32(dataPixelCount) * 100.0        classificationQI = objectify.Element('Classification_QI')        classificationQI.attrib['resolution'] = str(self.config.resolution)        classificationQI.append(objectify.Element('TOTAL_PIXEL_COUNT'))        classificationQI.append(objectify.Element('DATA_PIXEL_COUNT'))        classificationQI.append(objectify.Element('DATA_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('NODATA_PIXEL_COUNT'))        classificationQI.append(objectify.Element('NODATA_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('GOOD_PIXEL_COUNT'))        classificationQI.append(objectify.Element('GOOD_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('BAD_PIXEL_COUNT'))        classificationQI.append(objectify.Element('BAD_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('SATURATED_DEFECTIVE_PIXEL_COUNT'))        classificationQI.append(objectify.Element('SATURATED_DEFECTIVE_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('DARK_FEATURES_COUNT'))        classificationQI.append(objectify.Element('DARK_FEATURES_PERCENTAGE'))        classificationQI.append(objectify.Element('CLOUD_SHADOWS_COUNT'))        classificationQI.append(objectify.Element('CLOUD_SHADOWS_PERCENTAGE'))        classificationQI.append(objectify.Element('VEGETATION_COUNT'))        classificationQI.append(objectify.Element('VEGETATION_PERCENTAGE'))        classificationQI.append(objectify.Element('NOT_VEGETATED_COUNT'))        classificationQI.append(objectify.Element('NOT_VEGETATED_PERCENTAGE'))        classificationQI.append(objectify.Element('WATER_COUNT'))        classificationQI.append(objectify.Element('WATER_PERCENTAGE'))        classificationQI.append(objectify.Element('UNCLASSIFIED_COUNT'))        classificationQI.append(objectify.Element('UNCLASSIFIED_PERCENTAGE'))        classificationQI.append(objectify.Element('MEDIUM_PROBA_CLOUDS_COUNT'))        classificationQI.append(objectify.Element('MEDIUM_PROBA_CLOUDS_PERCENTAGE'))        classificationQI.append(objectify.Element('HIGH_PROBA_CLOUDS_COUNT'))        classificationQI.append(objectify.Element('HIGH_PROBA_CLOUDS_PERCENTAGE'))        classificationQI.append(objectify.Element('THIN_CIRRUS_COUNT'))        classificationQI.append(objectify.Element('THIN_CIRRUS_PERCENTAGE'))        classificationQI.append(objectify.Element('SNOW_ICE_COUNT'))        classificationQI.append(objectify.Element('SNOW_ICE_PERCENTAGE'))        classificationQI.TOTAL_PIXEL_COUNT = totalPixelCount        classificationQI.DATA_PIXEL_COUNT = dataPixelCount        classificationQI.DATA_PIXEL_PERCENTAGE = dataPixelPercentage        classificationQI.NODATA_PIXEL_COUNT = backgroundPixelCount        classificationQI.NODATA_PIXEL_PERCENTAGE = backgroundPixelPercentage        classificationQI.GOOD_PIXEL_COUNT = goodPixelCount        classificationQI.GOOD_PIXEL_PERCENTAGE = goodPixelPercentage        classificationQI.BAD_PIXEL_COUNT = badPixelCount        classificationQI.BAD_PIXEL_PERCENTAGE = badPixelPercentage        classificationQI.SATURATED_DEFECTIVE_PIXEL_COUNT = freqSCF[self._saturatedDefective]        classificationQI.SATURATED_DEFECTIVE_PIXEL_PERCENTAGE = percSCF[self._saturatedDefective]        classificationQI.DARK_FEATURES_COUNT = freqSCF[self._darkFeatures]        classificationQI.DARK_FEATURES_PERCENTAGE = percSCF[self._darkFeatures]        classificationQI.CLOUD_SHADOWS_COUNT = freqSCF[self._cloudShadows]        classificationQI.CLOUD_SHADOWS_PERCENTAGE = percSCF[self._cloudShadows]        classificationQI.VEGETATION_COUNT = freqSCF[self._vegetation]        classificationQI.VEGETATION_PERCENTAGE = percSCF[self._vegetation]        classificationQI.NOT_VEGETATED_COUNT = freqSCF[self._notVegetated]        classificationQI.NOT_VEGETATED_PERCENTAGE = percSCF[self._notVegetated]        classificationQI.WATER_COUNT = freqSCF[self._water]        classificationQI.WATER_PERCENTAGE = percSCF[self._water]        classificationQI.UNCLASSIFIED_COUNT = freqSCF[self._unclassified]        classificationQI.UNCLASSIFIED_PERCENTAGE = percSCF[self._unclassified]        classificationQI.MEDIUM_PROBA_CLOUDS_COUNT = freqSCF[self._medProbaClouds]        classificationQI.MEDIUM_PROBA_CLOUDS_PERCENTAGE = percSCF[self._medProbaClouds]        classificationQI.HIGH_PROBA_CLOUDS_COUNT = freqSCF[self._highProbaClouds]        classificationQI.HIGH_PROBA_CLOUDS_PERCENTAGE = percSCF[self._highProbaClouds]        classificationQI.THIN_CIRRUS_COUNT = freqSCF[self._thinCirrus]        classificationQI.THIN_CIRRUS_PERCENTAGE = percSCF[self._thinCirrus]        classificationQI.SNOW_ICE_COUNT = freqSCF[self._snowIce]        classificationQI.SNOW_ICE_PERCENTAGE = percSCF[self._snowIce]        xp = L3_XmlParser(self.config, 'T03')        l3qi = xp.getTree('Quality_Indicators_Info', 'Classification_QI')        l3qiLen = len(l3qi)        for i in range(l3qiLen):            if int(l3qi[i].attrib['resolution']) == self.config.resolution:                l3qi[i].clear()                l3qi[i] = classificationQI                xp.export()                self.product.updateTableRow(classificationQI)                break        return True    def readSolarZenithAngle(self, productStr):        ''' Helper class for reading the mean solar zenith angle from metadata            :param productStr: [L2A | L3].            :type productStr: str            :return: solar zenith angle            :rtype: unsigned float        '''        xp = L3_XmlParser(self.config, productStr)        ang = xp.getTree('Geometric_Info', 'Tile_Angles')        sza = float32(ang.Mean_Sun_Angle.ZENITH_ANGLE.text)        sza = absolute(sza)        if sza > 70.0: sza = 70.0        return sza    def preProcessing(self):        ''' Performs the pre processing, updates the pixel mask        '''        self.config.timestamp('L3_Synthesis: pre processing')        self.setPixelMasks()        if self._display is not None:            self._display.displayData(self.tables)        return    def forwardProcessing(self):        ''' This is the default processing routine: it removes clouds and dark features            from an input image. Calls the routine replaceBadPixels and updates the statistic        '''        for i in self.tables.bandIndex:            self.replaceBadPixels(i)        self.updateL3ClassificationQI()        self.updateL3MosaicQI()        if self._display is not None:            self._display.displayData(self.tables)        return    def postProcessing(self):        ''' Performs a validation of the metadada and prepares a statistics display, if activated        '''        self.product.postProcessing()        self.config.timestamp('L3_Synthesis: post processing')        # Output product shall be aligned to latest product version, currently 14.5:        self.config.productVersion = '14.5'        self.config.setSchemes()        # validate the meta data:        xp = L3_XmlParser(self.config, 'UP03')        xp.validate()        xp = L3_XmlParser(self.config, 'T03')        xp.validate()        xp = L3_XmlParser(self.config, 'DS03')        xp.validate()        return        def __exit__(self):        sys.exit(-1)    def __del__(self):        self.config.logger.info('Module L3_Synthesis deleted')            def process(self, tables):        ''' Triggers pre -, processing and post processing        '''        ts = time.time()        self.tables = tables        self.product = tables.product        self.config = tables.product.config        self.preProcessing()        self.forwardProcessing()        tDelta = time.time() - ts        self.config.logger.info('Procedure L3_Synthesis: overall time [s]: %0.3f' % tDelta)        if(self.config.loglevel == 'DEBUG'):            stdoutWrite('Procedure L3_Synthesis: overall time[s]: %0.3f\n' % tDelta)        return True
\ No newline at end of file
+#!/usr/bin/env pythonfrom numpy import *import timefrom datetime import datetimefrom lxml import objectifyfrom L3_Library import stdoutWrite, showImagefrom L3_XmlParser import L3_XmlParserfrom L3_Tables import readBlockIndex# the reasons for skipping a scene, see canContribute:NO_USABLE_PIXELS = 'scene contains no usable pixels'NOT_BETTER = 'scene is not better than the mosaic'class L3_Synthesis(object):    ''' Performs the spatio temporal algorithms.        All algorithms are processed in row blocks of the tile, thus the memory        consumption is independent of the resolution.        :param config: the config object for the current tile (via __init__).        :type config: a reference to the L3_Config object.    '''    def __init__(self, config):        self._config = config        self._product = None        self._tables = None        self._pixelMasks = []        self._classFreq = None        self._mosaicFreq = None        self._aotMean = 0        self._isBetterScene = False        self._bestSZA = 0.0        self._bestAOT = 1.0        self._noData = self.config.classifier['NO_DATA']        self._saturatedDefective = self.config.classifier['SATURATED_DEFECTIVE']        self._darkFeatures = self.config.classifier['DARK_FEATURES']        self._notVegetated = self.config.classifier['NOT_VEGETATED']        self._snowIce = self.config.classifier['SNOW_ICE']        self._vegetation = self.config.classifier['VEGETATION']        self._water = self.config.classifier['WATER']        self._unclassified = self.config.classifier['UNCLASSIFIED']        self._medProbaClouds = self.config.classifier['MEDIUM_PROBA_CLOUDS']        self._highProbaClouds = self.config.classifier['HIGH_PROBA_CLOUDS']        self._thinCirrus = self.config.classifier['THIN_CIRRUS']        self._cloudShadows = self.config.classifier['CLOUD_SHADOWS']        # created at first use, as the display imports matplotlib:        self._display = None        self.config.logger.debug('Module L3_STP initialized')        self._processingStatus = True    def get_config(self):        return self._config    def get_product(self):        return self._product    def get_tables(self):        return self._tables    def set_config(self, value):        self._config = value    def set_product(self, value):        self._product = value    def set_tables(self, value):        self._tables = value    def del_config(self):        del self._config    def del_product(self):        del self._product    def del_tables(self):        del self._tables    config = property(get_config, set_config, del_config)    product = property(get_product, set_product, del_product)    tables = property(get_tables, set_tables, del_tables)    def displayData(self):        ''' Displays the scene classification and the mosaic map, if configured.        '''        if not self._config.displayData:            return        if self._display is None:            from L3_Display import L3_Display            self._display = L3_Display(self._config)        self._display.displayData(self.tables)        return    def classifyPixels(self, scl2A, scl03):        ''' Classifies the pixels of a row block into good and bad pixels,            according to the scene classification of the current and the previous scene.            If 'better' features already exist in the previous scene,            these are kept in the scene classification of the current scene.            :param scl2A: the scene classification of the current scene, will be updated.            :type scl2A: a 2 dimensional numpy array of type unsigned int 8            :param scl03: the scene classification of the previous scene.            :type scl03: a 2 dimensional numpy array of type unsigned int 8            :return: the bad pixel masks of the current and the previous scene.            :rtype: a tuple of 2 dimensional numpy arrays of type unsigned int 8        '''        notVegetated = self._notVegetated        vegetation = self._vegetation        water = self._water        cirrus = self._thinCirrus        darkFeatures = self._darkFeatures        cloudShadows = self._cloudShadows        unclassified = self._unclassified        medProbaClouds = self._medProbaClouds        highProbaClouds = self._highProbaClouds        snowIce = self._snowIce        BPM2A = ones_like(scl2A)        BPM03 = ones_like(scl03)        BPM2A[(scl2A == notVegetated) | (scl2A == vegetation) | (scl2A == water)] = 0        BPM03[(scl03 == notVegetated) | (scl03 == vegetation) | (scl03 == water)] = 0        if self.config.cirrusRemoval == False:            BPM2A[scl2A == cirrus] = 0            BPM03[scl03 == cirrus] = 0        if self.config.shadowRemoval == False:            BPM2A[(scl2A == darkFeatures) | (scl2A == cloudShadows)] = 0            BPM03[(scl03 == darkFeatures) | (scl03 == cloudShadows)] = 0        if self.config.snowRemoval == False:            BPM2A[scl2A == snowIce] = 0            BPM03[scl03 == snowIce] = 0        # Create a hierachy of cloud probability in scene class and replace, if less:        BPM2A[(scl2A == cirrus) & (BPM03 == 1)] = 0        BPM2A[(scl2A == medProbaClouds) & (scl03 == highProbaClouds)] = 0        BPM2A[(scl2A == unclassified) & ((scl03 == medProbaClouds) | (scl03 == highProbaClouds))] = 0        BPM2A[(scl2A == darkFeatures) & ((scl03 == medProbaClouds) | (scl03 == highProbaClouds))] = 0        BPM2A[(scl2A == snowIce) & ((scl03 == medProbaClouds) | (scl03 == highProbaClouds))] = 0        BPM03[(scl03 == cirrus) & (BPM2A == 1)] = 0        BPM03[(scl03 == medProbaClouds) & (scl2A == highProbaClouds)] = 0        BPM03[(scl03 == unclassified) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = 0        BPM03[(scl03 == darkFeatures) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = 0        BPM03[(scl03 == snowIce) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = 0        # If 'better' features already exist, keep these:        scl2A[(scl03 == cirrus) & (BPM2A == 1)] = cirrus        scl2A[(scl03 == medProbaClouds) & (scl2A == highProbaClouds)] = medProbaClouds        scl2A[(scl03 == unclassified) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = unclassified        scl2A[(scl03 == darkFeatures) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = darkFeatures        scl2A[(scl03 == snowIce) & ((scl2A == medProbaClouds) | (scl2A == highProbaClouds))] = snowIce        return BPM2A, BPM03    def filterPixelMasks(self, BPM2A, BPM03):        ''' Applies the median filter to the bad pixel masks, if configured.            The filter needs a margin of medianFilter / 2 + 1 rows around the block            to give identical results as a filter on the whole tile.            :param BPM2A: the bad pixel mask of the current scene.            :type BPM2A: a 2 dimensional numpy array of type unsigned int 8            :param BPM03: the bad pixel mask of the previous scene.            :type BPM03: a 2 dimensional numpy array of type unsigned int 8            :return: the filtered bad pixel masks.            :rtype: a tuple of 2 dimensional numpy arrays of type unsigned int 8        '''        mf = self.config.medianFilter        if mf > 0:            from scipy import ndimage            from scipy.ndimage.morphology import generate_binary_structure            # binary dilation first, to increase shape:            struct = generate_binary_structure(2, 1)            BPM2A = ndimage.binary_dilation(BPM2A, struct).astype(BPM2A.dtype)            BPM03 = ndimage.binary_dilation(BPM03, struct).astype(BPM03.dtype)            # now the median filter:            BPM2A = self.tables.medianFilter(BPM2A, self.config.nrThreads)            BPM03 = self.tables.medianFilter(BPM03, self.config.nrThreads)        return BPM2A, BPM03    def getPixelMasks(self, block, shape):        ''' Unpacks the good pixel masks of a row block, as stored by setPixelMasks.            :param block: the packed row block (rowStart, rowStop, GPM2A, GPM03).            :type block: tuple            :param shape: the shape of the row block.            :type shape: tuple            :return: the good pixel masks of the current and the previous scene.            :rtype: a tuple of 2 dimensional numpy arrays of type unsigned int 8        '''        nPixels = shape[0] * shape[1]        GPM2A = unpackbits(block[2])[:nPixels].reshape(shape)        GPM03 = unpackbits(block[3])[:nPixels].reshape(shape)        return GPM2A, GPM03    def getCleanBlocks(self, index, margin):        ''' Get the row blocks of the L3 scene, which contain good pixels only.            A pixel of the L3 scene is good regardless of the current scene, if its class            is vegetation, not vegetated or water, or a class for which no removal is configured.            As the filtered pixel masks depend on a margin of neighbouring rows,            the neighbouring row blocks must be clean as well.            :param index: the row block index of the L3 scene classification, see L3_Tables.getBlockIndex.            :type index: a 2 dimensional numpy array (nblocks x 32) of type unsigned int 8            :param margin: the margin of neighbouring rows for the median filter.            :type margin: unsigned int            :return: true for each clean row block.            :rtype: a 1 dimensional numpy array of type bool        '''        goodClasses = zeros(256, dtype=bool)        goodClasses[[self._notVegetated, self._vegetation, self._water]] = True        if self.config.cirrusRemoval == False:            goodClasses[self._thinCirrus] = True        if self.config.shadowRemoval == False:            goodClasses[[self._darkFeatures, self._cloudShadows]] = True        if self.config.snowRemoval == False:            goodClasses[self._snowIce] = True        present = unpackbits(index, axis=1).astype(bool)        clean = (present & ~goodClasses).any(axis=1) == False        if margin > 0:            neighbours = clean.copy()            clean[1:] &= neighbours[:-1]            clean[:-1] &= neighbours[1:]        return clean    def getAotBlock(self, productLevel, rowStart, rowStop, shape):        ''' Get a row block of the AOT map in the geometry of the scene classification.            If the AOT map has a lower resolution (10 m tiles use the 20 m AOT),            it is resampled by nearest neighbour.            :param productLevel: [ L2A | L3].            :type productLevel: str            :param rowStart: first row of the block.            :type rowStart: unsigned int            :param rowStop: last row of the block + 1.            :type rowStop: unsigned int            :param shape: the size of the whole scene classification (nrows x ncols).            :type shape: tuple            :return: the AOT pixel data, false if AOT is not present.            :rtype: a 2 dimensional numpy array of type unsigned int 16        '''        size = self.tables.getBandSize(productLevel, self.tables.AOT)        if size == False:            return False        if size == shape:            return self.tables.getBandBlock(productLevel, self.tables.AOT, rowStart, rowStop)        rows = arange(rowStart, rowStop) * size[0] / shape[0]        cols = arange(shape[1]) * size[1] / shape[1]        aot = self.tables.getBandBlock(productLevel, self.tables.AOT, rows[0], rows[-1] + 1)        return aot[rows - rows[0]][:, cols]    def setPixelMasks(self):        ''' Sets the pixel masks according to following algorithm:            1. initialize good and bad pixels;            2. create mosaic map, if not exist, else read from L3_Tables;            3. check if the current scene is better than the scenes in the past, according to selected algorithm:                if self.config.algorithm == 'MOST_RECENT':                    previous classification map will always be replaced with good pixels of recent classification map                    if the time stamp of the recent tile is more actual than of any scene in the past;                else if self.config.algorithm == 'TEMP_HOMOGENEITY':                    previous classification map will only be replaced if sum of current good pixels                    is better than sum of good pixels of the best classification map in the past;                else if self.config.algorithm == 'RADIOMETRIC_QUALITY':                    previous classification map will be replaced if either:                    - the average of the current AOT is lower or                    - the average of the current Solar Zenith Angle                    is higher than the equivalent parameter of the best classification map in the past;                else if self.config.algorithm == 'AVERAGE':                    images are an average of the current good pixels and the                    good pixels of all previous scenes. Mosaic map is the per pixel sum                    of all good pixels in the past and is used for calculating the average;            4. store good pixel masks per row block, bit packed, for the subsequent forward processing;            5. row blocks of the L3 scene which contain good pixels only, according to the row block index               of the database, remain unchanged if the current scene is not better and the algorithm               is not 'AVERAGE'. For these no pixel masks are stored and the forward processing skips them.               If the decision on the better scene does not depend on the pixel masks ('MOST_RECENT',               'SOLAR_ZENITH'), it is taken in advance and clean row blocks are not even classified.            The update of mosaic map and scene classification map is performed in forwardProcessing.        '''        self._isBetterScene = False        self._pixelMasks = []        algorithm = self.config.algorithm        SCL = self.tables.SCL        MSC = self.tables.MSC        ntProcessed = self.config.getNrTilesProcessed()        self.config.timestamp('L3_Process: nr processed tiles: %d' % ntProcessed)        shape = self.tables.getBandSize('L3', SCL)        nrows = shape[0]        # the median filter needs a margin of neighbouring rows:        mf = self.config.medianFilter        if mf > 0:            margin = mf / 2 + 1        else:            margin = 0        # Create mosaic map if not exist, else read from table:        createMosaic = self.tables.testBand('L3', MSC) == False        if createMosaic:            self.tables.createBand('L3', MSC, shape, uint8)        # row blocks containing good pixels only can be skipped, if the scene is not better:        rowBlocks = self.tables.getRowBlocks(nrows)        index = False        if not createMosaic and algorithm != 'AVERAGE':            index = self.tables.getBlockIndex()        if index is False:            clean = zeros(len(rowBlocks), dtype=bool)        else:            clean = self.getCleanBlocks(index, margin)        decided = False        if algorithm == 'MOST_RECENT':            # previous scene will always be replaced by good pixels of recent scene            # if the time stamp of the recent tile is more actual than of any scene in the past:            self.isMoreRecent()            decided = True        elif algorithm == 'RADIOMETRIC_QUALITY' and self.config.radiometricPreference == 'SOLAR_ZENITH':            self.szaIsHigher()            decided = True        classFreq = zeros(256, dtype=int64)        mosaicFreq = zeros(256, dtype=int64)        goodFreq = zeros(256, dtype=int64)        GP2Asum = 0        aotSum = 0.0        aotCount = 0        for blockNr, (rowStart, rowStop) in enumerate(rowBlocks):            if decided and clean[blockNr] and not self._isBetterScene:                self._pixelMasks.append((rowStart, rowStop, None, None))                continue            marginStart = max(rowStart - margin, 0)            marginStop = min(rowStop + margin, nrows)            scl2A = self.tables.getBandBlock('L2A', SCL, marginStart, marginStop)            scl03 = self.tables.getBandBlock('L3', SCL, marginStart, marginStop)            BPM2A, BPM03 = self.filterPixelMasks(*self.classifyPixels(scl2A, scl03))            rows = slice(rowStart - marginStart, rowStop - marginStart)            GPM2A = 1 - BPM2A[rows]            GPM03 = 1 - BPM03[rows]            scl03 = scl03[rows]            self._pixelMasks.append((rowStart, rowStop, packbits(GPM2A), packbits(GPM03)))            if createMosaic:                mosaicMap = zeros_like(GPM03)                mosaicMap[GPM03 == 1] = 1                self.tables.setBandBlock('L3', MSC, rowStart, mosaicMap.astype(uint8))                classFreq += self.tables.getBlockHistogram(scl03)                mosaicFreq += self.tables.getBlockHistogram(mosaicMap)                aotArr = self.getAotBlock('L3', rowStart, rowStop, shape)                if aotArr is not False:                    validData = scl03 != self._noData                    aotSum += aotArr[validData].sum(dtype=float64)                    aotCount += count_nonzero(validData)            else:                mosaicMap = self.tables.getBandBlock('L3', MSC, rowStart, rowStop)            if algorithm == 'TEMP_HOMOGENEITY':                GP2Asum += count_nonzero(GPM2A)                goodFreq += bincount(mosaicMap[GPM03 == 1], minlength=256)        if createMosaic:            self._classFreq = classFreq            self._mosaicFreq = mosaicFreq            self._aotMean = aotSum / aotCount * 0.001 if aotCount > 0 else 0            self.updateL3MosaicQI(first=True)            self.displayData()        if algorithm == 'TEMP_HOMOGENEITY':            # previous scene will only be replaced if sum of current good pixels            # is better than sum of good pixels of the best scene in the past:            bestScenePast = goodFreq.max()            if GP2Asum > bestScenePast:                self._isBetterScene = True        elif algorithm == 'RADIOMETRIC_QUALITY':            # previous scene will be replaced if either:            # - the average of the current AOT or            # - the average of the current Solar Zenith Angle            # is better than the equivalent parameter of the best scene in the past:            if self.config.radiometricPreference != 'SOLAR_ZENITH':                self.aotIsLower()        if not self._isBetterScene:            # the clean row blocks remain unchanged:            self._pixelMasks = [(block[0], block[1], None, None) if clean[blockNr] else block                                for blockNr, block in enumerate(self._pixelMasks)]        skipped = count_nonzero([block[2] is None for block in self._pixelMasks])        self.config.timestamp('L3_Synthesis: %d of %d row blocks are clean and skipped' % (skipped, len(rowBlocks)))        return    def getObservationTime(self):        ''' Get the observation start time of the current scene from the user product ID.            :return: the observation start time in seconds since the epoch.            :rtype: float        '''        prdMinTimeS = self.config.L2A_UP_ID[45:60]        return time.mktime(datetime.strptime(prdMinTimeS,'%Y%m%dT%H%M%S').timetuple())    def isMoreRecent(self):        ''' Check if current timestamp is more recent than any timestamp of the past:            :return: true if more recent            :rtype: bool        '''        key = 'DATE_TIME'        prdMinTime = self.getObservationTime()        # the best value is shared with the other processes of the tile parallel processing:        with self.config.lock:            mostRecentPast = self.product.getTableVal(key)            if prdMinTime > mostRecentPast:  # more recent is better!                self.product.setTableVal(key, prdMinTime)                self._isBetterScene = True        return self._isBetterScene    def szaIsHigher(self):        ''' Check if current Solar Zenith Angle is higher than any SZA of the past:            :return: true if higher            :rtype: bool        '''        key = 'SZA_MEAN'        sza2A = self.readSolarZenithAngle('T2A')        with self.config.lock:            bestSzaPast = self.product.getTableVal(key)            if sza2A > bestSzaPast:  # higher is better!                self.product.setTableVal(key, sza2A)                self._isBetterScene = True        return self._isBetterScene    def aotIsLower(self):        ''' Check if current Aerosol Optical Thickness is lower than any AOT of the past.            The AOT mean is taken over the good pixels of the current scene,            as stored by setPixelMasks.            :return: true if lower            :rtype: bool        '''        key = 'AOT_MEAN'        shape = self.tables.getBandSize('L2A', self.tables.SCL)        aotSum = 0.0        aotCount = 0        for block in self._pixelMasks:            rowStart, rowStop = block[:2]            aotArr2A = self.getAotBlock('L2A', rowStart, rowStop, shape)            if aotArr2A is False:                return self._isBetterScene            GPM2A = self.getPixelMasks(block, aotArr2A.shape)[0]            aotSum += aotArr2A[GPM2A == 1].sum(dtype=float64)            aotCount += count_nonzero(GPM2A)        if aotCount == 0:            return self._isBetterScene        aotMean2A = aotSum / aotCount * 0.001        with self.config.lock:            bestAotPast = self.product.getTableVal(key)            if aotMean2A < bestAotPast:  # lower is better!                self.product.setTableVal(key, aotMean2A)                self._isBetterScene = True        return self._isBetterScene    def replaceBadPixels(self, bandIndex, rowStart, rowStop, GPM2A, GPM03, mosaicMap):        ''' Replaces the bad pixels of a row block by good ones, according to following algorithm:            1. get the row blocks from previous and current scene;            2. get the good pixel masks from function L3_Synthesis.setPixelMasks;            3. update bands according to selected algorithm:                if self.config.algorithm == 'MOST_RECENT':                    previous pixels will always be replaced with good pixels of recent scene                    if the time stamp of the recent tile is more actual than of any scene in the past;                else if self.config.algorithm == 'TEMP_HOMOGENEITY':                    previous pixels will only be replaced if sum of current good pixels                    is better than sum of good pixels of the best scene in the past;                else if self.config.algorithm == 'RADIOMETRIC_QUALITY':                    previous pixels will be replaced if either:                    - the average of the current AOT is lower or                    - the average of the current Solar Zenith Angle                    is higher than the equivalent parameter of the best classification map in the past;                else if self.config.algorithm == 'AVERAGE':                    images are an average of the current good pixels and the                    good pixels of all previous scenes. Mosaic map is the per pixel sum                    of all good pixels in the past and is used for calculating the average;            :param bandIndex: the band index.            :type bandIndex: unsigned int            :param rowStart: first row of the block.            :type rowStart: unsigned int            :param rowStop: last row of the block + 1.            :type rowStop: unsigned int            :param GPM2A: the good pixel mask of the current scene.            :type GPM2A: a 2 dimensional numpy array of type unsigned int 8            :param GPM03: the good pixel mask of the previous scene.            :type GPM03: a 2 dimensional numpy array of type unsigned int 8            :param mosaicMap: the updated mosaic map of the row block.            :type mosaicMap: a 2 dimensional numpy array of type unsigned int 8        '''        BL2A = self.tables.getBandBlock('L2A', bandIndex, rowStart, rowStop)        BL03 = self.tables.getBandBlock('L3', bandIndex, rowStart, rowStop)        if (BL2A is False) or (BL03 is False):            return        # fill always the bad pixels with good ones:        fill = (GPM2A == 1) & (GPM03 == 0)        BL03[fill] = BL2A[fill]        if self.config.algorithm == 'AVERAGE':            # new scene is an average of the current good pixels and the            # good pixels of all previous scenes:            good = GPM2A == 1            count = mosaicMap[good].astype(uint32)            BL03[good] = (BL03[good].astype(uint32) * (count - 1) + BL2A[good]) / count        elif self._isBetterScene:            # MOST_RECENT, TEMP_HOMOGENEITY and RADIOMETRIC_QUALITY:            # previous scene will be replaced by good pixels of a better scene:            BL03[(GPM2A == 1)] = BL2A[(GPM2A == 1)]        self.tables.setBandBlock('L3', bandIndex, rowStart, BL03)        return    def updateL3MosaicQI(self, first=False):        ''' Update the L3 Mosaic Map after each new cycle.            Uses the histograms of the mosaic map and the scene classification,            collected during the row block processing.           :param first: true if first tile.           :type first: bool        '''        # add mosaic values in list:        tilesProcessedCount = self.config.getNrTilesProcessed()        if first:            xp = L3_XmlParser(self.config, 'T03')            szaMean = self.readSolarZenithAngle('T03')            TILE_ID = self.config.TILE_ID_2A            PRODUCT_ID = self.config.L2A_UP_ID_first        else:            xp = L3_XmlParser(self.config, 'T2A')            szaMean = self.readSolarZenithAngle('T2A')            TILE_ID = xp.getTree('General_Info', 'TILE_ID_2A')            if TILE_ID == False:                TILE_ID = xp.getTree('General_Info', 'TILE_ID')            PRODUCT_ID = self.config.L2A_UP_ID            TILE_ID = TILE_ID.text        aotMean = self._aotMean        sensingTime = xp.getTree('General_Info', 'SENSING_TIME')        sensingTime = sensingTime.text        nClasses = flatnonzero(self._mosaicFreq).max()        xMoif = arange(0, nClasses+1)        yMoif = self._mosaicFreq[:nClasses+1]        yMoifCount = float32(yMoif.sum())        yMoifPerc = yMoif.astype(float32) / yMoifCount * 100.0        mosaicContent = objectify.Element('Mosaic_Content')        mosaicContent.attrib['tileNumber'] = str(tilesProcessedCount)        mosaicContent.append(objectify.Element('PRODUCT_ID'))        mosaicContent.append(objectify.Element('TILE_ID'))        mosaicContent.append(objectify.Element('TILE_PIXEL_COUNT'))        mosaicContent.append(objectify.Element('TILE_PIXEL_PERCENTAGE'))        mosaicContent.append(objectify.Element('TILE_DATE_TIME'))        mosaicContent.append(objectify.Element('TILE_AOT_MEAN'))        mosaicContent.append(objectify.Element('TILE_SZA_MEAN'))        mosaicContent.PRODUCT_ID = PRODUCT_ID        mosaicContent.TILE_ID = TILE_ID        mosaicContent.TILE_PIXEL_COUNT = '0'        mosaicContent.TILE_PIXEL_PERCENTAGE = '0.0'        mosaicContent.TILE_DATE_TIME = sensingTime        mosaicContent.TILE_AOT_MEAN = aotMean        mosaicContent.TILE_SZA_MEAN = szaMean        mosaicContent.TILE_SZA_MEAN.attrib['unit'] = 'deg'        xp = L3_XmlParser(self.config, 'T03')        mqi = xp.getTree('Quality_Indicators_Info', 'Mosaic_QI')        mqiLen = len(mqi)        for i in range(mqiLen):            if int(mqi[i].attrib['resolution']) == self.config.resolution:                mqi[i].append(mosaicContent)                mccLen = len(mqi[i].Mosaic_Content)                for j in range(mccLen):                    try:                        mqi[i].Mosaic_Content[j].attrib['tileNumber'] = str(xMoif[j+1])                        mqi[i].Mosaic_Content[j].TILE_PIXEL_COUNT = str(yMoif[j+1])                        mqi[i].Mosaic_Content[j].TILE_PIXEL_PERCENTAGE = str(yMoifPerc[j+1])                    except:                        totalPixelCount = self._classFreq.sum()                        dataPixelCount = totalPixelCount - self._classFreq[0]                        dataPixelPercentage = float32(dataPixelCount) / float32(totalPixelCount) * 100.0                        mqi[i].Mosaic_Content[j].attrib['tileNumber'] = str(0)                        mqi[i].Mosaic_Content[j].TILE_PIXEL_COUNT = str(dataPixelCount)                        mqi[i].Mosaic_Content[j].TILE_PIXEL_PERCENTAGE = str(dataPixelPercentage)        xp.export()        return True    def updateL3ClassificationQI(self):        ''' Update the L3 classification QI after each new cycle.            Uses the histograms of the mosaic map and the scene classification,            collected during the row block processing.        '''        classFreq = self._classFreq        totalPixelCount = int(classFreq.sum())        dataPixelCount = totalPixelCount - int(classFreq[0])        dataPixelPercentage = float32(dataPixelCount) / float32(totalPixelCount) * 100.0        backgroundPixelCount = totalPixelCount - dataPixelCount        backgroundPixelPercentage = float32(100.0 - dataPixelPercentage)        goodPixelCount = totalPixelCount - int(self._mosaicFreq[0])        goodPixelPercentage = float32(goodPixelCount) / float32(dataPixelCount) * 100.0        badPixelCount = totalPixelCount - goodPixelCount - backgroundPixelCount        badPixelPercentage = float32(badPixelCount) / float32(dataPixelCount) * 100.0        freqSCF = classFreq.copy()        freqSCF[self._noData] = 0        percSCF = freqSCF.astype(float32) / float32(dataPixelCount) * 100.0        classificationQI = objectify.Element('Classification_QI')        classificationQI.attrib['resolution'] = str(self.config.resolution)        classificationQI.append(objectify.Element('TOTAL_PIXEL_COUNT'))        classificationQI.append(objectify.Element('DATA_PIXEL_COUNT'))        classificationQI.append(objectify.Element('DATA_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('NODATA_PIXEL_COUNT'))        classificationQI.append(objectify.Element('NODATA_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('GOOD_PIXEL_COUNT'))        classificationQI.append(objectify.Element('GOOD_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('BAD_PIXEL_COUNT'))        classificationQI.append(objectify.Element('BAD_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('SATURATED_DEFECTIVE_PIXEL_COUNT'))        classificationQI.append(objectify.Element('SATURATED_DEFECTIVE_PIXEL_PERCENTAGE'))        classificationQI.append(objectify.Element('DARK_FEATURES_COUNT'))        classificationQI.append(objectify.Element('DARK_FEATURES_PERCENTAGE'))        classificationQI.append(objectify.Element('CLOUD_SHADOWS_COUNT'))        classificationQI.append(objectify.Element('CLOUD_SHADOWS_PERCENTAGE'))        classificationQI.append(objectify.Element('VEGETATION_COUNT'))        classificationQI.append(objectify.Element('VEGETATION_PERCENTAGE'))        classificationQI.append(objectify.Element('NOT_VEGETATED_COUNT'))        classificationQI.append(objectify.Element('NOT_VEGETATED_PERCENTAGE'))        classificationQI.append(objectify.Element('WATER_COUNT'))        classificationQI.append(objectify.Element('WATER_PERCENTAGE'))        classificationQI.append(objectify.Element('UNCLASSIFIED_COUNT'))        classificationQI.append(objectify.Element('UNCLASSIFIED_PERCENTAGE'))        classificationQI.append(objectify.Element('MEDIUM_PROBA_CLOUDS_COUNT'))        classificationQI.append(objectify.Element('MEDIUM_PROBA_CLOUDS_PERCENTAGE'))        classificationQI.append(objectify.Element('HIGH_PROBA_CLOUDS_COUNT'))        classificationQI.append(objectify.Element('HIGH_PROBA_CLOUDS_PERCENTAGE'))        classificationQI.append(objectify.Element('THIN_CIRRUS_COUNT'))        classificationQI.append(objectify.Element('THIN_CIRRUS_PERCENTAGE'))        classificationQI.append(objectify.Element('SNOW_ICE_COUNT'))        classificationQI.append(objectify.Element('SNOW_ICE_PERCENTAGE'))        classificationQI.TOTAL_PIXEL_COUNT = totalPixelCount        classificationQI.DATA_PIXEL_COUNT = dataPixelCount        classificationQI.DATA_PIXEL_PERCENTAGE = dataPixelPercentage        classificationQI.NODATA_PIXEL_COUNT = backgroundPixelCount        classificationQI.NODATA_PIXEL_PERCENTAGE = backgroundPixelPercentage        classificationQI.GOOD_PIXEL_COUNT = goodPixelCount        classificationQI.GOOD_PIXEL_PERCENTAGE = goodPixelPercentage        classificationQI.BAD_PIXEL_COUNT = badPixelCount        classificationQI.BAD_PIXEL_PERCENTAGE = badPixelPercentage        classificationQI.SATURATED_DEFECTIVE_PIXEL_COUNT = freqSCF[self._saturatedDefective]        classificationQI.SATURATED_DEFECTIVE_PIXEL_PERCENTAGE = percSCF[self._saturatedDefective]        classificationQI.DARK_FEATURES_COUNT = freqSCF[self._darkFeatures]        classificationQI.DARK_FEATURES_PERCENTAGE = percSCF[self._darkFeatures]        classificationQI.CLOUD_SHADOWS_COUNT = freqSCF[self._cloudShadows]        classificationQI.CLOUD_SHADOWS_PERCENTAGE = percSCF[self._cloudShadows]        classificationQI.VEGETATION_COUNT = freqSCF[self._vegetation]        classificationQI.VEGETATION_PERCENTAGE = percSCF[self._vegetation]        classificationQI.NOT_VEGETATED_COUNT = freqSCF[self._notVegetated]        classificationQI.NOT_VEGETATED_PERCENTAGE = percSCF[self._notVegetated]        classificationQI.WATER_COUNT = freqSCF[self._water]        classificationQI.WATER_PERCENTAGE = percSCF[self._water]        classificationQI.UNCLASSIFIED_COUNT = freqSCF[self._unclassified]        classificationQI.UNCLASSIFIED_PERCENTAGE = percSCF[self._unclassified]        classificationQI.MEDIUM_PROBA_CLOUDS_COUNT = freqSCF[self._medProbaClouds]        classificationQI.MEDIUM_PROBA_CLOUDS_PERCENTAGE = percSCF[self._medProbaClouds]        classificationQI.HIGH_PROBA_CLOUDS_COUNT = freqSCF[self._highProbaClouds]        classificationQI.HIGH_PROBA_CLOUDS_PERCENTAGE = percSCF[self._highProbaClouds]        classificationQI.THIN_CIRRUS_COUNT = freqSCF[self._thinCirrus]        classificationQI.THIN_CIRRUS_PERCENTAGE = percSCF[self._thinCirrus]        classificationQI.SNOW_ICE_COUNT = freqSCF[self._snowIce]        classificationQI.SNOW_ICE_PERCENTAGE = percSCF[self._snowIce]        # the pixel counts for the statistics of the product, in the order of L3_Product.STATISTICS:        classes = [self._saturatedDefective, self._darkFeatures, self._cloudShadows, self._vegetation,                   self._notVegetated, self._water, self._unclassified, self._medProbaClouds,                   self._highProbaClouds, self._thinCirrus, self._snowIce]        counts = concatenate(([totalPixelCount, dataPixelCount, backgroundPixelCount,                               goodPixelCount, badPixelCount], freqSCF[classes]))        xp = L3_XmlParser(self.config, 'T03')        l3qi = xp.getTree('Quality_Indicators_Info', 'Classification_QI')        l3qiLen = len(l3qi)        for i in range(l3qiLen):            if int(l3qi[i].attrib['resolution']) == self.config.resolution:                l3qi[i].clear()                l3qi[i] = classificationQI                xp.export()                self.product.updateTableRow(counts)                break        return True    def readImageContentQI(self):        ''' Helper for reading the image content quality indicators of the current scene from metadata            :return: the image content QI, false if not present.            :rtype: an objectify element        '''        xp = L3_XmlParser(self.config, 'T2A')        qi = xp.getTree('Quality_Indicators_Info', 'Image_Content_QI')        if qi is False:            # its' a PSD 14.2 tile:            qi = xp.getTree('Quality_Indicators_Info', 'L2A_Image_Content_QI')        return qi    def canContribute(self, product):        ''' Decides, before the tile of the current scene is prepared and any band is decoded,            whether the scene can change the mosaic. The decision uses the image content QI of the tile            metadata of the current scene and the row block index of the L3 scene classification.            A scene is skipped only if processing it would leave the bands and the mosaic map unchanged:            1. NO_USABLE_PIXELS: it contains no data, or the L3 scene contains good pixels only and               the current scene contains no good pixels. The best values of the past are to be updated               by updateBestValues(), as by the processing;            2. NOT_BETTER: the L3 scene contains good pixels only and the current scene is not better than               the best scene of the past. This can only be decided in advance for 'MOST_RECENT' and               'SOLAR_ZENITH'.            All scenes of the algorithm 'AVERAGE' are processed, as are the scenes of a tile without            row block index, i.e. the first two scenes of a tile. The decision has no side effects,            the tile metadata of the current scene must be set, see L3_Product.reinitL2A_Tile.            :param product: the product object for the current tile.            :type product: a reference to the L3_Product object            :return: false and the reason, if the scene cannot contribute, else true and None.            :rtype: tuple        '''        algorithm = self.config.algorithm        if algorithm == 'AVERAGE':            return True, None        L3_TILE_ID = product.getL3_TileId()        if L3_TILE_ID is False:            return True, None        database = product.getL3_Database(L3_TILE_ID)        if database is False:            return True, None        index = readBlockIndex(database)        if index is False:            return True, None        clean = self.getCleanBlocks(index, 0).all()        hasPixels = True        qi = self.readImageContentQI()        if qi is not False:            try:                goodPercentage = qi.VEGETATION_PERCENTAGE.pyval + qi.NOT_VEGETATED_PERCENTAGE.pyval + \                    qi.WATER_PERCENTAGE.pyval                if self.config.cirrusRemoval == False:                    goodPercentage += qi.THIN_CIRRUS_PERCENTAGE.pyval                if self.config.shadowRemoval == False:                    goodPercentage += qi.DARK_FEATURES_PERCENTAGE.pyval + qi.CLOUD_SHADOW_PERCENTAGE.pyval                if self.config.snowRemoval == False:                    goodPercentage += qi.SNOW_ICE_PERCENTAGE.pyval                # with a clean L3 scene, bad pixels of the current scene never become good, see classifyPixels:                if qi.NODATA_PIXEL_PERCENTAGE.pyval >= 100.0 or (clean and goodPercentage == 0):                    hasPixels = False            except AttributeError:                pass        if not hasPixels:            return False, NO_USABLE_PIXELS        if not clean or not self.isPixelIndependent():            return True, None        # the best values of the past are kept for the L3 tile:        if algorithm == 'MOST_RECENT':            isBetterScene = self.getObservationTime() > product.getTableVal('DATE_TIME', L3_TILE_ID)        else:            isBetterScene = self.readSolarZenithAngle('T2A') > product.getTableVal('SZA_MEAN', L3_TILE_ID)        if isBetterScene:            return True, None        return False, NOT_BETTER    def isPixelIndependent(self):        ''' Check if the better scene is decided independent of the pixels,            as for 'MOST_RECENT' and 'SOLAR_ZENITH', see setPixelMasks.            :return: true if independent of the pixels.            :rtype: bool        '''        algorithm = self.config.algorithm        return algorithm == 'MOST_RECENT' or \            (algorithm == 'RADIOMETRIC_QUALITY' and self.config.radiometricPreference == 'SOLAR_ZENITH')    def updateBestValues(self, product):        ''' Update the best values of the past for a scene skipped by canContribute, as by the            processing of the scene. Only the best values independent of the pixels are updated.            :param product: the product object for the current tile.            :type product: a reference to the L3_Product object        '''        if not self.isPixelIndependent():            return        # as done by the preparation of the tile, the best values of the past are kept per L3 tile:        self.config.L3_TILE_ID = product.getL3_TileId()        self.product = product        self._isBetterScene = False        if self.config.algorithm == 'MOST_RECENT':            self.isMoreRecent()        else:            self.szaIsHigher()        return    def readSolarZenithAngle(self, productStr):        ''' Helper class for reading the mean solar zenith angle from metadata            :param productStr: [L2A | L3].            :type productStr: str            :return: solar zenith angle            :rtype: unsigned float        '''        xp = L3_XmlParser(self.config, productStr)        ang = xp.getTree('Geometric_Info', 'Tile_Angles')        sza = float32(ang.Mean_Sun_Angle.ZENITH_ANGLE.text)        sza = absolute(sza)        if sza > 70.0: sza = 70.0        return sza    def preProcessing(self):        ''' Performs the pre processing, updates the pixel mask            and imports the row blocks of the current scene to be updated        '''        self.config.timestamp('L3_Synthesis: pre processing')        self.setPixelMasks()        # the spectral bands of the current scene are only needed for the row blocks to be updated:        rowBlocks = [block[:2] for block in self._pixelMasks if block[2] is not None]        self.tables.importBandBlocks(rowBlocks)        self.displayData()        return    def forwardProcessing(self):        ''' This is the default processing routine: it removes clouds and dark features            from an input image. In a single pass over the row blocks, it updates the scene            classification and the mosaic map, calls the routine replaceBadPixels for all bands            and collects the histograms for the statistics. Row blocks without pixel masks            remain unchanged and are only read for the statistics. Finally the row block index            of the L3 scene classification is updated.        '''        ntProcessed = self.config.getNrTilesProcessed() + 1        SCL = self.tables.SCL        MSC = self.tables.MSC        shape = self.tables.getBandSize('L3', SCL)        classFreq = zeros(256, dtype=int64)        mosaicFreq = zeros(256, dtype=int64)        aotSum = 0.0        aotCount = 0        index = []        for block in self._pixelMasks:            rowStart, rowStop = block[:2]            scl03 = self.tables.getBandBlock('L3', SCL, rowStart, rowStop)            mosaicMap = self.tables.getBandBlock('L3', MSC, rowStart, rowStop)            if block[2] is not None:                self.updateBlock(block, scl03, mosaicMap, ntProcessed)            classHist = self.tables.getBlockHistogram(scl03)            index.append(packbits(classHist > 0))            classFreq += classHist            mosaicFreq += self.tables.getBlockHistogram(mosaicMap)            aotArr = self.getAotBlock('L2A', rowStart, rowStop, shape)            if aotArr is not False:                validData = scl03 != self._noData                aotSum += aotArr[validData].sum(dtype=float64)                aotCount += count_nonzero(validData)        self._classFreq = classFreq        self._mosaicFreq = mosaicFreq        self._aotMean = aotSum / aotCount * 0.001 if aotCount > 0 else 0        self._pixelMasks = []        self.tables.setBlockIndex(array(index))        self.updateL3ClassificationQI()        self.updateL3MosaicQI()        self.displayData()        return    def updateBlock(self, block, scl03, mosaicMap, ntProcessed):        ''' Updates the scene classification, the mosaic map and all bands of a row block.            :param block: the packed row block (rowStart, rowStop, GPM2A, GPM03), as stored by setPixelMasks.            :type block: tuple            :param scl03: the scene classification of the row block, will be updated.            :type scl03: a 2 dimensional numpy array of type unsigned int 8            :param mosaicMap: the mosaic map of the row block, will be updated.            :type mosaicMap: a 2 dimensional numpy array of type unsigned int 8            :param ntProcessed: the number of the current tile.            :type ntProcessed: unsigned int        '''        SCL = self.tables.SCL        MSC = self.tables.MSC        rowStart, rowStop = block[:2]        scl2A = self.tables.getBandBlock('L2A', SCL, rowStart, rowStop)        # keep the 'better' features of the previous scene:        self.classifyPixels(scl2A, scl03)        GPM2A, GPM03 = self.getPixelMasks(block, scl03.shape)        good = GPM2A == 1        fill = good & (GPM03 == 0)        if self.config.algorithm == 'AVERAGE':            # Mosaic map is the per pixel sum of all good pixels in the past:            mosaicMap[good] = mosaicMap[good] + 1        else:            if self._isBetterScene:                scl03[good] = scl2A[good]                mosaicMap[good] = ntProcessed            mosaicMap[fill] = ntProcessed        # fill always the bad pixels with good ones:        scl03[fill] = scl2A[fill]        self.tables.setBandBlock('L3', SCL, rowStart, scl03.astype(uint8))        self.tables.setBandBlock('L3', MSC, rowStart, mosaicMap.astype(uint8))        for i in self.tables.bandIndex:            self.replaceBadPixels(i, rowStart, rowStop, GPM2A, GPM03, mosaicMap)        return    def postProcessing(self):        ''' Performs a validation of the metadada and prepares a statistics display, if activated        '''        self.product.postProcessing()        self.config.timestamp('L3_Synthesis: post processing')        # Output product shall be aligned to latest product version, currently 14.5:        self.config.productVersion = '14.5'        self.config.setSchemes()        # validate the meta data:        xp = L3_XmlParser(self.config, 'UP03')        xp.validate()        xp = L3_XmlParser(self.config, 'T03')        xp.validate()        xp = L3_XmlParser(self.config, 'DS03')        xp.validate()        return    def __exit__(self):        sys.exit(-1)    def __del__(self):        self.config.logger.info('Module L3_Synthesis deleted')    def process(self, tables):        ''' Triggers pre -, processing and post processing        '''        ts = time.time()        self.tables = tables        self.product = tables.product        self.config = tables.product.config        self.preProcessing()        self.forwardProcessing()        tDelta = time.time() - ts        self.config.logger.info('Procedure L3_Synthesis: overall time [s]: %0.3f' % tDelta)        if(self.config.loglevel == 'DEBUG'):            stdoutWrite('Procedure L3_Synthesis: overall time[s]: %0.3f\n' % tDelta)        return True
\ No newline at end of file
@@ -1,19 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: iso-8859-15 -*-
 
-import os, fnmatch
-import glymur
-from PIL import Image
-from scipy import ndimage
+import os, fnmatch, warnings, struct
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 from numpy import *
 from tables import *
+from tables import blosc_compressor_list
 from lxml import etree, objectify
 from tables.description import *
 from distutils.dir_util import mkpath
 from distutils.file_util import copy_file
 from L3_XmlParser import L3_XmlParser
-from L3_Library import showImage
+from L3_Library import showImage, fastMedianFilter
 
 class Particle(IsDescription):
     bandName = StringCol(8)
@@ -23,6 +23,55 @@ class Particle(IsDescription):
     rasterYSize = UInt16Col()
     rasterCount = UInt8Col()
 
+# row block size for block wise processing, divides the tile size of all resolutions.
+# The chunks of the database span the full row width, with a height dividing the row block,
+# thus a row block is read from complete chunks, each of about 1.3 MB for unsigned int 16:
+BLOCK_ROWS = 366
+
+def checkBlockIndex(node, blockRows):
+    ''' Get the row block index of a scene classification node, as stored by L3_Tables.setBlockIndex.
+
+        :param node: the scene classification node.
+        :type node: a pyTables array.
+        :param blockRows: the number of rows of a row block.
+        :type blockRows: unsigned int
+        :return: the bit packed flags of the scene classes present in each row block,
+                 false if no index matching the row blocks exists.
+        :rtype: a 2 dimensional numpy array (nblocks x 32) of type unsigned int 8
+
+    '''
+    attrs = node._v_attrs
+    if not ('BLOCK_INDEX' in attrs) or attrs.BLOCK_ROWS != blockRows:
+        return False
+    index = attrs.BLOCK_INDEX
+    if len(index) != (node.shape[0] + blockRows - 1) / blockRows:
+        return False
+    return index
+
+def readBlockIndex(imageDatabase, blockRows=BLOCK_ROWS):
+    ''' Read the row block index of the L3 scene classification of a database, without a table object.
+        Thus a scene can be judged before its tile is prepared. The database is opened read only.
+
+        :param imageDatabase: the file name of the database.
+        :type imageDatabase: str
+        :param blockRows: the number of rows of a row block.
+        :type blockRows: unsigned int
+        :return: the bit packed flags of the scene classes present in each row block,
+                 false if the database or a matching index does not exist.
+        :rtype: a 2 dimensional numpy array (nblocks x 32) of type unsigned int 8
+
+    '''
+    try:
+        h5file = open_file(imageDatabase, mode='r')
+    except (IOError, HDF5ExtError):
+        return False
+    try:
+        return checkBlockIndex(h5file.get_node('/L3', 'SCL'), blockRows)
+    except NoSuchNodeError:
+        return False
+    finally:
+        h5file.close()
+
 class L3_Tables(object):
     ''' A support class, managing the conversion of the JPEG-2000 based input data
         to an internal format based on HDF5 (pyTables). Provide a high performance
@@ -32,8 +81,11 @@ class L3_Tables(object):
         :type config: a reference to the L3_Config object.
 
     '''
+    # decoded bands shared between the resolutions of a tile in single pass mode:
+    _sharedBands = {}
 
     def __init__(self, product):
+        self._h5file = None
         self._product = product
         self._config = product.config
 
@@ -52,14 +104,17 @@ class L3_Tables(object):
         if(self._resolution == 10):
             self._bandIndex = [1,2,3,7]
             self._nBands = 4
+            self._chunkRows = 61
             bandDir = 'R10m'
         elif(self._resolution == 20):
             self._bandIndex = [1,2,3,4,5,6,8,11,12]
             self._nBands = 9
+            self._chunkRows = 122
             bandDir = 'R20m'
         elif(self._resolution == 60):
             self._bandIndex = [0,1,2,3,4,5,6,8,9,11,12]
             self._nBands = 11
+            self._chunkRows = 366
             bandDir = 'R60m'
 
         BANDS = bandDir
@@ -70,26 +125,12 @@ class L3_Tables(object):
         # check whether a tile with same ORBIT ID already exists, if yes use this folder.
         # else create a new tile folder with corresponding orbit ID
         L2A_TILE_ID = self._config.L2A_TILE_ID
-        L3_TILE_MSK = 'L03_*'
-        strList = L2A_TILE_ID.split('_')
-        if self._config.namingConvention == 'SAFE_STANDARD':
-            ORBIT_ID = strList[-2]
+        L3_TILE_ID = product.getL3_TileId()
+        if L3_TILE_ID:
+            # target exists, will be used, the L2A tile is set by the caller, see reinitL2A_Tile:
+            product.reinitL3_Tile(L3_TILE_ID)
         else:
-            ORBIT_ID = strList[1]
-        L3_TARGET_ID = self._config.L3_TARGET_ID
-        tiles = os.path.join(self._config.targetDir, L3_TARGET_ID, GRANULE)
-        files = sorted(os.listdir(tiles))
-        reinit = False
-        for L3_TILE_ID in files:
-            if fnmatch.fnmatch(L3_TILE_ID, L3_TILE_MSK):
-                if ORBIT_ID in L3_TILE_ID:
-                 # target exists, will be used:
-                    product.reinitL2A_Tile()
-                    product.reinitL3_Tile(L3_TILE_ID)
-                    reinit = True
-                    break
-        # target does not exist, must be created:
-        if reinit == False:
+            # target does not exist, must be created:
             product.createL3_Tile(L2A_TILE_ID)
 
         L3_TILE_ID = self.config.L3_TILE_ID
@@ -180,6 +221,10 @@ class L3_Tables(object):
         self._MSC = 34
 
         self._geobox = None
+        self._filters = None
+        self._deferredJobs = []
+        # row block size for block wise processing:
+        self._blockRows = BLOCK_ROWS
         self._config.logger.debug('Module L3_Tables initialized with resolution %d' % self._resolution)
 
         return
@@ -267,6 +312,7 @@ class L3_Tables(object):
 
 
     def __del__(self):
+        self.closeDatabase()
         self.config.logger.debug('Module L3_Tables deleted')
 
 
@@ -545,18 +591,127 @@ class L3_Tables(object):
         ''' Checks the existence of a L3 target database for the processed tile.
             If the database exists, the given tile will be imported. If the database does not exist
             it will be created and the current tile will become the base for the subsequent processing.
+            The spectral bands of an imported tile are only decoded on demand, see importBandBlocks().
+            The database remains open for all subsequent band operations, until closeDatabase() is called.
         '''
         self._config.logger.info('Checking existence of L3 target database')
-        try:
-            h5file = open_file(self._imageDatabase)
-            h5file.close()
-        except:
+        if not self.existDatabase():
             self.initDatabase()
             self.importBandList('L3')
             return
-        self.importBandList('L2A')
+        self.migrateDatabase()
+        self.openDatabase()
+        self.importBandList('L2A', deferred=True)
+        return
+
+    def existDatabase(self):
+        ''' Check if the L3 target database of the tile exists, i.e. if a scene was already processed.
+
+            :return: true if the database exists.
+            :rtype: boolean
+
+        '''
+        return os.path.isfile(self._imageDatabase)
+
+    def openDatabase(self):
+        ''' Open the H5 database of the current tile, if not already open.
+            A single handle is kept for the lifetime of the tile processing,
+            all band operations are routed through it.
+
+            :return: the database handle.
+            :rtype: a pyTables file object.
+
+        '''
+        if self._h5file is not None:
+            if self._h5file.isopen and self._h5file.filename == self._imageDatabase:
+                return self._h5file
+            self.closeDatabase()
+        self._h5file = open_file(self._imageDatabase, mode='a', title=str(self._resolution) + 'm bands',
+                                 CHUNK_CACHE_SIZE=self.config.chunkCacheSize * 1024 * 1024)
+        self.config.logger.debug('Database %s opened' % self._imageDatabase)
+        return self._h5file
+
+    def migrateDatabase(self):
+        ''' Migrate an existing database to the configured compression and chunk layout.
+            If any band deviates, all bands are copied row block wise into a new file,
+            which then replaces the database. Thus also the space of removed bands is reclaimed.
+
+            :return: true if the database was migrated.
+            :rtype: boolean
+
+        '''
+        filters = self.getFilters()
+        h5file = self.openDatabase()
+        outdated = False
+        for node in h5file.walk_nodes('/', classname='Leaf'):
+            # pyTables Filters implement == only:
+            if not (node.filters == filters) or node.chunkshape != self.getChunkShape(node.shape):
+                outdated = True
+                break
+        self.closeDatabase()
+        if not outdated:
+            return False
+
+        self.config.logger.info('Migrating database %s to %s' % (self._imageDatabase, filters))
+        tmpFile = self._imageDatabase + '.tmp'
+        src = open_file(self._imageDatabase, mode='r')
+        dst = open_file(tmpFile, mode='w', title=src.title)
+        try:
+            # the user attributes, like the row block index, are copied with the nodes:
+            for group in src.walk_groups('/'):
+                if group._v_pathname != '/':
+                    newGroup = dst.create_group(group._v_parent._v_pathname, group._v_name, group._v_title)
+                else:
+                    newGroup = dst.root
+                group._v_attrs._f_copy(newGroup)
+            for node in src.walk_nodes('/', classname='Leaf'):
+                newNode = dst.create_carray(node._v_parent._v_pathname, node.name, node.atom, node.shape,
+                                            node.title, filters=filters, chunkshape=self.getChunkShape(node.shape))
+                for rowStart, rowStop in self.getRowBlocks(node.shape[0]):
+                    newNode[rowStart:rowStop] = node.read(rowStart, rowStop)
+                node._v_attrs._f_copy(newNode)
+            result = True
+        except:
+            self.config.logger.error('error in migration of database %s, database remains unchanged.' % self._imageDatabase)
+            result = False
+        finally:
+            src.close()
+            dst.close()
+
+        if result == True:
+            os.remove(self._imageDatabase)
+            os.rename(tmpFile, self._imageDatabase)
+            self.config.timestamp('L3_Tables: database migrated')
+        else:
+            os.remove(tmpFile)
+        return result
+
+    def closeDatabase(self):
+        ''' Flush and close the H5 database of the current tile, if open.
+        '''
+        if self._h5file is None:
+            return
+        if self._h5file.isopen:
+            self.config.logger.debug('Database %s closed' % self._h5file.filename)
+            self._h5file.close()
+        self._h5file = None
         return
 
+    @contextmanager
+    def session(self):
+        ''' Context managed database session for the processing of one tile.
+            The database is opened on first access and closed on leaving the context.
+            Thus a missing database is not created by entering the session, see init().
+
+            :return: the table object itself.
+            :rtype: L3_Tables
+
+        '''
+        try:
+            yield self
+        finally:
+            self.closeDatabase()
+
     def exportTile(self, L3_TILE_ID):
         ''' Prepare the export of a synthesized tile.
         
@@ -612,16 +767,19 @@ class L3_Tables(object):
         self._L3_Tile_PVI_File = os.path.join(self._L3_QualityDataDir,
             L3_TILE_ID_SHORT + '_PVI.jp2')
 
+        # switch the session to the database of the tile to be exported:
+        self.closeDatabase()
         self._imageDatabase = os.path.join(self._L3_bandDir, '.database.h5')
         self.config.logger.debug('Module L3_Tables reinitialized with resolution %d' % self._resolution)
-        self.exportBandList('L3')
+        with self.session():
+            self.exportBandList('L3')
         return
     
     def initDatabase(self):
         ''' Initialize H5 target database for usage.
         '''
         try:
-            h5file = open_file(self._imageDatabase, mode='a', title =  str(self._resolution) + 'm bands')
+            h5file = self.openDatabase()
             # remove all existing L2A tables as they will be replaced by the new data set
             h5file.create_group('/', 'L2A', 'bands L2A')
             h5file.create_group('/', 'L3', 'bands L3')
@@ -630,14 +788,16 @@ class L3_Tables(object):
             self.config.logger.fatal('error in initialization of database: %s:' % self._imageDatabase)
             self.config.exitError()
             result = False
-        h5file.close()
         return result
     
-    def importBandList(self, productLevel):
+    def importBandList(self, productLevel, deferred=False):
         ''' Import all bands of current tile.
             
             :param productLevel: [L2A | L3].
             :type productLevel: str
+            :param deferred: if true, the spectral bands are only created with their full size,
+                             the row blocks needed are decoded later by importBandBlocks().
+            :type deferred: bool
             :rtype: none.
             
         '''        
@@ -647,63 +807,63 @@ class L3_Tables(object):
         os.chdir(bandDir)
         dirs = sorted(os.listdir(bandDir))
         bands = self._bandIndex
+        jobs = []
         for i in bands:
-            for filename in dirs:  
-                bandName = self.getBandNameFromIndex(i)
-                if self.config.productVersion == 13.1:
-                    filemask = '*_L2A_*_B%2s_??m.jp2' % bandName[1:3]
-                elif self.config.productVersion == 14.2:
-                    filemask = 'L2A_T*_B%2s_??m.jp2' % bandName[1:3]
-                elif self.config.productVersion == 14.5:
-                    filemask = 'T*_B%2s_??m.jp2' % bandName[1:3]
+            bandName = self.getBandNameFromIndex(i)
+            if self.config.productVersion == 13.1:
+                filemask = '*_L2A_*_B%2s_??m.jp2' % bandName[1:3]
+            elif self.config.productVersion == 14.2:
+                filemask = 'L2A_T*_B%2s_??m.jp2' % bandName[1:3]
+            elif self.config.productVersion == 14.5:
+                filemask = 'T*_B%2s_??m.jp2' % bandName[1:3]
+            found = False
+            for filename in dirs:
                 if not fnmatch.fnmatch(filename, filemask):
                     continue
 
-                self.importBand(i, os.path.join(bandDir,filename))
-
-                #
-                # the File structure:
-                # -------------------------------------------------------
-                if (self.config.productVersion == 13.1) and (bandName == 'B02'):
-                    # B02 is always present:
-                    L2A_TILE_ID_SHORT = self.config.L2A_TILE_ID[:55]
-                    pre = L2A_TILE_ID_SHORT[:8]
-                    post = L2A_TILE_ID_SHORT[12:]
-                    self._L2A_Tile_BND_File = os.path.join(self._L2A_bandDir,
-                        L2A_TILE_ID_SHORT + '_BXX_' + str(self._resolution) + 'm.jp2')
-                    self._L2A_Tile_AOT_File = os.path.join(self._L2A_bandDir,
-                        pre + '_AOT' + post + '_' + str(self._resolution) + 'm.jp2')
-                    self._L2A_Tile_WVP_File = os.path.join(self._L2A_bandDir,
-                        pre + '_WVP' + post + '_' + str(self._resolution) + 'm.jp2')
-                    self._L2A_Tile_SCL_File = os.path.join(self._L2A_ImgDataDir,
-                        pre + '_SCL' + post + '_' + str(self._resolution) + 'm.jp2')
-                    self._L2A_Tile_CLD_File = os.path.join(self._L2A_QualityDataDir,
-                        pre + '_CLD' + post + '_' + str(self._resolution) + 'm.jp2')
-                    self._L2A_Tile_SNW_File = os.path.join(self._L2A_QualityDataDir,
-                        pre + '_SNW' + post + '_' + str(self._resolution) + 'm.jp2')
-                    self._L2A_Tile_PVI_File = os.path.join(self._L2A_QualityDataDir,
-                        pre + '_PVI' + post + '.jp2')
-                elif (self.config.productVersion > 13.1) and (bandName == 'B02'):
-                    self._L2A_Tile_BND_File = os.path.join(bandDir, filename.replace('B02', 'BXX'))
-                    self._L2A_Tile_AOT_File = os.path.join(bandDir, filename.replace('B02', 'AOT'))
-                    self._L2A_Tile_WVP_File = os.path.join(bandDir, filename.replace('B02', 'AOT'))
-                    self._L2A_Tile_SCL_File = os.path.join(bandDir, filename.replace('B02', 'SCL'))
-                # if (self.config.productVersion == 14.2) and (bandName == 'B02'):
-                #     self._L2A_Tile_CLD_File = os.path.join(self._L2A_QualityDataDir, filename.replace('B02', 'CLD'))
-                #     self._L2A_Tile_SNW_File = os.path.join(self._L2A_QualityDataDir, filename.replace('B02', 'SNW'))
-                # elif (self.config.productVersion > 14.2) and (bandName == 'B02'):
-                #     filename = 'MSK_CLDPRB_' + str(self._resolution) + 'm.jp2'
-                #     self._L2A_Tile_CLD_File = os.path.join(self._L2A_QualityDataDir, filename)
-                #     filename = 'MSK_SNWPRB_' + str(self._resolution) + 'm.jp2'
-                #     self._L2A_Tile_SNW_File = os.path.join(self._L2A_QualityDataDir, filename)
-
+                jobs.append((i, os.path.join(bandDir,filename), 1))
+                found = True
+                if bandName == 'B02':
+                    self.setL2A_TileFiles(bandDir, filename)
+
+            if found or self.config.bandDerivation == 'NONE':
+                continue
+            # band is missing, derive it from a finer resolution:
+            filename, factor = self.getFinerBandFile(filemask)
+            if filename is None:
+                continue
+            self.config.logger.info('band %s will be derived from %s' % (bandName, filename))
+            jobs.append((i, filename, factor))
+            if bandName == 'B02':
+                filename = os.path.basename(filename)
+                filename = filename.replace('_%dm' % (self._resolution / factor), '_%dm' % self._resolution)
+                self.setL2A_TileFiles(bandDir, filename)
+
+        if deferred:
+            for bandIndex, filename, factor in jobs:
+                size, geobox = self.readBandHeader(bandIndex, filename, factor)
+                if geobox is not None:
+                    self._geobox = geobox
+                self.createBand(productLevel, bandIndex, size, uint16)
+            self._deferredJobs = jobs
+        else:
+            self.importBands(jobs)
+        # AOT and SCL are imported after the spectral bands,
+        # as the up sampling of the 10m SCL depends on the size of B02:
+        jobs = []
         if self.config.resolution > 10:
-            if os.path.isfile(self._L2A_Tile_AOT_File):
-                self.importBand(self.AOT, self._L2A_Tile_AOT_File)
-            if os.path.isfile(self._L2A_Tile_SCL_File):
-                self.importBand(self.SCL, self._L2A_Tile_SCL_File)
+            for index, filename in [(self.AOT, self._L2A_Tile_AOT_File), (self.SCL, self._L2A_Tile_SCL_File)]:
+                if os.path.isfile(filename):
+                    jobs.append((index, filename, 1))
+                elif self.config.bandDerivation != 'NONE':
+                    # band is missing, derive it from a finer resolution:
+                    filemask = os.path.basename(filename).replace('_%dm' % self._resolution, '_??m')
+                    filename, factor = self.getFinerBandFile(filemask)
+                    if filename is not None:
+                        jobs.append((index, filename, factor))
             # if os.path.isfile(self._L2A_Tile_CLD_File):
-            #     self.importBand(self.CLD, self._L2A_Tile_CLD_File)
+            #     jobs.append((self.CLD, self._L2A_Tile_CLD_File))
+            self.importBands(jobs)
             return
         else: # 10m bands only: perform an up sampling of SCL and AOT from 20 m channels to 10:
             self.config.logger.info('perform up sampling of SCL from 20m channels to 10m')
@@ -722,7 +882,7 @@ class L3_Tables(object):
             for filename in dirs:
                 if not fnmatch.fnmatch(filename, filemask):
                     continue
-                self.importBand(channel, os.path.join(sourceDir, filename))
+                jobs.append((channel, os.path.join(sourceDir, filename), 1))
                 break
 
             channel = 14 # import SCL:
@@ -741,8 +901,129 @@ class L3_Tables(object):
             for filename in dirs:
                 if not fnmatch.fnmatch(filename, filemask):
                     continue
-                self.importBand(channel, os.path.join(sourceDir, filename))
-                return
+                jobs.append((channel, os.path.join(sourceDir, filename), 1))
+                break
+
+            self.importBands(jobs)
+            return
+
+    def setL2A_TileFiles(self, bandDir, filename):
+        ''' Set the file structure of the L2A tile, from the file name of band 2.
+
+            :param bandDir: the band directory of the current resolution.
+            :type bandDir: str
+            :param filename: the file name of band 2 in the current resolution.
+            :type filename: str
+
+        '''
+        if self.config.productVersion == 13.1:
+            # B02 is always present:
+            L2A_TILE_ID_SHORT = self.config.L2A_TILE_ID[:55]
+            pre = L2A_TILE_ID_SHORT[:8]
+            post = L2A_TILE_ID_SHORT[12:]
+            self._L2A_Tile_BND_File = os.path.join(self._L2A_bandDir,
+                L2A_TILE_ID_SHORT + '_BXX_' + str(self._resolution) + 'm.jp2')
+            self._L2A_Tile_AOT_File = os.path.join(self._L2A_bandDir,
+                pre + '_AOT' + post + '_' + str(self._resolution) + 'm.jp2')
+            self._L2A_Tile_WVP_File = os.path.join(self._L2A_bandDir,
+                pre + '_WVP' + post + '_' + str(self._resolution) + 'm.jp2')
+            self._L2A_Tile_SCL_File = os.path.join(self._L2A_ImgDataDir,
+                pre + '_SCL' + post + '_' + str(self._resolution) + 'm.jp2')
+            self._L2A_Tile_CLD_File = os.path.join(self._L2A_QualityDataDir,
+                pre + '_CLD' + post + '_' + str(self._resolution) + 'm.jp2')
+            self._L2A_Tile_SNW_File = os.path.join(self._L2A_QualityDataDir,
+                pre + '_SNW' + post + '_' + str(self._resolution) + 'm.jp2')
+            self._L2A_Tile_PVI_File = os.path.join(self._L2A_QualityDataDir,
+                pre + '_PVI' + post + '.jp2')
+        else:
+            self._L2A_Tile_BND_File = os.path.join(bandDir, filename.replace('B02', 'BXX'))
+            self._L2A_Tile_AOT_File = os.path.join(bandDir, filename.replace('B02', 'AOT'))
+            self._L2A_Tile_WVP_File = os.path.join(bandDir, filename.replace('B02', 'AOT'))
+            self._L2A_Tile_SCL_File = os.path.join(bandDir, filename.replace('B02', 'SCL'))
+        # if (self.config.productVersion == 14.2):
+        #     self._L2A_Tile_CLD_File = os.path.join(self._L2A_QualityDataDir, filename.replace('B02', 'CLD'))
+        #     self._L2A_Tile_SNW_File = os.path.join(self._L2A_QualityDataDir, filename.replace('B02', 'SNW'))
+        # elif (self.config.productVersion > 14.2):
+        #     filename = 'MSK_CLDPRB_' + str(self._resolution) + 'm.jp2'
+        #     self._L2A_Tile_CLD_File = os.path.join(self._L2A_QualityDataDir, filename)
+        #     filename = 'MSK_SNWPRB_' + str(self._resolution) + 'm.jp2'
+        #     self._L2A_Tile_SNW_File = os.path.join(self._L2A_QualityDataDir, filename)
+        return
+
+    def importBands(self, jobs):
+        ''' Import a list of bands. The JPEG-2000 decoding is performed concurrently
+            by a pool of worker threads, if more than one thread is configured.
+            The database writes are serialised in the calling thread, in the order of the list.
+
+            :param jobs: the bands to import.
+            :type jobs: list of (band index, file name, reduction factor) tuples.
+            :return: false if error occurred during import.
+            :rtype: boolean
+
+        '''
+        nrThreads = min(self.config.nrThreads, len(jobs))
+        pool = None
+        if nrThreads > 1:
+            pool = ThreadPool(nrThreads)
+            decoded = pool.imap(lambda job: self.decodeBand(*job), jobs)
+        else:
+            decoded = (self.decodeBand(*job) for job in jobs)
+        result = True
+        try:
+            for bandIndex, indataArr, geobox in decoded:
+                if not self.storeBand(bandIndex, indataArr, geobox):
+                    result = False
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return result
+
+    def importBandBlocks(self, rowBlocks):
+        ''' Import the row blocks of the spectral bands deferred by importBandList().
+            Adjacent row blocks are merged to windows and only the code blocks of the
+            JPEG-2000 images covering the windows are decoded. The decoding is performed
+            concurrently by a pool of worker threads, if more than one thread is configured.
+
+            :param rowBlocks: the row blocks needed (first row, last row + 1), in ascending order.
+            :type rowBlocks: list of tuples (unsigned int).
+            :return: false if error occurred during import.
+            :rtype: boolean
+
+        '''
+        jobs = self._deferredJobs
+        self._deferredJobs = []
+        windows = []
+        for rowStart, rowStop in rowBlocks:
+            if windows and windows[-1][1] == rowStart:
+                windows[-1] = (windows[-1][0], rowStop)
+            else:
+                windows.append((rowStart, rowStop))
+        if not jobs or not windows:
+            return True
+
+        nRows = sum(rowStop - rowStart for rowStart, rowStop in windows)
+        self.config.logger.info('decoding %d rows in %d windows of the spectral bands' % (nRows, len(windows)))
+        nrThreads = min(self.config.nrThreads, len(jobs))
+        pool = None
+        if nrThreads > 1:
+            pool = ThreadPool(nrThreads)
+            decoded = pool.imap(lambda job: self.decodeBandBlocks(job[0], job[1], job[2], windows), jobs)
+        else:
+            decoded = (self.decodeBandBlocks(job[0], job[1], job[2], windows) for job in jobs)
+        result = True
+        try:
+            for bandIndex, blocks in decoded:
+                for rowStart, indataArr in blocks:
+                    if not self.setBandBlock('L2A', bandIndex, rowStart, indataArr):
+                        result = False
+                self.config.timestamp('L3_Tables: Level L2A band ' +
+                                      self.getBandNameFromIndex(bandIndex) + ' imported')
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return result
 
     def getBand(self, productLevel, bandIndex):
         ''' Get a single band from database.
@@ -760,13 +1041,12 @@ class L3_Tables(object):
         self.verifyProductId(productLevel)
         bandName = self.getBandNameFromIndex(bandIndex)
         try:
-            h5file = open_file(self._imageDatabase)
+            h5file = self.openDatabase()
             node = h5file.get_node('/' + productLevel, bandName)
             result = node.read()
         except NoSuchNodeError:
             self.config.logger.debug('%s: Band %s is missing', productLevel, self.getBandNameFromIndex(bandIndex))
             result = False
-        h5file.close()
         return result
 
     def importBand(self, bandIndex, filename):
@@ -780,18 +1060,217 @@ class L3_Tables(object):
             :rtype: boolean
             
         '''
-        from skimage.transform import resize as skit_resize
-        # convert JPEG-2000 input file to H5 file format
-        self.verifyProductId(self._productLevel)
+        bandIndex, indataArr, geobox = self.decodeBand(bandIndex, filename)
+        return self.storeBand(bandIndex, indataArr, geobox)
+
+    def decodeBand(self, bandIndex, filename, factor=1):
+        ''' Decode a JPEG-2000 input file. Does not access the database,
+            thus it can be executed concurrently by worker threads.
+            If a reduction factor is given, the band is derived from a band of finer resolution:
+            the scene classification is subsampled, all other bands are averaged over blocks
+            of factor x factor pixels. With band derivation WAVELET, the power of 2 part of
+            the factor is performed by the JPEG-2000 decoder at a reduced resolution level.
+            In single pass mode, the 20m SCL and AOT are taken from the bands shared between the
+            resolutions. The native 60m SCL and AOT are not used by other resolutions, thus not shared.
+
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param filename: file name of JPEG-2000 input image.
+            :type filename: str
+            :param factor: the reduction factor, 1 for the native resolution.
+            :type factor: unsigned int
+            :return: the band index, the pixel data and the geobox (None if not needed).
+            :rtype: tuple
+
+        '''
+        import glymur
         warnings.filterwarnings("ignore")
+        geobox = None
+        if self.config.singlePass and ((bandIndex == self.SCL) | (bandIndex == self.AOT)) \
+                and (factor > 1 or self._resolution < 60):
+            # the 20m SCL and AOT are used by all resolutions, these are decoded only once:
+            indataArr = self.getSharedBand(filename)
+            if factor > 1:
+                if bandIndex == self.SCL:
+                    indataArr = indataArr[factor/2::factor, factor/2::factor]
+                else:
+                    indataArr = self.reduceBand(indataArr, factor)
+            return bandIndex, indataArr, geobox
+
         indataset = glymur.Jp2k(filename)
-        ncols = indataset.shape[1]
+        if factor > 1:
+            # the geobox of the finer resolution is not applicable:
+            if bandIndex == self.SCL:
+                indataArr = indataset[:]
+                indataArr = indataArr[factor/2::factor, factor/2::factor]
+            else:
+                step, factor = self.getDecodingSteps(factor)
+                indataArr = self.reduceBand(indataset[::step, ::step], factor)
+            return bandIndex, indataArr, geobox
+
         indataArr = indataset[:]
         # fix for SIIMPC-558.2, UMW:
         # update the geobox for own resolution:
         if (bandIndex == 0) | (bandIndex == 1) | (bandIndex == 5):
-            self._geobox = indataset.box[3]
+            geobox = indataset.box[3]
             # end fix for SIIMPC-558.2
+        return bandIndex, indataArr, geobox
+
+    def getDecodingSteps(self, factor):
+        ''' Split a reduction factor into the step of the JPEG-2000 resolution level
+            and the remaining factor for the block average, see decodeBand().
+
+            :param factor: the reduction factor, 1 for the native resolution.
+            :type factor: unsigned int
+            :return: the step and the remaining factor.
+            :rtype: tuple
+
+        '''
+        step = 1
+        if self.config.bandDerivation == 'WAVELET':
+            while factor % 2 == 0:
+                step *= 2
+                factor /= 2
+        return step, factor
+
+    def readBandHeader(self, bandIndex, filename, factor=1):
+        ''' Read the size of a band and its geobox from the header of the JPEG-2000 input file,
+            without decoding the image.
+
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param filename: file name of JPEG-2000 input image.
+            :type filename: str
+            :param factor: the reduction factor, 1 for the native resolution.
+            :type factor: unsigned int
+            :return: the size of the decoded band (nrows x ncols) and the geobox (None if not needed).
+            :rtype: tuple
+
+        '''
+        import glymur
+        warnings.filterwarnings("ignore")
+        indataset = glymur.Jp2k(filename)
+        nrows, ncols = indataset.shape[:2]
+        if factor > 1:
+            step, factor = self.getDecodingSteps(factor)
+            nrows = (nrows + step - 1) / step / factor
+            ncols = (ncols + step - 1) / step / factor
+            return (nrows, ncols), None
+        geobox = None
+        if (bandIndex == 0) | (bandIndex == 1) | (bandIndex == 5):
+            geobox = indataset.box[3]
+        return (nrows, ncols), geobox
+
+    def decodeBandBlocks(self, bandIndex, filename, factor, windows):
+        ''' Decode row windows of a JPEG-2000 input file of a spectral band.
+            Does not access the database, thus it can be executed concurrently by worker threads.
+            A reduction factor is applied as in decodeBand().
+
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param filename: file name of JPEG-2000 input image.
+            :type filename: str
+            :param factor: the reduction factor, 1 for the native resolution.
+            :type factor: unsigned int
+            :param windows: the row windows (first row, last row + 1) in the reduced resolution.
+            :type windows: list of tuples (unsigned int).
+            :return: the band index and the decoded windows (first row, pixel data).
+            :rtype: tuple
+
+        '''
+        import glymur
+        warnings.filterwarnings("ignore")
+        indataset = glymur.Jp2k(filename)
+        step, reduction = self.getDecodingSteps(factor)
+        blocks = []
+        for rowStart, rowStop in windows:
+            indataArr = indataset[rowStart * factor:rowStop * factor:step, ::step]
+            blocks.append((rowStart, self.reduceBand(indataArr, reduction)))
+        return bandIndex, blocks
+
+    def getSharedBand(self, filename):
+        ''' Get a band shared between the resolutions of a tile. The band is decoded
+            on first request and kept until releaseSharedBands() is called.
+
+            :param filename: file name of JPEG-2000 input image.
+            :type filename: str
+            :return: the pixel data, must not be modified.
+            :rtype: a 2 dimensional numpy array (row x column).
+
+        '''
+        import glymur
+        try:
+            return L3_Tables._sharedBands[filename]
+        except KeyError:
+            indataArr = glymur.Jp2k(filename)[:]
+            L3_Tables._sharedBands[filename] = indataArr
+            return indataArr
+
+    def releaseSharedBands(self):
+        ''' Release the bands shared between the resolutions of a tile,
+            to be called after the last resolution of the tile is processed.
+        '''
+        L3_Tables._sharedBands.clear()
+        return
+
+    def reduceBand(self, arr, factor):
+        ''' Reduce the resolution of a band by averaging blocks of factor x factor pixels.
+
+            :param arr: the pixel data.
+            :type arr: a 2 dimensional numpy array (row x column).
+            :param factor: the reduction factor.
+            :type factor: unsigned int
+            :return: the reduced pixel data, same data type.
+            :rtype: a 2 dimensional numpy array (row x column).
+
+        '''
+        if factor == 1:
+            return arr
+        nrows = arr.shape[0] / factor
+        ncols = arr.shape[1] / factor
+        blocks = arr[:nrows * factor, :ncols * factor].reshape(nrows, factor, ncols, factor)
+        return (blocks.mean(axis=(1,3)) + 0.5).astype(arr.dtype)
+
+    def getFinerBandFile(self, filemask):
+        ''' Search a band in the directories of finer resolution, for the derivation of a missing band.
+            The closest resolution is preferred.
+
+            :param filemask: the file mask of the band, independent of the resolution.
+            :type filemask: str
+            :return: the file name and the reduction factor, (None, 0) if not found.
+            :rtype: tuple
+
+        '''
+        for resolution in [20, 10]:
+            if resolution >= self._resolution:
+                continue
+            sourceDir = self._L2A_bandDir.replace('R%dm' % self._resolution, 'R%dm' % resolution)
+            if not os.path.isdir(sourceDir):
+                continue
+            for filename in sorted(os.listdir(sourceDir)):
+                if fnmatch.fnmatch(filename, filemask):
+                    return os.path.join(sourceDir, filename), self._resolution / resolution
+        return None, 0
+
+    def storeBand(self, bandIndex, indataArr, geobox=None):
+        ''' Store a decoded band into the H5 database.
+            Must be called from the thread owning the database session.
+
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param indataArr: the pixel data.
+            :type indataArr: a 2 dimensional numpy array (row x column).
+            :param geobox: the geobox of the JPEG-2000 input image, if present.
+            :type geobox: a glymur box.
+            :return: false if error occurred during import.
+            :rtype: boolean
+
+        '''
+        from skimage.transform import resize as skit_resize
+        self.verifyProductId(self._productLevel)
+        ncols = indataArr.shape[1]
+        if geobox is not None:
+            self._geobox = geobox
 
         if self.config.resolution == 10:
         # upsampling is required, order 3 is for cubic spline:
@@ -800,15 +1279,13 @@ class L3_Tables(object):
                 ncols = size[0]
                 indataArr = (skit_resize(indataArr.astype(uint8), size, order=1) * 255.).round().astype(uint8)
 
-        indataset = None
         # Create new arrays:
-        database = self._imageDatabase
         nodeStr = self._productLevel
         bandName = self.getBandNameFromIndex(bandIndex)
         try:
             if self.testBand(self._productLevel, bandIndex) == True:
                 self.delBand(self._productLevel, bandIndex)
-            h5file = open_file(database, mode='a')
+            h5file = self.openDatabase()
             if not (h5file.__contains__('/' + nodeStr)):
                 self.config.logger.fatal('table initialization, wrong node %s:' % nodeStr)
                 self.config.exitError()
@@ -820,9 +1297,8 @@ class L3_Tables(object):
                 locator = h5file.root.L3
 
             dtOut = self.mapDataType(indataArr.dtype)
-            filters = Filters(complib="zlib", complevel=1)
-            node = h5file.create_earray(locator, bandName, dtOut, (0, ncols), bandName, filters=filters)
-            node.append(indataArr)
+            node = self.createNode(locator, bandName, dtOut, indataArr.shape)
+            node[:] = indataArr
             self.config.timestamp('L3_Tables: Level ' + self._productLevel + ' band ' + bandName + ' imported')
             result = True
         except:
@@ -832,7 +1308,6 @@ class L3_Tables(object):
             result = False
 
         indataArr = None
-        h5file.close()
         return result
 
 
@@ -893,6 +1368,7 @@ class L3_Tables(object):
 
         gl = objectify.Element('Granule_List')
         gl.append(Granule)
+        jobs = []
         for index in bandIndex:
             bandName = self.getBandNameFromIndex(index)
             if index == self.SCL:
@@ -901,24 +1377,11 @@ class L3_Tables(object):
                 filename = self._L3_Tile_MSC_File
             else:
                 filename = self._L3_Tile_BND_File.replace('BXX', bandName)
-            if self.testBand(productLevel, index):
-                band = self.getBand(productLevel, index)
-            else:
-                # create mosaic map if first tile:
-                scl = self.getBand(productLevel, self.SCL)
-                scl[scl > 0] = 1
-                self.setBand(productLevel, self.MSC)
-            # Median Filter:
-            mf = self.config.medianFilter
-            if(mf > 0):
-                band = ndimage.filters.median_filter(band, (mf,mf))
-
-            if (index == self.SCL) or (index == self.MSC):
-                self.glymurWrapper(filename, band.astype(uint8))
-            else:
-                self.glymurWrapper(filename, band.astype(uint16))
-            self.config.logger.info('Band ' + bandName + ' exported')
-            self.config.timestamp('L3_Tables: band ' + bandName + ' exported')
+            jobs.append((index, filename))
+
+        self.exportBands(productLevel, jobs)
+        # the image files are listed in the order of the bands:
+        for index, filename in jobs:
             filename = os.path.basename(filename.strip('.jp2'))
             imageFile3 = etree.Element('IMAGE_FILE')
             # by intention os.path.join is not used here, as otherwise validation on windows fails:
@@ -960,6 +1423,94 @@ class L3_Tables(object):
         self.config.timestamp(productLevel + '_Tables: stop export')
         return True
 
+    def exportBands(self, productLevel, jobs):
+        ''' Export a list of bands. The bands are read from the database in the calling thread,
+            the median filter and the JPEG-2000 encoding are performed concurrently by a pool
+            of worker threads, if more than one thread is configured. The bands are processed
+            in batches of one band per thread, thus not more bands than threads are held in memory.
+
+            :param productLevel: [ L2A | L3].
+            :type productLevel: str
+            :param jobs: the bands to export.
+            :type jobs: list of (band index, file name) tuples.
+            :rtype: none.
+
+        '''
+        # at least one thread, also if there is nothing to export:
+        nrThreads = max(min(self.config.nrThreads, len(jobs)), 1)
+        pool = None
+        if nrThreads > 1:
+            pool = ThreadPool(nrThreads)
+        try:
+            for i in range(0, len(jobs), nrThreads):
+                batch = []
+                for index, filename in jobs[i:i + nrThreads]:
+                    if self.testBand(productLevel, index):
+                        band = self.getBand(productLevel, index)
+                    else:
+                        # create mosaic map if first tile:
+                        band = self.getBand(productLevel, self.SCL)
+                        band[band > 0] = 1
+                        self.setBand(productLevel, self.MSC, band)
+                    batch.append((index, filename, band))
+                if pool is not None:
+                    pool.map(lambda job: self.encodeBand(*job), batch)
+                else:
+                    self.encodeBand(*batch[0])
+                batch = None
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return
+
+    def encodeBand(self, bandIndex, filename, band):
+        ''' Apply the median filter to a band and encode it to JPEG-2000.
+            Does not access the database, thus it can be executed concurrently by worker threads.
+
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param filename: file name of JPEG-2000 output image.
+            :type filename: str
+            :param band: the pixel data.
+            :type band: a 2 dimensional numpy array (row x column).
+            :rtype: none.
+
+        '''
+        bandName = self.getBandNameFromIndex(bandIndex)
+        # Median Filter:
+        mf = self.config.medianFilter
+        if(mf > 0):
+            band = self.medianFilter(band)
+
+        if (bandIndex == self.SCL) or (bandIndex == self.MSC):
+            self.glymurWrapper(filename, band.astype(uint8))
+        else:
+            self.glymurWrapper(filename, band.astype(uint16))
+        self.config.logger.info('Band ' + bandName + ' exported')
+        self.config.timestamp('L3_Tables: band ' + bandName + ' exported')
+        return
+
+    def medianFilter(self, arr, nrThreads=1):
+        ''' Apply the median filter of the configured size to an array. With the method
+            SORTING_NETWORK and an odd filter size, the exact sorting network implementation
+            of L3_Library is used, else the median filter of scipy.ndimage. Both give
+            identical results.
+
+            :param arr: the image array.
+            :type arr: 2 dimensional numpy array (nrow x ncols).
+            :param nrThreads: the number of threads for the sorting network.
+            :type nrThreads: unsigned int
+            :return: the filtered array.
+            :rtype: 2 dimensional numpy array (nrow x ncols).
+
+        '''
+        mf = self.config.medianFilter
+        if (self.config.medianFilterMethod == 'SORTING_NETWORK') and (mf % 2 == 1):
+            return fastMedianFilter(arr, mf, nrThreads)
+        from scipy import ndimage
+        return ndimage.filters.median_filter(arr, (mf, mf))
+
     def scalePreview(self, arr):
         ''' Scale image array for preview. Helper function used by createRgbImage().
 
@@ -1022,24 +1573,250 @@ class L3_Tables(object):
         try:
             if self.testBand(productLevel, bandIndex) == True:
                 self.delBand(productLevel, bandIndex)
-            h5file = open_file(self._imageDatabase, mode='a')
+            h5file = self.openDatabase()
             bandName = self.getBandNameFromIndex(bandIndex)
             dtIn = self.mapDataType(arr.dtype)
-            filters = Filters(complib="zlib", complevel=1)
             # create new group and append node:
             if productLevel == 'L2A':
                 locator = h5file.root.L2A
             elif productLevel == 'L3':
                 locator = h5file.root.L3
 
-            node = h5file.create_earray(locator, bandName, dtIn, (0,arr.shape[1]), bandName, filters=filters)
+            node = self.createNode(locator, bandName, dtIn, arr.shape)
             self.config.logger.debug('%s: Band %02d %s added to table', productLevel, bandIndex, self.getBandNameFromIndex(bandIndex))
-            node.append(arr)
+            node[:] = arr
+            result = True
+        except NoSuchNodeError:
+            self.config.logger.debug('%s: Band %s cannot be set', productLevel, self.getBandNameFromIndex(bandIndex))
+            result = False
+        return result
+
+    def createNode(self, locator, bandName, atom, size):
+        ''' Create a chunked array node of known size in H5 database.
+            The chunks span the full row width and a resolution dependent number of rows,
+            aligned to the row blocks of the block wise processing.
+
+            :param locator: the group of the product level.
+            :type locator: a pyTables group.
+            :param bandName: the band name.
+            :type bandName: str
+            :param atom: the data type of the band.
+            :type atom: a pyTables atom.
+            :param size: image size (nrows x ncols).
+            :type size: data tuple (unsigned int).
+            :return: the new node.
+            :rtype: a pyTables CArray.
+
+        '''
+        h5file = self.openDatabase()
+        return h5file.create_carray(locator, bandName, atom, size, bandName,
+                                    filters=self.getFilters(), chunkshape=self.getChunkShape(size))
+
+    def getChunkShape(self, size):
+        ''' Get the chunk shape for a band of given size.
+
+            :param size: image size (nrows x ncols).
+            :type size: data tuple (unsigned int).
+            :return: the chunk shape (nrows x ncols).
+            :rtype: data tuple (unsigned int).
+
+        '''
+        return (max(1, min(self._chunkRows, size[0])), size[1])
+
+    def getFilters(self):
+        ''' Get the compression filters for the bands of the database, as configured in the GIPP.
+            Falls back to zlib, if the configured library is not available.
+
+            :return: the compression filters.
+            :rtype: a pyTables Filters object.
+
+        '''
+        if self._filters is not None:
+            return self._filters
+        complib = self.config.compression.lower()
+        complevel = self.config.compressionLevel
+        if complib == 'none' or complevel == 0:
+            self._filters = Filters(complevel=0)
+            return self._filters
+
+        library = complib.split(':')
+        available = which_lib_version(library[0]) is not None
+        if available and len(library) > 1:
+            available = library[1] in blosc_compressor_list()
+        if not available:
+            self.config.logger.error('compression library %s is not available, zlib will be used.' % complib)
+            complib = 'zlib'
+        shuffle = self.config.compressionShuffle
+        self._filters = Filters(complib=complib, complevel=complevel,
+                                shuffle=(shuffle == 'SHUFFLE'), bitshuffle=(shuffle == 'BITSHUFFLE'))
+        return self._filters
+
+    def createBand(self, productLevel, bandIndex, size, dataType):
+        ''' Create a single band in H5 database, initialized with zeros.
+            The band can then be written in row blocks via setBandBlock.
+
+            :param productLevel: [ L2A | L3].
+            :type productLevel: str
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param size: image size (nrows x ncols).
+            :type size: data tuple (unsigned int).
+            :param dataType: the numpy data type of the band.
+            :type dataType: numpy dtype
+            :return: false if error occurred during creation of band.
+            :rtype: boolean
+
+        '''
+        self.verifyProductId(productLevel)
+        try:
+            if self.testBand(productLevel, bandIndex) == True:
+                self.delBand(productLevel, bandIndex)
+            h5file = self.openDatabase()
+            bandName = self.getBandNameFromIndex(bandIndex)
+            dtIn = self.mapDataType(dtype(dataType))
+            locator = h5file.get_node('/' + productLevel)
+            self.createNode(locator, bandName, dtIn, size)
+            self.config.logger.debug('%s: Band %02d %s created', productLevel, bandIndex, bandName)
+            result = True
+        except NoSuchNodeError:
+            self.config.logger.debug('%s: Band %s cannot be created', productLevel, self.getBandNameFromIndex(bandIndex))
+            result = False
+        return result
+
+    def getRowBlocks(self, nrows):
+        ''' Get the row blocks for a block wise processing of a band.
+
+            :param nrows: the number of rows of the band.
+            :type nrows: unsigned int
+            :return: list of row blocks (first row, last row + 1).
+            :rtype: list of tuples (unsigned int).
+
+        '''
+        step = self._blockRows
+        return [(rowStart, min(rowStart + step, nrows)) for rowStart in range(0, nrows, step)]
+
+    def getBlockHistogram(self, arr):
+        ''' Get the histogram of the class values of a row block, in a single pass.
+
+            :param arr: the row block of an 8 bit band, e.g. the scene classification.
+            :type arr: a 2 dimensional numpy array of type unsigned int 8
+            :return: the pixel count of each class value.
+            :rtype: a numpy array (256) of type int 64
+
+        '''
+        return bincount(arr.ravel(), minlength=256).astype(int64)
+
+    def getClassHistogram(self, productLevel, bandIndex=None):
+        ''' Get the histogram of the class values of a band, e.g. of the scene classification
+            or the mosaic map. The band is read row block by row block, the histograms
+            of the row blocks are merged.
+
+            :param productLevel: [ L2A | L3].
+            :type productLevel: str
+            :param bandIndex: the band index, default is the scene classification.
+            :type bandIndex: unsigned int
+            :return: the pixel count of each class value.
+            :rtype: a numpy array (256) of type int 64
+
+        '''
+        if bandIndex is None:
+            bandIndex = self.SCL
+        histogram = zeros(256, dtype=int64)
+        nrows = self.getBandSize(productLevel, bandIndex)[0]
+        for rowStart, rowStop in self.getRowBlocks(nrows):
+            histogram += self.getBlockHistogram(self.getBandBlock(productLevel, bandIndex, rowStart, rowStop))
+        return histogram
+
+    def getBlockIndex(self):
+        ''' Get the row block index of the L3 scene classification, as stored by setBlockIndex.
+            The index is kept as attribute of the scene classification node,
+            thus it becomes invalid with any replacement of the node.
+
+            :return: the bit packed flags of the scene classes present in each row block,
+                     false if no index matching the row blocks exists.
+            :rtype: a 2 dimensional numpy array (nblocks x 32) of type unsigned int 8
+
+        '''
+        bandName = self.getBandNameFromIndex(self.SCL)
+        try:
+            h5file = self.openDatabase()
+            node = h5file.get_node('/L3', bandName)
+        except NoSuchNodeError:
+            return False
+        return checkBlockIndex(node, self._blockRows)
+
+    def setBlockIndex(self, index):
+        ''' Store the row block index of the L3 scene classification.
+
+            :param index: the bit packed flags of the scene classes present in each row block.
+            :type index: a 2 dimensional numpy array (nblocks x 32) of type unsigned int 8
+            :return: false if the scene classification does not exist.
+            :rtype: boolean
+
+        '''
+        bandName = self.getBandNameFromIndex(self.SCL)
+        try:
+            h5file = self.openDatabase()
+            node = h5file.get_node('/L3', bandName)
+        except NoSuchNodeError:
+            return False
+        node._v_attrs.BLOCK_ROWS = self._blockRows
+        node._v_attrs.BLOCK_INDEX = index
+        return True
+
+    def getBandBlock(self, productLevel, bandIndex, rowStart, rowStop):
+        ''' Get a row block of a single band from database.
+            Only the requested rows are read and decompressed.
+
+            :param productLevel: [ L2A | L3].
+            :type productLevel: str
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param rowStart: first row of the block.
+            :type rowStart: unsigned int
+            :param rowStop: last row of the block + 1.
+            :type rowStop: unsigned int
+            :return: the pixel data.
+            :rtype: a 2 dimensional numpy array (row x column)
+
+        '''
+        self.verifyProductId(productLevel)
+        bandName = self.getBandNameFromIndex(bandIndex)
+        try:
+            h5file = self.openDatabase()
+            node = h5file.get_node('/' + productLevel, bandName)
+            result = node.read(rowStart, rowStop)
+        except NoSuchNodeError:
+            self.config.logger.debug('%s: Band %s is missing', productLevel, self.getBandNameFromIndex(bandIndex))
+            result = False
+        return result
+
+    def setBandBlock(self, productLevel, bandIndex, rowStart, arr):
+        ''' Write a row block of a single band to H5 database.
+            The band must already exist, with the full size of the image.
+
+            :param productLevel: [ L2A | L3].
+            :type productLevel: str
+            :param bandIndex: the band index.
+            :type bandIndex: unsigned int
+            :param rowStart: first row of the block.
+            :type rowStart: unsigned int
+            :param arr: the pixel data of the block.
+            :type arr: a 2 dimensional numpy array (row x column)
+            :return: false if error occurred during setting of block.
+            :rtype: boolean
+
+        '''
+        self.verifyProductId(productLevel)
+        bandName = self.getBandNameFromIndex(bandIndex)
+        try:
+            h5file = self.openDatabase()
+            node = h5file.get_node('/' + productLevel, bandName)
+            node[rowStart:rowStart + arr.shape[0]] = arr
             result = True
         except NoSuchNodeError:
             self.config.logger.debug('%s: Band %s cannot be set', productLevel, self.getBandNameFromIndex(bandIndex))
             result = False
-        h5file.close()
         return result
 
     def delBand(self, productLevel, bandIndex):
@@ -1055,7 +1832,7 @@ class L3_Tables(object):
         '''  
         self.verifyProductId(productLevel)
         try:
-            h5file = open_file(self._imageDatabase, mode='a')
+            h5file = self.openDatabase()
             bandName = self.getBandNameFromIndex(bandIndex)
             if(h5file.__contains__('/' + productLevel + '/' + bandName)):
                 node = h5file.get_node('/' + productLevel, bandName)
@@ -1065,7 +1842,6 @@ class L3_Tables(object):
         except NoSuchNodeError:
             self.config.logger.debug('%s: Band %s cannot be removed', productLevel, self.getBandNameFromIndex(bandIndex))
             result = False
-        h5file.close()
         return result
 
     def delBandList(self, productLevel):
@@ -1078,7 +1854,7 @@ class L3_Tables(object):
             
         ''' 
         try:
-            h5file = open_file(self._imageDatabase, mode='a')
+            h5file = self.openDatabase()
             if(h5file.__contains__('/' + productLevel)):
                 node = h5file.get_node('/' + productLevel)
                 del node
@@ -1087,7 +1863,6 @@ class L3_Tables(object):
         except NoSuchNodeError:
             self.config.logger.debug('%s: Bands cannot be removed', productLevel)
             result = False          
-        h5file.close()
         return result            
         
     def delDatabase(self):
@@ -1098,6 +1873,7 @@ class L3_Tables(object):
             
         ''' 
         database = self._imageDatabase
+        self.closeDatabase()
         if os.path.isfile(database):
             os.remove(database)
             self.config.logger.debug('%s: removed', database)
@@ -1115,6 +1891,7 @@ class L3_Tables(object):
             :rtype: boolean
             
         '''
+        from PIL import Image
 
         self.config.logger.debug('Creating Preview Image')
         b = self.getBand(productLevel, self.B02)
@@ -1124,9 +1901,9 @@ class L3_Tables(object):
         # Median Filter:
         mf = self.config.medianFilter
         if (mf > 0):
-            b = ndimage.filters.median_filter(b, (mf, mf))
-            g = ndimage.filters.median_filter(g, (mf, mf))
-            r = ndimage.filters.median_filter(r, (mf, mf))
+            b = self.medianFilter(b, self.config.nrThreads)
+            g = self.medianFilter(g, self.config.nrThreads)
+            r = self.medianFilter(r, self.config.nrThreads)
 
         b1 = self.scalePreview(b)
         g1 = self.scalePreview(g)
@@ -1159,6 +1936,7 @@ class L3_Tables(object):
             :rtype: boolean
 
         '''
+        from PIL import Image
 
         self.config.logger.debug('Creating TCI Image')
         b = self.getBand(productLevel, self.B02)
@@ -1195,7 +1973,7 @@ class L3_Tables(object):
         '''
         result = False
         try:
-            h5file = open_file(self._imageDatabase)
+            h5file = self.openDatabase()
             h5file.get_node('/L3', 'B02')
             h5file.get_node('/L3', 'B03')
             h5file.get_node('/L3', 'B04')
@@ -1205,7 +1983,6 @@ class L3_Tables(object):
             status = 'Database  ' + self._imageDatabase + ' will be removed due to corruption'
             self.removeDatabase()
             result = False
-        h5file.close()
         self.config.logger.info(status)
         return result
     
@@ -1237,18 +2014,18 @@ class L3_Tables(object):
         self.verifyProductId(productLevel)
         bandName = self.getBandNameFromIndex(bandIndex)
         try:
-            h5file = open_file(self._imageDatabase)
+            h5file = self.openDatabase()
             h5file.get_node('/' + productLevel , bandName)
             self.config.logger.debug('%s: Band %s is present', productLevel, self.getBandNameFromIndex(bandIndex))
             result = True
         except NoSuchNodeError:
             self.config.logger.debug('%s: Band %s is missing', productLevel, self.getBandNameFromIndex(bandIndex))
             result = False
-        h5file.close()
         return result
 
     def getBandSize(self, productLevel, bandIndex):
         ''' Get size of image array.
+            The size is taken from the node metadata, the band data are not read.
 
             :param productLevel: [ L2A | L3].
             :type productLevel: str
@@ -1261,20 +2038,18 @@ class L3_Tables(object):
         self.verifyProductId(productLevel)
         bandName = self.getBandNameFromIndex(bandIndex)
         try:
-            h5file = open_file(self._imageDatabase)
+            h5file = self.openDatabase()
             node = h5file.get_node('/' + productLevel, bandName)
-            arr = node.read()
-            ncols = arr.shape[1]
-            nrows = arr.shape[0]
+            nrows, ncols = node.shape[:2]
             result = (nrows, ncols)
         except NoSuchNodeError:
             self.config.logger.debug('%s: Band %s is missing', productLevel, self.getBandNameFromIndex(bandIndex))
             result = False            
-        h5file.close()
         return result
 
     def getDataType(self, productLevel, bandIndex):
         ''' Get data type of image array.
+            The data type is taken from the node atom, the band data are not read.
 
             :param productLevel: [ L2A | L3].
             :type productLevel: str
@@ -1287,13 +2062,12 @@ class L3_Tables(object):
         self.verifyProductId(productLevel)
         bandName = self.getBandNameFromIndex(bandIndex)
         try:
-            h5file = open_file(self._imageDatabase)
+            h5file = self.openDatabase()
             node = h5file.get_node('/' + productLevel, bandName)
-            result = node.dtype
+            result = node.atom.dtype
         except NoSuchNodeError:
             self.config.logger.debug('%s: Band %s is missing', productLevel, self.getBandNameFromIndex(bandIndex))
             result = False            
-        h5file.close()
         return result
         
     def mapDataType(self, dtIn):
@@ -1329,6 +2103,7 @@ class L3_Tables(object):
         return dtOut
 
     def glymurWrapper(self, filename, band):
+        import glymur
         # fix for SIIMPC-687, UMW
         if self.config.resolution == 60:
             kwargs = {"tilesize": (192, 192), "prog": "RPCL"}
@@ -1337,15 +2112,51 @@ class L3_Tables(object):
         elif self.config.resolution == 10:
             kwargs = {"tilesize": (1024, 1024), "prog": "RPCL"}
         # end fix for SIIMPC-687
-        # fix for SIIMPC-558.3, UMW
         glymur.Jp2k(filename, band, **kwargs)
-        jp2_L2A = glymur.Jp2k(filename)
-        boxes_L2A = jp2_L2A.box
-        boxes_L2A.insert(3, self._geobox)
-        boxes_L2A[1] = glymur.jp2box.FileTypeBox(brand='jpx ', compatibility_list=['jpxb', 'jp2 '])
+        # fix for SIIMPC-558.3, UMW
+        self.setGeoJp2Boxes(filename)
+        # end fix for SIIMPC-558.3
+        return
+
+    def setGeoJp2Boxes(self, filename):
+        ''' Complete an encoded JPEG-2000 file to a GeoJP2 file, with the same boxes as a wrap by glymur:
+            the file type box is branded as jpx, compatible to jpxb and jp2, and the geobox is inserted
+            in front of the code stream. The boxes are copied as bytes, the code stream is not decoded.
+            As glymur encodes only into a new file, the code stream is read and written once more,
+            which is the same amount of output I/O as the wrap by glymur.
+
+            :param filename: file name of the encoded JPEG-2000 image.
+            :type filename: str
+
+        '''
         file_L3_geo = os.path.splitext(filename)[0] + '_geo.jp2'
-        jp2_L2A.wrap(file_L3_geo, boxes=boxes_L2A)
+        with open(filename, 'rb') as fpIn, open(file_L3_geo, 'wb') as fpOut:
+            fpIn.seek(0, os.SEEK_END)
+            fileSize = fpIn.tell()
+            offset = 0
+            while offset < fileSize:
+                fpIn.seek(offset)
+                length, boxId = struct.unpack('>I4s', fpIn.read(8))
+                if length == 0:
+                    # box extends to the end of file:
+                    length = fileSize - offset
+                elif length == 1:
+                    length = struct.unpack('>Q', fpIn.read(8))[0]
+                if boxId == 'ftyp':
+                    # brand, minor version and compatibility list:
+                    fpOut.write(struct.pack('>I4s4sI4s4s', 24, 'ftyp', 'jpx ', 0, 'jpxb', 'jp2 '))
+                else:
+                    if boxId == 'jp2c' and self._geobox is not None:
+                        self._geobox.write(fpOut)
+                    fpIn.seek(offset)
+                    remaining = length
+                    while remaining > 0:
+                        chunk = fpIn.read(min(remaining, 1 << 20))
+                        if not chunk:
+                            break
+                        fpOut.write(chunk)
+                        remaining -= len(chunk)
+                offset += length
         os.remove(filename)
         os.rename(file_L3_geo, filename)
-        # end fix for SIIMPC-558.3
         return
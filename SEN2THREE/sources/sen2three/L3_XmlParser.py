@@ -3,17 +3,34 @@
 
 from numpy import *
 import os, sys
+from copy import deepcopy
+from collections import OrderedDict
+from contextlib import contextmanager
 from lxml import etree, objectify
 from L3_Library import stdoutWrite, stderrWrite
 
 class L3_XmlParser():
     ''' A parser for the assignment of xml based metadata to python configuration objects and vice versa.
         Performs also a validation of the metadata against the corresponding scheme.
+        The parsed trees are cached per file, a file is parsed again only if it was modified
+        by other means than export() or convert(). Each parser works on its own copy of the
+        cached tree, thus changes become visible to other parsers with the export only.
+        Within a metadata session, see metadataSession(), the export of selected documents
+        is deferred to the end of the session.
 
             :param productStr: the product string for the given metadata (via __init__).
             :type productStr: a string.
 
     '''
+    # the parsed trees, by absolute path of the file, with the file modification time and size:
+    _treeCache = OrderedDict()
+    _treeCacheSize = 16
+    # the compiled schemes, by path, for the lifetime of the process:
+    _schemaCache = {}
+    # the product strings deferred by the active metadata session, None if no session is active:
+    _deferred = None
+    # the deferred exports, by absolute path of the file, with the parser and the file state on export:
+    _pending = OrderedDict()
 
     def __init__(self, config, productStr):
         self._config = config
@@ -85,12 +102,42 @@ class L3_XmlParser():
         if self._root is not None:
             return True
         try:
-            doc = objectify.parse(self._xmlFn)
-            self._root = doc.getroot()
+            path = os.path.abspath(self._xmlFn)
+            stat = os.stat(path)
+            entry = L3_XmlParser._treeCache.pop(path, None)
+            if entry is not None and entry[0] == (stat.st_mtime, stat.st_size):
+                # the cached tree is never modified, the parser gets its own copy:
+                self._root = deepcopy(entry[1])
+                L3_XmlParser._treeCache[path] = entry
+            else:
+                doc = objectify.parse(self._xmlFn)
+                self._root = doc.getroot()
+                self.cacheRoot(stat)
             return True
         except:
             return False
 
+    def cacheRoot(self, stat=None):
+        ''' Stores a copy of the xml tree in the cache, for the current state of the file.
+            Later changes of the tree by this parser are not seen by other parsers before the next export.
+
+            :param stat: the status of the file, will be read if not given.
+            :type stat: a stat result
+            :rtype: none
+
+        '''
+        path = os.path.abspath(self._xmlFn)
+        if stat is None:
+            stat = os.stat(path)
+        L3_XmlParser._treeCache[path] = ((stat.st_mtime, stat.st_size), deepcopy(self._root))
+        # the trees with pending exports are kept:
+        for key in list(L3_XmlParser._treeCache):
+            if len(L3_XmlParser._treeCache) <= L3_XmlParser._treeCacheSize:
+                break
+            if key not in L3_XmlParser._pending:
+                del L3_XmlParser._treeCache[key]
+        return
+
     def getTree(self, key, subkey):
         ''' Gets the subtree of an xml tree, addressed by the corresponding key and subkey.
 
@@ -137,6 +184,26 @@ class L3_XmlParser():
                     return False
         return False
 
+    def getSchema(self, scheme=None):
+        ''' Gets a compiled scheme. The schemes are compiled once per process,
+            worker processes inherit the schemes compiled before their creation.
+
+            :param scheme: the file name of the scheme in the configuration directory, default is the scheme of the metadata.
+            :type scheme: a string
+            :return: the compiled scheme
+            :rtype: an XMLSchema object
+
+        '''
+        if scheme is None:
+            scheme = self._scheme
+        path = os.path.join(self._config.configDir, scheme)
+        try:
+            return L3_XmlParser._schemaCache[path]
+        except KeyError:
+            schema = etree.XMLSchema(file = path)
+            L3_XmlParser._schemaCache[path] = schema
+            return schema
+
     def validate(self):
         """ Validator for the metadata.
 
@@ -146,9 +213,10 @@ class L3_XmlParser():
         """
         fn = os.path.basename(self._xmlFn)
         self._config.logger.info('validating metadata file %s against scheme' % fn)
+        self.flush()
         err = 'unknown'
         try:
-            schema = etree.XMLSchema(file = os.path.join(self._config.configDir, self._scheme))
+            schema = self.getSchema()
             parser = etree.XMLParser(schema = schema)
             objectify.parse(self._xmlFn, parser)
             self._config.logger.info('metadata file is valid')
@@ -196,6 +264,42 @@ class L3_XmlParser():
             return False
 
     def export(self):
+        ''' Writes the xml tree to the file. Within a metadata session,
+            the export of the deferred documents is performed at the end of the session.
+
+            :return: true if succesful
+            :rtype: bool
+
+        '''
+        if (L3_XmlParser._deferred is not None) and (self._productStr in L3_XmlParser._deferred):
+            path = os.path.abspath(self._xmlFn)
+            stat = os.stat(path)
+            L3_XmlParser._pending[path] = (self, (stat.st_mtime, stat.st_size))
+            # the parsers created later in the session start from the exported tree:
+            self.cacheRoot(stat)
+            return True
+        return self.write()
+
+    def flush(self):
+        ''' Performs a pending export of the document. If the file was replaced after
+            the export, the replacement is kept, as it would have overwritten an immediate export.
+
+            :return: true if succesful
+            :rtype: bool
+
+        '''
+        entry = L3_XmlParser._pending.pop(os.path.abspath(self._xmlFn), None)
+        if entry is None:
+            return True
+        parser, state = entry
+        stat = os.stat(parser._xmlFn)
+        if (stat.st_mtime, stat.st_size) != state:
+            self._config.logger.warning('metadata file %s was replaced after a deferred export, '
+                                        'the pending changes are discarded' % os.path.basename(self._xmlFn))
+            return True
+        return parser.write()
+
+    def write(self):
         import codecs
         outfile = codecs.open(self._xmlFn, 'w', 'utf-8')
         outfile.write('<?xml version="1.0"  encoding="UTF-8"?>')
@@ -203,7 +307,9 @@ class L3_XmlParser():
         outstr = etree.tostring(self._root, pretty_print=True)
         outfile.write(outstr)        
         outfile.close()
-        return self.setRoot()
+        # the tree in memory is the state of the file, no need to parse it again:
+        self.cacheRoot()
+        return True
 
     def convert(self):
         import codecs
@@ -245,6 +351,10 @@ class L3_XmlParser():
         outfile.write('<?xml version="1.0"  encoding="UTF-8"?>')
         outfile.write(outstr)
         outfile.close()
+        # the file differs from the tree in memory, it is parsed again:
+        L3_XmlParser._treeCache.pop(os.path.abspath(self._xmlFn), None)
+        L3_XmlParser._pending.pop(os.path.abspath(self._xmlFn), None)
+        self._root = None
         return self.setRoot()
 
     def getIntArray(self, node):
@@ -339,4 +449,27 @@ class L3_XmlParser():
 
         return False
 
-    
\ No newline at end of file
+    
+
+
+@contextmanager
+def metadataSession(productStrs):
+    ''' Context managed metadata session: the export of the documents of the given
+        product strings is deferred, each document is written once on leaving the context.
+        A nested session joins the active one.
+
+        :param productStrs: the product strings of the documents to be deferred, e.g. ['T03'].
+        :type productStrs: list of str
+
+    '''
+    if L3_XmlParser._deferred is not None:
+        yield
+        return
+    L3_XmlParser._deferred = set(productStrs)
+    try:
+        yield
+    finally:
+        L3_XmlParser._deferred = None
+        while L3_XmlParser._pending:
+            parser = L3_XmlParser._pending.values()[0][0]
+            parser.flush()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+''' Startup time of the processor: times the import of L3_Process in fresh interpreters,
+    as done now, with the image processing libraries imported by the routines using them,
+    and with these libraries imported at startup, as by the previous versions.
+    Libraries which are not installed are left out.
+
+    usage: python benchmark_L3_Process.py [number of runs, default 10]
+'''
+
+import os, sys, subprocess
+from timeit import default_timer
+
+# the libraries imported at startup by the previous versions:
+IMAGE_LIBRARIES = ['glymur', 'PIL.Image', 'scipy.ndimage', 'scipy.interpolate', 'skimage.transform', 'pylab']
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sen2three')
+
+def installed(module):
+    ''' Check if a library is installed, in a fresh interpreter, as importing pylab may fail.
+    '''
+    with open(os.devnull, 'w') as devnull:
+        return subprocess.call([sys.executable, '-c', 'import ' + module], stderr=devnull) == 0
+
+def timeImport(script, runs):
+    ''' Time a script in fresh interpreters.
+
+        :param script: the python statements.
+        :type script: str
+        :param runs: the number of interpreters started.
+        :type runs: unsigned int
+        :return: the median of the wall clock times in seconds.
+        :rtype: float
+
+    '''
+    times = []
+    for _ in range(runs):
+        tStart = default_timer()
+        subprocess.check_call([sys.executable, '-B', '-c', script], cwd=SOURCE_DIR)
+        times.append(default_timer() - tStart)
+    times.sort()
+    return times[len(times) / 2]
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    libraries = [module for module in IMAGE_LIBRARIES if installed(module)]
+    interpreter = timeImport('pass', runs)
+    deferred = timeImport('import L3_Process', runs)
+    eager = timeImport(''.join('import %s; ' % module for module in libraries) + 'import L3_Process', runs)
+    print 'median of %d fresh interpreters, python %s' % (runs, sys.version.split()[0])
+    print 'libraries at startup: %s' % (', '.join(libraries) or 'none installed')
+    print '  interpreter only                    %.3f s' % interpreter
+    print '  import L3_Process                   %.3f s' % deferred
+    print '  import L3_Process, libraries first  %.3f s' % eager
+    print '  saved at startup                    %.3f s' % (eager - deferred)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+''' Common fixtures of the tests. The tests run without a GIPP and without L2A products,
+    the config object is prepared directly with the values needed.
+'''
+
+import os, sys, logging
+import pytest
+
+# the modules of the processor import each other by their module names:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sen2three'))
+
+from L3_Config import L3_Config
+
+# the scene classes, as configured in the Classificators section of the GIPP:
+CLASSIFIER = {'NO_DATA': 0, 'SATURATED_DEFECTIVE': 1, 'DARK_FEATURES': 2, 'CLOUD_SHADOWS': 3,
+              'VEGETATION': 4, 'NOT_VEGETATED': 5, 'WATER': 6, 'UNCLASSIFIED': 7,
+              'MEDIUM_PROBA_CLOUDS': 8, 'HIGH_PROBA_CLOUDS': 9, 'THIN_CIRRUS': 10, 'SNOW_ICE': 11,
+              'URBAN_AREAS': 12}
+
+@pytest.fixture
+def config(tmpdir, monkeypatch):
+    ''' A config object for a source and a target directory below the temporary directory of the test.
+
+        :return: the config object, with the log directory in the temporary directory.
+        :rtype: L3_Config
+
+    '''
+    monkeypatch.setenv('SEN2THREE_HOME', str(tmpdir))
+    config = L3_Config(60, str(tmpdir.mkdir('source')))
+    config.logger = logging.getLogger('sen2three')
+    config.classifier = dict(CLASSIFIER)
+    config.L3_TARGET_DIR = str(tmpdir.mkdir('target'))
+    # the listings are shared by all config objects:
+    L3_Config._inventory = {}
+    # the status file, into which the progress is written by timestamp, as initialised by setTimeEstimation:
+    tmpdir.join('log', '.progress').write('0.0\n')
+    return config
+
+@pytest.fixture
+def tables(config, tmpdir):
+    ''' A table object for the database of a 60 m tile below the temporary directory.
+        The object is set up without a product, as no tile metadata is needed by the tests.
+
+        :return: the table object, the database is not yet created.
+        :rtype: L3_Tables
+
+    '''
+    from L3_Tables import L3_Tables, BLOCK_ROWS
+    tables = L3_Tables.__new__(L3_Tables)
+    tables._h5file = None
+    tables._config = config
+    tables._resolution = 60
+    tables._bandIndex = [0,1,2,3,4,5,6,8,9,11,12]
+    tables._nBands = 11
+    tables._chunkRows = 366
+    tables._L2A_bandDir = str(tmpdir.mkdir('L2A'))
+    tables._L3_bandDir = str(tmpdir.mkdir('L3'))
+    tables._imageDatabase = os.path.join(tables._L3_bandDir, '.database.h5')
+    tables._TmpFile = os.path.join(tables._L3_bandDir, '.tmpfile_')
+    tables._productLevel = ['L2A','L3']
+    tables._bandNames = ['B01','B02','B03','B04','B05','B06','B07','B08','B8A',
+                         'B09','B10','B11','B12','DEM','SCL','SNW','CLD','AOT',
+                         'WVP','VIS','SCM','PRV','ILU','SLP','ASP','HAZ','SDW',
+                         'DDV','HCW','ELE', 'PWC', 'MSL', 'OZO', 'TCI', 'MSC']
+    for index, bandName in enumerate(tables._bandNames):
+        setattr(tables, '_' + bandName, index)
+    tables._geobox = None
+    tables._filters = None
+    tables._deferredJobs = []
+    tables._blockRows = BLOCK_ROWS
+    return tables
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+''' Tests of the product history, the progress status and the inventory of the source directory.
+'''
+
+import os, time
+from L3_Config import L3_Config
+
+L2A_TILE_IDS = ['L2A_T32TPS_A000002_20160111T101010', 'L2A_T32TPS_A000003_20160121T101010',
+                'L2A_T32TPS_A000004_20160131T101010']
+
+def testSkippedTilesHaveNoMosaicNumber(config):
+    config.L2A_TILE_ID = L2A_TILE_IDS[0]
+    assert config.getNrTilesProcessed() == 0
+    assert config.appendTile()
+    config.L2A_TILE_ID = L2A_TILE_IDS[1]
+    assert config.appendTile(skipped=True)
+    # the skipped tile is not processed again:
+    assert config.tileExists(L2A_TILE_IDS[1])
+    assert config.getNrTilesProcessed() == 1
+    config.L2A_TILE_ID = L2A_TILE_IDS[2]
+    assert not config.tileExists(L2A_TILE_IDS[2])
+    assert config.appendTile()
+    assert config.getNrTilesProcessed() == 2
+
+def testProgressInterval(config, tmpdir):
+    status = tmpdir.join('log', '.progress')
+    config.progressInterval = 3600.0
+    config.timestamp('first step')
+    # the first step is always written, the following ones are accumulated:
+    first = status.read()
+    time.sleep(0.01)
+    config.timestamp('second step')
+    assert status.read() == first
+    config.progressInterval = 0.0
+    config.timestamp('third step')
+    assert float(status.read()) > float(first)
+
+def testInventoryIsStoredInLogDirectory(config, tmpdir, monkeypatch):
+    source = tmpdir.join('source')
+    source.mkdir('S2A_USER_PRD_MSIL2A_PDMC_20170101T000000_R0_V20160101T101010_20160101T101010').mkdir('GRANULE')
+    config.inventoryCache = True
+    L3_Config._inventory = {}
+    config.scanSource()
+    # the source directory is not written:
+    assert source.listdir() == [source.join('S2A_USER_PRD_MSIL2A_PDMC_20170101T000000_R0_V20160101T101010_20160101T101010')]
+    assert tmpdir.join('log', '.inventory.json').check()
+    scanned = dict(L3_Config._inventory)
+
+    # the next run reuses the stored listings of the unchanged directories:
+    L3_Config._inventory = {}
+    listdir = os.listdir
+    monkeypatch.setattr(os, 'listdir', lambda path: 1 / 0)
+    config.scanSource()
+    assert L3_Config._inventory == scanned
+    assert all(isinstance(name, str) for _, names in scanned.values() for name in names)
+
+    # a changed directory is listed again:
+    monkeypatch.setattr(os, 'listdir', listdir)
+    source.mkdir('S2A_USER_PRD_MSIL2A_PDMC_20170101T000000_R0_V20160111T101010_20160111T101010')
+    os.utime(str(source), (time.time() + 10, time.time() + 10))
+    L3_Config._inventory = {}
+    config.scanSource()
+    assert len(config.listSource(str(source))) == 2
+
+def testInvalidInventoryIsIgnored(config, tmpdir):
+    inventory = tmpdir.join('log', '.inventory.json')
+    config.inventoryCache = True
+    for content in ['not json', '[]', '{"sourceDir": "%s", "inventory": {"x": 1}}' % config.sourceDir,
+                    '{"sourceDir": "/other", "inventory": {}}']:
+        inventory.write(content)
+        L3_Config._inventory = {}
+        config.scanSource()
+        assert L3_Config._inventory == {config.sourceDir: (os.stat(config.sourceDir).st_mtime, [])}
+
+def testFinerBandsWithBandDerivation(config, tmpdir):
+    tileId = 'L2A_T32TPS_A000002_20160111T101010'
+    imgData = tmpdir.join('source', 'GRANULE', tileId, 'IMG_DATA')
+    imgData.ensure('R60m', dir=True)
+    for filename in ['T32TPS_B02_20m.jp2', 'T32TPS_SCL_20m.jp2', 'T32TPS_AOT_20m.jp2']:
+        imgData.ensure('R20m', filename)
+    config.namingConvention = 'SAFE_COMPACT'
+    tilePath = str(tmpdir.join('source', 'GRANULE'))
+    config.bandDerivation = 'NONE'
+    assert not config.checkTileConsistency(tilePath, tileId)
+    # the bands missing in 60m are derived from 20m:
+    config.bandDerivation = 'AVERAGE'
+    assert config.checkTileConsistency(tilePath, tileId)
+    # but not the bands of a coarser resolution:
+    config.resolution = 10
+    assert not config.checkTileConsistency(tilePath, tileId)
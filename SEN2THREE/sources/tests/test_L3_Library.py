@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+''' Tests of the library functions.
+'''
+
+import pytest
+from numpy import *
+from scipy import ndimage
+from L3_Library import fastMedianFilter
+
+@pytest.mark.parametrize('size', [1, 3, 5, 7])
+@pytest.mark.parametrize('dtype', [uint8, uint16, float32])
+@pytest.mark.parametrize('shape', [(64, 48), (5, 9), (1, 13)])
+def testFastMedianFilterAsNdimage(size, dtype, shape):
+    rs = random.RandomState(size)
+    arr = rs.randint(0, 1000, shape).astype(dtype)
+    assert array_equal(fastMedianFilter(arr, size), ndimage.median_filter(arr, (size, size)))
+
+def testFastMedianFilterOfMasks():
+    # the bad pixel masks of the synthesis, with few values:
+    arr = (random.RandomState(0).rand(400, 300) < 0.3).astype(uint8)
+    expected = ndimage.median_filter(arr, (5, 5))
+    assert array_equal(fastMedianFilter(arr, 5), expected)
+    # filtered concurrently in row blocks:
+    assert array_equal(fastMedianFilter(arr, 5, nrThreads=4), expected)
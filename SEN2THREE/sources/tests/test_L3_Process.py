@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+''' Tests of the tile parallel processing and of the import of the processor.
+'''
+
+import os, sys, subprocess
+from contextlib import contextmanager
+from multiprocessing import Pool, RLock, Event
+import pytest
+import L3_Process
+from L3_Config import L3_Config
+from L3_Product import L3_Product
+from L3_Synthesis import L3_Synthesis
+
+# user products of increasing observation time, each with the same two tiles:
+UP_IDS = ['S2A_USER_PRD_MSIL2A_PDMC_20170101T000000_R0_V201601%02dT101010_201601%02dT101010' % (day, day)
+          for day in [1, 11, 21, 31]]
+TILE_IDS = ['S2A_USER_MSI_L03_TL_MPS__20170101T000000_A000000_T32TPS_N02.01',
+            'S2A_USER_MSI_L03_TL_MPS__20170101T000000_A000000_T32TQS_N02.01']
+
+def decideScenes(items):
+    ''' Decide for each scene, if it is the better scene, in the order of the items.
+
+        :param items: the user product ID and the L3 tile ID of the scenes.
+        :type items: list of tuples
+        :return: the scenes, with the decisions.
+        :rtype: list of tuples
+
+    '''
+    config = L3_Config(None)
+    product = L3_Product(config)
+    synthesis = L3_Synthesis(config)
+    synthesis.product = product
+    decisions = []
+    for L2A_UP_ID, L3_TILE_ID in items:
+        config.L2A_UP_ID = L2A_UP_ID
+        config.L3_TILE_ID = L3_TILE_ID
+        synthesis._isBetterScene = False
+        decisions.append((L2A_UP_ID, L3_TILE_ID, synthesis.isMoreRecent()))
+    return decisions
+
+def testParallelGroupsDecideAsSequential(config):
+    ''' The tile groups of the parallel processing must take the same decisions on the better scene
+        as the sequential processing, as the best values of the past are kept per tile.
+    '''
+    scenes = [(L2A_UP_ID, L3_TILE_ID) for L2A_UP_ID in UP_IDS for L3_TILE_ID in TILE_IDS]
+    config.nrProcesses = len(TILE_IDS)
+    L3_Product(config).createTable()
+    sequential = decideScenes(scenes)
+    # all scenes are more recent than the previous scenes of the same tile:
+    assert [decision for _, _, decision in sequential] == [True] * len(scenes)
+
+    L3_Product(config).createTable()
+    config.lock = RLock()
+    pool = Pool(len(TILE_IDS))
+    try:
+        groups = [[scene for scene in scenes if scene[1] == L3_TILE_ID] for L3_TILE_ID in TILE_IDS]
+        parallel = sum(pool.map(decideScenes, groups), [])
+    finally:
+        pool.close()
+        pool.join()
+    assert sorted(parallel) == sorted(sequential)
+
+def testSequentialDecidesProductWide(config):
+    ''' Without tile parallel processing, the best values of the past are product wide:
+        a scene is compared with the more recent scenes of the other tiles.
+    '''
+    scenes = [(UP_IDS[1], TILE_IDS[0]), (UP_IDS[0], TILE_IDS[1]), (UP_IDS[2], TILE_IDS[1])]
+    L3_Product(config).createTable()
+    assert [decision for _, _, decision in decideScenes(scenes)] == [True, False, True]
+    # with tile parallel processing, the tiles are independent:
+    config.nrProcesses = len(TILE_IDS)
+    L3_Product(config).createTable()
+    assert [decision for _, _, decision in decideScenes(scenes)] == [True, True, True]
+
+@pytest.fixture
+def tileGroup(config, monkeypatch):
+    ''' The processing of a tile group by processTileGroup, with stubs for the product, the tables and
+        the processor, which record the processing. The result of a tile is set in results,
+        the tiles in skipped cannot contribute to the mosaic.
+
+        :return: the recorded calls, the results and the skipped tiles.
+        :rtype: dict
+
+    '''
+    recorded = {'processed': [], 'skipped': [], 'appended': [], 'results': {}, 'cannotContribute': set()}
+    class Product(object):
+        def __init__(self, config):
+            self.config = config
+        def updateUserProduct(self, L2A_UP_ID):
+            self.config.L2A_UP_ID = L2A_UP_ID
+        def reinitL2A_Tile(self):
+            pass
+    class Tables(object):
+        B02 = 1
+        def __init__(self, product):
+            self.product = product
+        @contextmanager
+        def session(self):
+            yield self
+        def init(self):
+            pass
+        def testBand(self, productLevel, bandIndex):
+            return True
+    class Synthesis(object):
+        def canContribute(self, product):
+            if product.config.L2A_TILE_ID in recorded['cannotContribute']:
+                return False, L3_Process.NO_USABLE_PIXELS
+            return True, None
+        def updateBestValues(self, product):
+            recorded['skipped'].append((product.config.L2A_UP_ID, product.config.L2A_TILE_ID))
+    class Processor(object):
+        def __init__(self, config):
+            self.l3Synthesis = Synthesis()
+        def process(self, tables):
+            item = (tables.product.config.L2A_UP_ID, tables.product.config.L2A_TILE_ID)
+            recorded['processed'].append(item)
+            result = recorded['results'].get(item[1], 0)
+            if result == 'exitError':
+                tables.product.config.exitError()
+            return self, result
+    monkeypatch.setattr(L3_Process, 'L3_Product', Product)
+    monkeypatch.setattr(L3_Process, 'L3_Tables', Tables)
+    monkeypatch.setattr(L3_Process, 'L3_Process', Processor)
+    @contextmanager
+    def metadataSession(products):
+        yield
+    monkeypatch.setattr(L3_Process, 'metadataSession', metadataSession)
+    monkeypatch.setattr(L3_Process, 'terminated', Event())
+    monkeypatch.setattr(L3_Config, 'checkTimeRange', lambda self, L2A_UP_ID: True)
+    monkeypatch.setattr(L3_Config, 'writeTimeEstimation', lambda self, resolution, tMeasure: None)
+    monkeypatch.setattr(L3_Config, 'appendTile',
+                        lambda self, skipped=False: recorded['appended'].append((self.L2A_TILE_ID, skipped)) or True)
+    return recorded
+
+# the tiles of one target tile, in the order of the observation time:
+GROUP = [(UP_IDS[index], 'L2A_T32TPS_A00000%d_201601%02dT101010' % (index, day))
+         for index, day in enumerate([1, 11, 21, 31])]
+
+def testTileGroupInOrder(tileGroup):
+    tileGroup['cannotContribute'].add(GROUP[1][1])
+    assert L3_Process.processTileGroup(GROUP) == (0, GROUP[-1])
+    assert tileGroup['processed'] == [GROUP[0], GROUP[2], GROUP[3]]
+    # the skipped scene keeps its place in the order of the best values:
+    assert tileGroup['skipped'] == [GROUP[1]]
+    assert tileGroup['appended'] == [(GROUP[1][1], True)]
+    assert not L3_Process.terminated.is_set()
+
+def testTileGroupTerminates(tileGroup):
+    tileGroup['results'][GROUP[1][1]] = 1
+    assert L3_Process.processTileGroup(GROUP) == (1, GROUP[1])
+    assert tileGroup['processed'] == GROUP[:2]
+    # the other groups stop before their next tile:
+    assert L3_Process.terminated.is_set()
+    assert L3_Process.processTileGroup(GROUP[2:]) == (1, None)
+    assert tileGroup['processed'] == GROUP[:2]
+
+@pytest.mark.parametrize('error', [-1, 'exitError'])
+def testTileGroupFails(tileGroup, error):
+    tileGroup['results'][GROUP[2][1]] = error
+    # the last item processed successfully is returned for the post processing:
+    assert L3_Process.processTileGroup(GROUP) == (-1, GROUP[1])
+    assert tileGroup['processed'] == GROUP[:3]
+
+def testTileGroupFailsOnHistory(tileGroup, monkeypatch):
+    tileGroup['cannotContribute'].add(GROUP[0][1])
+    monkeypatch.setattr(L3_Config, 'appendTile', lambda self, skipped=False: False)
+    assert L3_Process.processTileGroup(GROUP) == (-1, None)
+    assert tileGroup['processed'] == []
+
+def testTileGroupsInObservationOrder(config, tmpdir, monkeypatch):
+    tiles = {}
+    # the products are created in another order than their observation times:
+    for index, L2A_UP_ID in reversed(list(enumerate(UP_IDS))):
+        GRANULE = tmpdir.join('source', L2A_UP_ID, 'GRANULE')
+        tiles[L2A_UP_ID] = ['L2A_%s_A00000%d_%s' % (tileId, index, L2A_UP_ID[-15:]) for tileId in ['T32TQS', 'T32TPS']]
+        for tile in tiles[L2A_UP_ID] + ['QI_DATA']:
+            GRANULE.ensure(tile, dir=True)
+    created = []
+    class Product(object):
+        def updateUserProduct(self, L2A_UP_ID):
+            created.append(L2A_UP_ID)
+    monkeypatch.setattr(L3_Config, 'checkTimeRange', lambda self, L2A_UP_ID: True)
+    monkeypatch.setattr(L3_Config, 'checkTileConsistency', lambda self, GRANULE, tile: True)
+    config.tileFilter = ['*']
+    config.namingConvention = 'SAFE_COMPACT'
+    # a tile processed by a previous run:
+    config.L2A_TILE_ID = tiles[UP_IDS[1]][1]
+    config.appendTile()
+
+    targetTiles, groups = L3_Process.getTileGroups(config, Product())
+    assert targetTiles == ['T32TPS', 'T32TQS']
+    assert groups['T32TPS'] == [(UP_IDS[index], tiles[UP_IDS[index]][1]) for index in [0, 2, 3]]
+    assert groups['T32TQS'] == [(L2A_UP_ID, tiles[L2A_UP_ID][0]) for L2A_UP_ID in UP_IDS]
+    # the target product is created with the first user product:
+    assert created == [UP_IDS[0]]
+
+def testTargetTiles(config):
+    assert L3_Process.getTargetTileId(config, GROUP[0][1]) == 'T32TPS'
+    config.namingConvention = 'SAFE_STANDARD'
+    tile = 'S2A_USER_MSI_L2A_TL_MPS__20160101T101010_A000000_T32TPS_N02.01'
+    assert L3_Process.getTargetTileId(config, tile) == 'T32TPS'
+
+def testImportDefersImageLibraries():
+    ''' Importing the processor must not load the image processing libraries,
+        these are imported by the routines using them.
+    '''
+    script = 'import sys, L3_Process; print " ".join(sys.modules)'
+    sourceDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sen2three')
+    modules = subprocess.check_output([sys.executable, '-B', '-c', script], cwd=sourceDir).split()
+    packages = set(module.split('.')[0] for module in modules)
+    assert not packages & set(['glymur', 'PIL', 'scipy', 'skimage', 'matplotlib', 'pylab'])
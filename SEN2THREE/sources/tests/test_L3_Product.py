@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+''' Tests of the statistics of the product.
+'''
+
+import os
+import tables
+from numpy import *
+from L3_Product import L3_Product, STATISTICS
+
+TILE_IDS = ['S2A_USER_MSI_L03_TL_MPS__20170101T000000_A000000_T32TPS_N02.01',
+            'S2A_USER_MSI_L03_TL_MPS__20170101T000000_A000000_T32TQS_N02.01',
+            'S2A_USER_MSI_L03_TL_MPS__20170101T000000_A000000_T32UPU_N02.01']
+
+def scanTable(config):
+    ''' Read the statistics of the current resolution by a scan over all rows of the table.
+
+        :return: the tile count and the pixel counts, by tile ID.
+        :rtype: dict
+
+    '''
+    h5file = tables.open_file(os.path.join(config.L3_TARGET_DIR, '.database.h5'), mode='r')
+    try:
+        return dict((row['TILE_ID'], [int(row['TILES_COUNT'])] + [int(row[column]) for column in STATISTICS])
+                    for row in h5file.root.group1.classes if row['RESOLUTION'] == config.resolution)
+    finally:
+        h5file.close()
+
+def updates(seed):
+    ''' A sequence of updates of the statistics, with repeated tiles.
+    '''
+    rs = random.RandomState(seed)
+    for tileNr in rs.randint(0, len(TILE_IDS), 12):
+        yield TILE_IDS[tileNr], rs.randint(0, 1 << 24, len(STATISTICS))
+
+def testUpdateTableRowAsScan(config):
+    product = L3_Product(config)
+    product.createTable()
+    expected = {}
+    for L3_TILE_ID, counts in updates(0):
+        config.L3_TILE_ID = L3_TILE_ID
+        product.updateTableRow(counts)
+        tileID = L3_TILE_ID[-13:-7] + '_60'
+        tilesCount = expected.get(tileID, [0])[0] + 1
+        expected[tileID] = [tilesCount] + list(counts)
+        assert scanTable(config) == expected
+
+def testUpdateTableRowWithoutIndex(config):
+    product = L3_Product(config)
+    product.createTable()
+    # the table of a previous version:
+    h5file = tables.open_file(os.path.join(config.L3_TARGET_DIR, '.database.h5'), mode='a')
+    h5file.root.group1.classes.cols.TILE_ID.remove_index()
+    h5file.close()
+    config.L3_TILE_ID = TILE_IDS[0]
+    product.updateTableRow(arange(len(STATISTICS)))
+    product.updateTableRow(arange(len(STATISTICS)) * 2)
+    assert scanTable(config) == {'T32TPS_60': [2] + range(0, 2 * len(STATISTICS), 2)}
+
+def scanTotals(config):
+    ''' Sum up the pixel counts of the current resolution by a scan over all rows of the table.
+    '''
+    sums = zeros(len(STATISTICS), dtype=int64)
+    for counts in scanTable(config).values():
+        sums += counts[1:]
+    return dict(zip(STATISTICS, sums))
+
+def testRunningTotalsAsScan(config):
+    product = L3_Product(config)
+    product.createTable()
+    for L3_TILE_ID, counts in updates(1):
+        config.L3_TILE_ID = L3_TILE_ID
+        product.updateTableRow(counts)
+        assert product.getTotals() == scanTotals(config)
+    # read again by another process, from the attributes of the table:
+    L3_Product._totals.clear()
+    assert product.getTotals() == scanTotals(config)
+
+def testRunningTotalsOfPreviousVersion(config):
+    product = L3_Product(config)
+    product.createTable()
+    for L3_TILE_ID, counts in updates(2):
+        config.L3_TILE_ID = L3_TILE_ID
+        product.updateTableRow(counts)
+    # a database of a previous version has no running totals, the table is summed up:
+    h5file = tables.open_file(os.path.join(config.L3_TARGET_DIR, '.database.h5'), mode='a')
+    del h5file.root.group1.classes.attrs.TOTALS_60
+    h5file.close()
+    L3_Product._totals.clear()
+    assert product.getTotals() == scanTotals(config)
+    config.L3_TILE_ID = TILE_IDS[0]
+    product.updateTableRow(arange(len(STATISTICS)))
+    assert product.getTotals() == scanTotals(config)
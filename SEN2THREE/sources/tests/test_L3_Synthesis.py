@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+''' Tests of the spatio temporal algorithms.
+'''
+
+import os, time
+from datetime import datetime
+import pytest
+import itertools
+import tables
+from numpy import *
+from L3_Product import L3_Product
+from L3_Synthesis import L3_Synthesis, NO_USABLE_PIXELS, NOT_BETTER
+
+L2A_UP_ID = 'S2A_USER_PRD_MSIL2A_PDMC_20170101T000000_R0_V20160111T101010_20160111T101010'
+L2A_TILE_ID = 'L2A_T32TPS_A000002_20160111T101010'
+L3_TILE_ID = 'L03_T32TPS_A000001_20160101T101010'
+
+TILE_MTD = '''<Level-2A_Tile_ID>
+  <General_Info><TILE_ID>%s</TILE_ID><SENSING_TIME>2016-01-11T10:10:10.000Z</SENSING_TIME></General_Info>
+  <Geometric_Info><Tile_Angles><Mean_Sun_Angle>
+    <ZENITH_ANGLE unit="deg">%f</ZENITH_ANGLE>
+  </Mean_Sun_Angle></Tile_Angles></Geometric_Info>
+  <Quality_Indicators_Info><Image_Content_QI>
+    <NODATA_PIXEL_PERCENTAGE>%f</NODATA_PIXEL_PERCENTAGE>
+    <DARK_FEATURES_PERCENTAGE>0.0</DARK_FEATURES_PERCENTAGE>
+    <CLOUD_SHADOW_PERCENTAGE>0.0</CLOUD_SHADOW_PERCENTAGE>
+    <VEGETATION_PERCENTAGE>%f</VEGETATION_PERCENTAGE>
+    <NOT_VEGETATED_PERCENTAGE>0.0</NOT_VEGETATED_PERCENTAGE>
+    <WATER_PERCENTAGE>0.0</WATER_PERCENTAGE>
+    <THIN_CIRRUS_PERCENTAGE>0.0</THIN_CIRRUS_PERCENTAGE>
+    <SNOW_ICE_PERCENTAGE>0.0</SNOW_ICE_PERCENTAGE>
+  </Image_Content_QI></Quality_Indicators_Info>
+</Level-2A_Tile_ID>
+'''
+
+@pytest.fixture
+def scene(config, tmpdir):
+    ''' A scene of an L2A tile and the target product, into which it is processed.
+        The tile metadata and the L3 database are created by the test, see writeScene and writeMosaic.
+
+        :return: the config object, prepared for the scene.
+        :rtype: L3_Config
+
+    '''
+    config.namingConvention = 'SAFE_COMPACT'
+    config.algorithm = 'MOST_RECENT'
+    config.targetDir = str(tmpdir.join('target'))
+    config.L3_TARGET_ID = 'L3_TARGET'
+    config.L3_TARGET_DIR = os.path.join(config.targetDir, config.L3_TARGET_ID)
+    os.makedirs(os.path.join(config.L3_TARGET_DIR, 'GRANULE'))
+    config.L2A_UP_ID = L2A_UP_ID
+    config.L2A_UP_DIR = os.path.join(config.sourceDir, L2A_UP_ID)
+    config.L2A_TILE_ID = L2A_TILE_ID
+    config.L3_TILE_ID = L3_TILE_ID
+    os.makedirs(os.path.join(config.L2A_UP_DIR, 'GRANULE', L2A_TILE_ID))
+    L3_Product(config).createTable()
+    return config
+
+def writeScene(config, noData=0.0, vegetation=100.0, sza=30.0):
+    ''' Write the tile metadata of the current scene, with the given image content QI and solar zenith angle.
+    '''
+    fn = os.path.join(config.L2A_UP_DIR, 'GRANULE', L2A_TILE_ID, 'MTD_TL.xml')
+    with open(fn, 'w') as f:
+        f.write(TILE_MTD % (L2A_TILE_ID, sza, noData, vegetation))
+    # the parsed metadata is cached per modification time of the file:
+    os.utime(fn, (time.time(), time.time() + 1))
+    # as set by the processing loops, before the decision on the scene:
+    L3_Product(config).reinitL2A_Tile()
+
+def writeMosaic(config, scl, index=True):
+    ''' Write the L3 scene classification of the target tile, with its row block index.
+    '''
+    imgDir = os.path.join(config.L3_TARGET_DIR, 'GRANULE', L3_TILE_ID, 'IMG_DATA', 'R60m')
+    os.makedirs(imgDir)
+    h5file = tables.open_file(os.path.join(imgDir, '.database.h5'), mode='w')
+    h5file.create_group('/', 'L2A')
+    h5file.create_group('/', 'L3')
+    node = h5file.create_array('/L3', 'SCL', scl)
+    if index:
+        node._v_attrs.BLOCK_ROWS = 366
+        node._v_attrs.BLOCK_INDEX = array([packbits(bincount(scl[row:row + 366].ravel(), minlength=256) > 0)
+                                           for row in range(0, scl.shape[0], 366)])
+    h5file.close()
+
+def observationTime():
+    return time.mktime(datetime.strptime(L2A_UP_ID[45:60], '%Y%m%dT%H%M%S').timetuple())
+
+L3_TILE_MTD = '''<Level-3_Tile_ID>
+  <General_Info><TILE_ID>%s</TILE_ID><SENSING_TIME>2016-01-01T10:10:10.000Z</SENSING_TIME></General_Info>
+  <Geometric_Info><Tile_Angles><Mean_Sun_Angle>
+    <ZENITH_ANGLE unit="deg">40.0</ZENITH_ANGLE>
+  </Mean_Sun_Angle></Tile_Angles></Geometric_Info>
+  <Quality_Indicators_Info>
+    <Classification_QI resolution="60"/>
+    <Mosaic_QI resolution="60"/>
+  </Quality_Indicators_Info>
+</Level-3_Tile_ID>
+'''
+
+CLEAN = full((732, 4), 4, dtype=uint8)
+CLOUDY = CLEAN.copy()
+CLOUDY[500, 2] = 9
+
+def testFirstScenesAreProcessed(scene):
+    writeScene(scene, noData=100.0)
+    synthesis = L3_Synthesis(scene)
+    product = L3_Product(scene)
+    # no target tile:
+    assert synthesis.canContribute(product) == (True, None)
+    # no row block index, i.e. the mosaic map does not exist yet:
+    writeMosaic(scene, CLEAN, index=False)
+    assert synthesis.canContribute(product) == (True, None)
+
+def testSceneWithoutDataIsSkipped(scene):
+    writeScene(scene, noData=100.0, vegetation=0.0)
+    writeMosaic(scene, CLOUDY)
+    product = L3_Product(scene)
+    synthesis = L3_Synthesis(scene)
+    scene.L3_TILE_ID = None
+    assert synthesis.canContribute(product) == (False, NO_USABLE_PIXELS)
+    # the decision has no side effects:
+    assert scene.L3_TILE_ID is None
+    assert synthesis.product is None
+    assert product.getTableVal('DATE_TIME', L3_TILE_ID) == 0.0
+    # the best value is updated as by the processing of the scene:
+    synthesis.updateBestValues(product)
+    assert scene.L3_TILE_ID == L3_TILE_ID
+    assert product.getTableVal('DATE_TIME') == float32(observationTime())
+
+def testSceneWithoutGoodPixels(scene):
+    writeScene(scene, vegetation=0.0)
+    writeMosaic(scene, CLOUDY)
+    product = L3_Product(scene)
+    # the good pixels of the current scene may become good in a cloudy mosaic, see classifyPixels:
+    assert L3_Synthesis(scene).canContribute(product) == (True, None)
+    assert product.getTableVal('DATE_TIME') == 0.0
+
+def testSceneWithoutGoodPixelsOnCleanMosaicIsSkipped(scene):
+    writeScene(scene, vegetation=0.0)
+    writeMosaic(scene, CLEAN)
+    assert L3_Synthesis(scene).canContribute(L3_Product(scene)) == (False, NO_USABLE_PIXELS)
+
+def testOlderSceneOnCleanMosaicIsSkipped(scene):
+    writeScene(scene)
+    writeMosaic(scene, CLEAN)
+    product = L3_Product(scene)
+    synthesis = L3_Synthesis(scene)
+    # the more recent scene replaces the good pixels of the mosaic:
+    assert synthesis.canContribute(product) == (True, None)
+    # the decision is taken again by the processing:
+    assert product.getTableVal('DATE_TIME') == 0.0
+    product.setTableVal('DATE_TIME', observationTime() + 86400.0)
+    assert synthesis.canContribute(product) == (False, NOT_BETTER)
+    # the best values are not updated by a scene, which is not better:
+    synthesis.updateBestValues(product)
+    assert product.getTableVal('DATE_TIME') == float32(observationTime() + 86400.0)
+    scene.algorithm = 'TEMP_HOMOGENEITY'
+    assert synthesis.canContribute(product) == (True, None)
+
+def testLowerSunOnCleanMosaicIsSkipped(scene):
+    scene.algorithm = 'RADIOMETRIC_QUALITY'
+    scene.radiometricPreference = 'SOLAR_ZENITH'
+    writeScene(scene, sza=30.0)
+    writeMosaic(scene, CLEAN)
+    product = L3_Product(scene)
+    product.setTableVal('SZA_MEAN', 40.0)
+    assert L3_Synthesis(scene).canContribute(product) == (False, NOT_BETTER)
+    product.setTableVal('SZA_MEAN', 20.0)
+    assert L3_Synthesis(scene).canContribute(product) == (True, None)
+
+def testAverageIsAlwaysProcessed(scene):
+    scene.algorithm = 'AVERAGE'
+    writeScene(scene, noData=100.0, vegetation=0.0)
+    writeMosaic(scene, CLEAN)
+    assert L3_Synthesis(scene).canContribute(L3_Product(scene)) == (True, None)
+    # nor are the best values updated for a skipped scene:
+    L3_Synthesis(scene).updateBestValues(L3_Product(scene))
+    assert L3_Product(scene).getTableVal('DATE_TIME') == 0.0
+
+def fullScanIndex(scl, blockRows):
+    ''' The row block index of a scene classification, from a scan of all pixels.
+    '''
+    return array([packbits(in1d(arange(256), scl[rowStart:rowStart + blockRows]))
+                  for rowStart in range(0, scl.shape[0], blockRows)])
+
+def synthesize(scene, tables, name, seed, blockRows, mosaic, cleanRows=0, index=False, bestValues={}):
+    ''' Process a random scene into a random mosaic, with the given row block size.
+        The first rows of the mosaic can be made clean, and the row block index can be stored with the mosaic.
+        The best values of the past are reset to the given values.
+
+        :return: the L3 bands, the tile metadata and the statistics of the product.
+        :rtype: tuple
+
+    '''
+    rs = random.RandomState(seed)
+    scene.L3_TILE_MTD_XML = os.path.join(scene.L3_TARGET_DIR, name + '.xml')
+    with open(scene.L3_TILE_MTD_XML, 'w') as f:
+        f.write(L3_TILE_MTD % L3_TILE_ID)
+    L3_Product(scene).createTable()
+    for key, value in bestValues.items():
+        L3_Product(scene).setTableVal(key, value)
+    tables._imageDatabase = os.path.join(scene.L3_TARGET_DIR, name + '.h5')
+    tables._blockRows = blockRows
+    tables._bandIndex = [1, 2, 3]
+    tables._product = L3_Product(scene)
+    with tables.session():
+        h5file = tables.openDatabase()
+        h5file.create_group('/', 'L2A')
+        h5file.create_group('/', 'L3')
+        for productLevel in ['L2A', 'L3']:
+            for bandIndex in tables.bandIndex:
+                tables.setBand(productLevel, bandIndex, rs.randint(0, 3000, (40, 40)).astype(uint16))
+            # mostly good pixels, with scattered bad ones:
+            scl = where(rs.rand(40, 40) < 0.85, rs.randint(4, 7, (40, 40)), rs.randint(0, 12, (40, 40)))
+            tables.setBand(productLevel, tables.SCL, scl.astype(uint8))
+            tables.setBand(productLevel, tables.AOT, rs.randint(50, 300, (40, 40)).astype(uint16))
+        if mosaic:
+            tables.setBand('L3', tables.MSC, rs.randint(0, 4, (40, 40)).astype(uint8))
+        if cleanRows:
+            scl = tables.getBand('L3', tables.SCL)
+            scl[:cleanRows] = scene.classifier['VEGETATION']
+            tables.setBand('L3', tables.SCL, scl)
+        if index:
+            tables.setBlockIndex(fullScanIndex(tables.getBand('L3', tables.SCL), blockRows))
+        L3_Synthesis(scene).process(tables)
+        bands = [tables.getBand('L3', bandIndex) for bandIndex in tables.bandIndex + [tables.SCL, tables.MSC]]
+        # the index is updated for the next scene:
+        assert array_equal(tables.getBlockIndex(), fullScanIndex(bands[-2], blockRows))
+    with open(scene.L3_TILE_MTD_XML) as f:
+        metadata = f.read()
+    return bands, metadata, L3_Product(scene).getTotals()
+
+@pytest.mark.parametrize('algorithm, medianFilter, mosaic',
+                         itertools.product(['MOST_RECENT', 'TEMP_HOMOGENEITY', 'RADIOMETRIC_QUALITY', 'AVERAGE'],
+                                           [0, 3], [False, True]))
+def testRowBlocksAsWholeTile(scene, tables, algorithm, medianFilter, mosaic):
+    scene.algorithm = algorithm
+    scene.radiometricPreference = 'AEROSOL_OPTICAL_THICKNESS'
+    scene.medianFilter = medianFilter
+    scene.L2A_TILE_MTD_XML = os.path.join(scene.L2A_UP_DIR, 'GRANULE', L2A_TILE_ID, 'MTD_TL.xml')
+    scene.L2A_UP_ID_first = L2A_UP_ID
+    scene.TILE_ID_2A = L2A_TILE_ID
+    writeScene(scene)
+    # the row blocks and the margins of the median filter do not align:
+    bands, metadata, totals = synthesize(scene, tables, 'blocks', 1, 7, mosaic)
+    wholeBands, wholeMetadata, wholeTotals = synthesize(scene, tables, 'whole', 1, 40, mosaic)
+    for band, wholeBand in zip(bands, wholeBands):
+        assert array_equal(band, wholeBand)
+    assert metadata == wholeMetadata
+    assert totals == wholeTotals
+
+@pytest.mark.parametrize('algorithm, medianFilter, isBetter',
+                         itertools.product(['MOST_RECENT', 'TEMP_HOMOGENEITY', 'RADIOMETRIC_QUALITY', 'AVERAGE'],
+                                           [0, 3], [False, True]))
+def testCleanBlocksAsFullScan(scene, tables, algorithm, medianFilter, isBetter):
+    scene.algorithm = algorithm
+    scene.radiometricPreference = 'SOLAR_ZENITH'
+    scene.medianFilter = medianFilter
+    scene.L2A_TILE_MTD_XML = os.path.join(scene.L2A_UP_DIR, 'GRANULE', L2A_TILE_ID, 'MTD_TL.xml')
+    writeScene(scene, sza=30.0)
+    bestValues = {}
+    if not isBetter:
+        # a more recent scene, with a higher sun in the past:
+        bestValues = {'DATE_TIME': observationTime() + 86400.0, 'SZA_MEAN': 40.0}
+    def process(name, index):
+        return synthesize(scene, tables, name, 2, 7, True, cleanRows=22, index=index, bestValues=bestValues)
+    # the clean row blocks are only skipped with the index:
+    bands, metadata, totals = process('indexed', True)
+    scanBands, scanMetadata, scanTotals = process('scanned', False)
+    for band, scanBand in zip(bands, scanBands):
+        assert array_equal(band, scanBand)
+    assert metadata == scanMetadata
+    assert totals == scanTotals
+
+def testCleanBlocksOfIndex(scene):
+    scl = CLEAN.copy()
+    scl[400, 0] = scene.classifier['CLOUD_SHADOWS']
+    synthesis = L3_Synthesis(scene)
+    index = fullScanIndex(scl, 100)
+    expected = array([(scl[rowStart:rowStart + 100] == scene.classifier['VEGETATION']).all()
+                      for rowStart in range(0, 732, 100)])
+    scene.shadowRemoval = True
+    assert array_equal(synthesis.getCleanBlocks(index, 0), expected)
+    # the neighbours within the margin of the median filter:
+    expected[[3, 5]] = False
+    assert array_equal(synthesis.getCleanBlocks(index, 2), expected)
+    # shadows are not removed, thus good:
+    scene.shadowRemoval = False
+    assert synthesis.getCleanBlocks(index, 2).all()
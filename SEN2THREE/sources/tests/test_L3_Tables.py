@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+''' Tests of the database and the export of the bands.
+'''
+
+import os, sys, time, types, struct
+import pytest
+import tables as pytables
+from L3_Tables import L3_Tables, readBlockIndex
+from numpy import *
+
+def readBoxes(filename):
+    ''' Read the top level boxes of a JPEG-2000 file.
+
+        :return: the box IDs and contents.
+        :rtype: list of tuples
+
+    '''
+    boxes = []
+    with open(filename, 'rb') as fp:
+        data = fp.read()
+    offset = 0
+    while offset < len(data):
+        length, boxId = struct.unpack('>I4s', data[offset:offset + 8])
+        if length == 0:
+            length = len(data) - offset
+        boxes.append((boxId, data[offset + 8:offset + length]))
+        offset += length
+    return boxes
+
+def box(boxId, content, length=None):
+    if length is None:
+        length = len(content) + 8
+    return struct.pack('>I4s', length, boxId) + content
+
+class GeoBox(object):
+    ''' The GeoJP2 UUID box, as read by glymur from the L2A band.
+    '''
+    def write(self, fp):
+        fp.write(box('uuid', 'GEOJP2' * 4))
+
+def testGeoJp2Boxes(tables, tmpdir):
+    filename = str(tmpdir.join('band.jp2'))
+    codestream = '\xff\x4f\xff\x51' + 'codestream' * 100 + '\xff\xd9'
+    with open(filename, 'wb') as fp:
+        fp.write(box('jP  ', '\r\n\x87\n'))
+        fp.write(box('ftyp', 'jp2 ' + struct.pack('>I', 0) + 'jp2 '))
+        fp.write(box('jp2h', box('ihdr', '\0' * 14)))
+        # the code stream extends to the end of the file:
+        fp.write(box('jp2c', codestream, length=0))
+    tables._geobox = GeoBox()
+    tables.setGeoJp2Boxes(filename)
+    boxes = readBoxes(filename)
+    # as wrapped by glymur, the geobox precedes the code stream:
+    assert [boxId for boxId, _ in boxes] == ['jP  ', 'ftyp', 'jp2h', 'uuid', 'jp2c']
+    assert boxes[1][1] == 'jpx ' + struct.pack('>I', 0) + 'jpxb' + 'jp2 '
+    assert boxes[3][1] == 'GEOJP2' * 4
+    assert boxes[4][1] == codestream
+    assert not tmpdir.join('band_geo.jp2').exists()
+
+def testMigrationKeepsAttributes(tables):
+    scl = arange(732 * 8, dtype=uint8).reshape(732, 8) % 12
+    h5file = pytables.open_file(tables._imageDatabase, mode='w')
+    h5file.create_group('/', 'L2A')
+    h5file.create_group('/', 'L3')
+    # a database of a previous version, uncompressed:
+    node = h5file.create_array('/L3', 'SCL', scl)
+    node._v_attrs.BLOCK_ROWS = 366
+    node._v_attrs.BLOCK_INDEX = ones((2, 32), dtype=uint8)
+    h5file.root.L3._v_attrs.TOTALS_60 = arange(5, dtype=int64)
+    h5file.close()
+
+    assert tables.migrateDatabase()
+    h5file = pytables.open_file(tables._imageDatabase, mode='r')
+    try:
+        node = h5file.get_node('/L3', 'SCL')
+        assert node.filters == tables.getFilters()
+        assert (node.read() == scl).all()
+        assert node._v_attrs.BLOCK_ROWS == 366
+        assert (node._v_attrs.BLOCK_INDEX == ones((2, 32), dtype=uint8)).all()
+        assert (h5file.root.L3._v_attrs.TOTALS_60 == arange(5)).all()
+    finally:
+        h5file.close()
+    # the migrated database is up to date:
+    assert not tables.migrateDatabase()
+
+def testBandSizeAsFullRead(tables):
+    rs = random.RandomState(0)
+    bands = [('L2A', tables.B02, rs.randint(0, 10000, (61, 37)).astype(uint16)),
+             ('L2A', tables.AOT, rs.randint(0, 1000, (61, 37)).astype(uint16)),
+             ('L3', tables.SCL, rs.randint(0, 12, (61, 37)).astype(uint8)),
+             ('L3', tables.MSC, rs.randint(0, 200, (61, 37)).astype(uint8))]
+    # a database of a previous version, with uncompressed arrays:
+    h5file = pytables.open_file(tables._imageDatabase, mode='w')
+    h5file.create_group('/', 'L2A')
+    h5file.create_group('/', 'L3')
+    for productLevel, bandIndex, band in bands[:2]:
+        h5file.create_array('/' + productLevel, tables.getBandNameFromIndex(bandIndex), band)
+    h5file.close()
+
+    def fullRead(productLevel, bandIndex):
+        # as answered before from the band data:
+        node = tables.openDatabase().get_node('/' + productLevel, tables.getBandNameFromIndex(bandIndex))
+        arr = node.read()
+        return (arr.shape[0], arr.shape[1]), node.dtype
+
+    with tables.session():
+        for productLevel, bandIndex, band in bands[2:]:
+            tables.setBand(productLevel, bandIndex, band)
+        for productLevel, bandIndex, band in bands:
+            answer = (tables.getBandSize(productLevel, bandIndex), tables.getDataType(productLevel, bandIndex))
+            assert answer == fullRead(productLevel, bandIndex) == (band.shape, band.dtype)
+        assert tables.getBandSize('L3', tables.B02) is False
+        assert tables.getDataType('L3', tables.B02) is False
+    # and the same answers after the migration of the database:
+    assert tables.migrateDatabase()
+    with tables.session():
+        for productLevel, bandIndex, band in bands:
+            answer = (tables.getBandSize(productLevel, bandIndex), tables.getDataType(productLevel, bandIndex))
+            assert answer == fullRead(productLevel, bandIndex) == (band.shape, band.dtype)
+
+def testExportWithoutBands(tables):
+    tables.config.nrThreads = 4
+    tables.exportBands('L3', [])
+
+def createBands(tables, scl, msc):
+    h5file = tables.openDatabase()
+    h5file.create_group('/', 'L2A')
+    h5file.create_group('/', 'L3')
+    tables.setBand('L3', tables.SCL, scl)
+    tables.setBand('L3', tables.MSC, msc)
+
+def testClassHistogramAsFullScan(tables):
+    rs = random.RandomState(0)
+    scl = rs.randint(0, 12, (50, 30)).astype(uint8)
+    msc = rs.randint(0, 200, (50, 30)).astype(uint8)
+    tables._blockRows = 7
+    with tables.session():
+        createBands(tables, scl, msc)
+        for bandIndex, band in [(tables.SCL, scl), (tables.MSC, msc)]:
+            values, counts = unique(band, return_counts=True)
+            expected = zeros(256, dtype=int64)
+            expected[values] = counts
+            assert array_equal(tables.getClassHistogram('L3', bandIndex), expected)
+
+def testBlockIndexOfSceneClassification(tables):
+    scl = random.RandomState(0).randint(0, 12, (50, 30)).astype(uint8)
+    tables._blockRows = 7
+    index = array([packbits(bincount(scl[rowStart:rowStart + 7].ravel(), minlength=256) > 0)
+                   for rowStart in range(0, 50, 7)])
+    with tables.session():
+        createBands(tables, scl, scl)
+        assert tables.getBlockIndex() is False
+        tables.setBlockIndex(index)
+        assert array_equal(tables.getBlockIndex(), index)
+        # the index is kept with the database:
+        tables.closeDatabase()
+        assert array_equal(readBlockIndex(tables._imageDatabase, 7), index)
+        # an index of other row blocks does not match:
+        assert readBlockIndex(tables._imageDatabase, 10) is False
+        tables._blockRows = 10
+        assert tables.getBlockIndex() is False
+        # a replaced scene classification has no index:
+        tables._blockRows = 7
+        tables.setBand('L3', tables.SCL, scl)
+        assert tables.getBlockIndex() is False
+
+def testOnlyBandsOfOtherResolutionsAreShared(tables, monkeypatch):
+    decoded = []
+    class Jp2k(object):
+        ''' A band of 12 x 12 pixels, as decoded by glymur.
+        '''
+        def __init__(self, filename):
+            self.filename = filename
+        def __getitem__(self, index):
+            decoded.append(self.filename)
+            return arange(144, dtype=uint16).reshape(12, 12)[index]
+    monkeypatch.setitem(sys.modules, 'glymur', types.ModuleType('glymur'))
+    sys.modules['glymur'].Jp2k = Jp2k
+    tables._config.singlePass = True
+    try:
+        # the native 60m band is decoded, but not kept:
+        tables.decodeBand(tables.SCL, 'SCL_60m.jp2')
+        assert decoded == ['SCL_60m.jp2']
+        assert L3_Tables._sharedBands == {}
+        # the 20m band derived for 60m is kept for 20m and 10m:
+        scl = tables.decodeBand(tables.SCL, 'SCL_20m.jp2', 3)[1]
+        assert scl.shape == (4, 4)
+        for resolution in [20, 10]:
+            tables._resolution = resolution
+            assert tables.decodeBand(tables.SCL, 'SCL_20m.jp2')[1].shape == (12, 12)
+        assert decoded == ['SCL_60m.jp2', 'SCL_20m.jp2']
+        assert list(L3_Tables._sharedBands) == ['SCL_20m.jp2']
+    finally:
+        tables.releaseSharedBands()
+        tables._config.singlePass = False
+
+@pytest.fixture
+def jp2files(monkeypatch):
+    ''' The JPEG-2000 files read by glymur, replaced by arrays. As by glymur, a step of the slices
+        selects a reduced resolution level, the start and stop of the slices are full resolution rows.
+
+        :return: the pixel data by file name.
+        :rtype: dict
+
+    '''
+    files = {}
+    class Jp2k(object):
+        def __init__(self, filename):
+            self._data = files[filename]
+            self.shape = self._data.shape
+            self.box = [None, None, None, ('geobox', filename)]
+        def __getitem__(self, index):
+            return self._data[index].copy()
+    glymur = types.ModuleType('glymur')
+    glymur.Jp2k = Jp2k
+    monkeypatch.setitem(sys.modules, 'glymur', glymur)
+    return files
+
+def testReduceBandAsMean(tables):
+    band = random.RandomState(0).randint(0, 10000, (13, 11)).astype(uint16)
+    assert tables.reduceBand(band, 1) is band
+    reduced = tables.reduceBand(band, 3)
+    # incomplete blocks at the lower and right border are dropped:
+    assert reduced.shape == (4, 3)
+    assert reduced.dtype == uint16
+    for row in range(4):
+        for col in range(3):
+            block = band[row * 3:row * 3 + 3, col * 3:col * 3 + 3]
+            assert reduced[row, col] == int(block.mean() + 0.5)
+
+@pytest.mark.parametrize('bandDerivation, factor, steps', [
+    ('NONE', 2, (1, 2)), ('NONE', 3, (1, 3)), ('NONE', 6, (1, 6)),
+    ('AVERAGE', 2, (1, 2)), ('AVERAGE', 3, (1, 3)), ('AVERAGE', 6, (1, 6)),
+    ('WAVELET', 2, (2, 1)), ('WAVELET', 3, (1, 3)), ('WAVELET', 6, (2, 3))])
+def testDecodingSteps(tables, bandDerivation, factor, steps):
+    tables._config.bandDerivation = bandDerivation
+    assert tables.getDecodingSteps(factor) == steps
+
+@pytest.mark.parametrize('bandDerivation', ['AVERAGE', 'WAVELET'])
+@pytest.mark.parametrize('factor', [1, 2, 3, 6])
+@pytest.mark.parametrize('size', [(36, 24), (37, 29)])
+def testHeaderSizeAsDecodedSize(tables, jp2files, bandDerivation, factor, size):
+    jp2files['B02.jp2'] = random.RandomState(0).randint(0, 10000, size).astype(uint16)
+    tables._config.bandDerivation = bandDerivation
+    shape, geobox = tables.readBandHeader(tables.B02, 'B02.jp2', factor)
+    bandIndex, band, decodedGeobox = tables.decodeBand(tables.B02, 'B02.jp2', factor)
+    assert band.shape == shape
+    # the geobox of a finer resolution is not applicable:
+    assert geobox == decodedGeobox == (('geobox', 'B02.jp2') if factor == 1 else None)
+
+def testDerivedBandsOfSameSize(tables, jp2files):
+    # the sizes of a tile in 20m and 60m:
+    scl = random.RandomState(0).randint(0, 12, (54, 54)).astype(uint8)
+    jp2files['SCL_20m.jp2'] = scl
+    jp2files['B02_20m.jp2'] = scl.astype(uint16)
+    tables._config.bandDerivation = 'AVERAGE'
+    # the scene classification is subsampled, not averaged:
+    derived = tables.decodeBand(tables.SCL, 'SCL_20m.jp2', 3)[1]
+    assert array_equal(derived, scl[1::3, 1::3])
+    assert derived.shape == tables.decodeBand(tables.B02, 'B02_20m.jp2', 3)[1].shape == (18, 18)
+
+@pytest.mark.parametrize('bandDerivation', ['AVERAGE', 'WAVELET'])
+@pytest.mark.parametrize('factor', [1, 2, 3, 6])
+def testBandBlocksAsWholeBand(tables, jp2files, bandDerivation, factor):
+    jp2files['B02.jp2'] = random.RandomState(0).randint(0, 10000, (12 * factor, 10 * factor)).astype(uint16)
+    tables._config.bandDerivation = bandDerivation
+    band = tables.decodeBand(tables.B02, 'B02.jp2', factor)[1]
+    windows = [(0, 3), (5, 6), (8, 12)]
+    bandIndex, blocks = tables.decodeBandBlocks(tables.B02, 'B02.jp2', factor, windows)
+    assert bandIndex == tables.B02
+    assert [rowStart for rowStart, _ in blocks] == [0, 5, 8]
+    for (rowStart, rowStop), (_, block) in zip(windows, blocks):
+        assert array_equal(block, band[rowStart:rowStop])
+
+def testFinerBandFile(tables, tmpdir):
+    imgData = tmpdir.mkdir('IMG_DATA')
+    tables._L2A_bandDir = str(imgData.mkdir('R60m'))
+    assert tables.getFinerBandFile('T*_B02_??m.jp2') == (None, 0)
+    imgData.mkdir('R10m').join('T32TPS_B02_10m.jp2').write('')
+    assert tables.getFinerBandFile('T*_B02_??m.jp2') == (str(imgData.join('R10m', 'T32TPS_B02_10m.jp2')), 6)
+    # the closest resolution is preferred:
+    imgData.mkdir('R20m').join('T32TPS_B02_20m.jp2').write('')
+    assert tables.getFinerBandFile('T*_B02_??m.jp2') == (str(imgData.join('R20m', 'T32TPS_B02_20m.jp2')), 3)
+    assert tables.getFinerBandFile('T*_B05_??m.jp2') == (None, 0)
+    tables._resolution = 20
+    tables._L2A_bandDir = str(imgData.join('R20m'))
+    assert tables.getFinerBandFile('T*_B02_??m.jp2') == (str(imgData.join('R10m', 'T32TPS_B02_10m.jp2')), 2)
+
+def importBands(tables, jobs, nrThreads):
+    ''' Import bands into a new database.
+
+        :return: the imported bands by band index and the geobox.
+        :rtype: tuple
+
+    '''
+    if os.path.exists(tables._imageDatabase):
+        os.remove(tables._imageDatabase)
+    tables._geobox = None
+    tables._config.nrThreads = nrThreads
+    with tables.session():
+        tables.initDatabase()
+        assert tables.importBands(jobs)
+        return dict((bandIndex, tables.getBand('L2A', bandIndex)) for bandIndex, _, _ in jobs), tables._geobox
+
+def testConcurrentImportAsSequential(tables, jp2files, monkeypatch):
+    # the up sampling of the 10m scene classification is not used:
+    monkeypatch.setitem(sys.modules, 'skimage', types.ModuleType('skimage'))
+    monkeypatch.setitem(sys.modules, 'skimage.transform', types.ModuleType('skimage.transform'))
+    sys.modules['skimage.transform'].resize = None
+    # the first band of the list is decoded last by the threads:
+    Jp2k = sys.modules['glymur'].Jp2k
+    class SlowJp2k(Jp2k):
+        def __getitem__(self, index):
+            time.sleep(delays[self._filename])
+            return Jp2k.__getitem__(self, index)
+        def __init__(self, filename):
+            Jp2k.__init__(self, filename)
+            self._filename = filename
+    monkeypatch.setattr(sys.modules['glymur'], 'Jp2k', SlowJp2k)
+
+    rs = random.RandomState(0)
+    jobs = []
+    delays = {}
+    for bandIndex in tables._bandIndex:
+        filename = 'B%02d_60m.jp2' % bandIndex
+        jp2files[filename] = rs.randint(0, 10000, (30, 24)).astype(uint16)
+        jobs.append((bandIndex, filename, 1))
+    # a band derived from 20m:
+    jp2files['AOT_20m.jp2'] = rs.randint(0, 1000, (90, 72)).astype(uint16)
+    jobs.append((tables.AOT, 'AOT_20m.jp2', 3))
+    jp2files['SCL_60m.jp2'] = rs.randint(0, 12, (30, 24)).astype(uint8)
+    jobs.append((tables.SCL, 'SCL_60m.jp2', 1))
+    for _, filename, _ in jobs:
+        delays[filename] = 0.0
+    delays[jobs[0][1]] = 0.05
+    tables._productLevel = 'L2A'
+
+    sequential, sequentialGeobox = importBands(tables, jobs, 1)
+    concurrent, concurrentGeobox = importBands(tables, jobs, 4)
+    assert sorted(concurrent) == sorted(sequential)
+    for bandIndex in sequential:
+        assert concurrent[bandIndex].dtype == sequential[bandIndex].dtype
+        assert array_equal(concurrent[bandIndex], sequential[bandIndex])
+    assert array_equal(sequential[tables.SCL], jp2files['SCL_60m.jp2'])
+    # the geobox of the last band with a geobox in the list is kept:
+    assert concurrentGeobox == sequentialGeobox == ('geobox', 'B05_60m.jp2')
+
+@pytest.mark.parametrize('bandDerivation', ['AVERAGE', 'WAVELET'])
+def testHeaderSizeOfEncodedBand(tables, tmpdir, bandDerivation):
+    glymur = pytest.importorskip('glymur')
+    if glymur.lib.openjp2.OPENJP2 is None:
+        pytest.skip('the openjpeg library is not available')
+    filename = str(tmpdir.join('B02.jp2'))
+    glymur.Jp2k(filename, random.RandomState(0).randint(0, 10000, (67, 50)).astype(uint16))
+    tables._config.bandDerivation = bandDerivation
+    for factor in [2, 3, 6]:
+        shape, _ = tables.readBandHeader(tables.B02, filename, factor)
+        assert tables.decodeBand(tables.B02, filename, factor)[1].shape == shape
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+''' Tests of the metadata cache and the metadata sessions.
+'''
+
+import os, time
+import pytest
+from L3_XmlParser import L3_XmlParser, metadataSession
+
+TILE_MTD = '''<?xml version="1.0"  encoding="UTF-8"?>
+<Level-3_Tile_ID>
+  <General_Info><TILE_ID>%s</TILE_ID></General_Info>
+</Level-3_Tile_ID>
+'''
+
+TILE_SCHEME = '''<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:element name="Level-3_Tile_ID">
+    <xs:complexType><xs:sequence>
+      <xs:element name="General_Info">
+        <xs:complexType><xs:sequence>
+          <xs:element name="TILE_ID" type="xs:string"/>
+        </xs:sequence></xs:complexType>
+      </xs:element>
+    </xs:sequence></xs:complexType>
+  </xs:element>
+</xs:schema>
+'''
+
+@pytest.fixture
+def metadata(config, tmpdir):
+    ''' The tile metadata of the target product.
+
+        :return: the config object, with the file name of the tile metadata.
+        :rtype: L3_Config
+
+    '''
+    config.L3_TILE_MTD_XML = str(tmpdir.join('MTD_TL.xml'))
+    writeMetadata(config, 'T32TPS')
+    return config
+
+def writeMetadata(config, tileId):
+    ''' Replace the tile metadata by other means than the parser.
+    '''
+    fn = config.L3_TILE_MTD_XML
+    mtime = os.path.getmtime(fn) if os.path.exists(fn) else time.time()
+    with open(fn, 'w') as f:
+        f.write(TILE_MTD % tileId)
+    # the cache is validated by modification time and size of the file:
+    os.utime(fn, (mtime + 1, mtime + 1))
+
+def tileId(config):
+    return L3_XmlParser(config, 'T03').getTree('General_Info', 'TILE_ID').text
+
+def testParsersHaveOwnTrees(metadata):
+    xp = L3_XmlParser(metadata, 'T03')
+    other = L3_XmlParser(metadata, 'T03')
+    assert xp.getRoot() is not other.getRoot()
+    # a change is not visible before the export:
+    xp.getTree('General_Info', 'TILE_ID')._setText('T32TQS')
+    assert other.getTree('General_Info', 'TILE_ID').text == 'T32TPS'
+    assert tileId(metadata) == 'T32TPS'
+    xp.export()
+    assert tileId(metadata) == 'T32TQS'
+
+def testReplacedFileIsParsedAgain(metadata):
+    assert tileId(metadata) == 'T32TPS'
+    writeMetadata(metadata, 'T32UPU')
+    assert tileId(metadata) == 'T32UPU'
+
+def testSchemaIsCompiledOnce(metadata, tmpdir):
+    metadata.configDir = str(tmpdir)
+    metadata.tileScheme3 = 'tile.xsd'
+    tmpdir.join('tile.xsd').write(TILE_SCHEME)
+    xp = L3_XmlParser(metadata, 'T03')
+    assert xp.validate()
+    schema = xp.getSchema()
+    # the scheme is compiled for the lifetime of the process:
+    tmpdir.join('tile.xsd').remove()
+    xp = L3_XmlParser(metadata, 'T03')
+    assert xp.getSchema() is schema
+    assert xp.validate()
+    xp.getRoot().General_Info.addattr('UNKNOWN', 'value')
+    xp.export()
+    assert not L3_XmlParser(metadata, 'T03').validate()
+
+def setTileId(config, tileId):
+    xp = L3_XmlParser(config, 'T03')
+    xp.getTree('General_Info', 'TILE_ID')._setText(tileId)
+    xp.export()
+
+def readFile(config):
+    with open(config.L3_TILE_MTD_XML) as f:
+        return f.read()
+
+def testExportIsDeferredInSession(metadata):
+    original = readFile(metadata)
+    with metadataSession(['T03']):
+        setTileId(metadata, 'T32TQS')
+        assert readFile(metadata) == original
+        # the parsers of the session see the exported tree:
+        assert tileId(metadata) == 'T32TQS'
+        setTileId(metadata, 'T32UPU')
+        # a nested session joins the active one:
+        with metadataSession(['T2A']):
+            setTileId(metadata, 'T32UQU')
+        assert readFile(metadata) == original
+    assert 'T32UQU' in readFile(metadata)
+    L3_XmlParser._treeCache.clear()
+    assert tileId(metadata) == 'T32UQU'
+
+def testOtherDocumentsAreExported(metadata):
+    with metadataSession(['T2A']):
+        setTileId(metadata, 'T32TQS')
+        assert 'T32TQS' in readFile(metadata)
+
+def testValidationFlushesPendingExport(metadata, tmpdir):
+    metadata.configDir = str(tmpdir)
+    metadata.tileScheme3 = 'tile.xsd'
+    tmpdir.join('tile.xsd').write(TILE_SCHEME)
+    with metadataSession(['T03']):
+        setTileId(metadata, 'T32TQS')
+        assert L3_XmlParser(metadata, 'T03').validate()
+        assert 'T32TQS' in readFile(metadata)
+
+def testReplacementAfterDeferredExportIsKept(metadata, caplog):
+    with metadataSession(['T03']):
+        setTileId(metadata, 'T32TQS')
+        writeMetadata(metadata, 'T32UPU')
+    assert 'T32UPU' in readFile(metadata)
+    assert 'pending changes are discarded' in caplog.text